@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+
+def batch_by_padded_size(
+    indices: np.ndarray,
+    src_sizes: np.ndarray,
+    tgt_sizes: Optional[np.ndarray] = None,
+    max_tokens: Optional[int] = None,
+    max_sentences: Optional[int] = None,
+    max_pad_ratio: float = 1.0,
+    required_batch_size_multiple: int = 1,
+) -> List[np.ndarray]:
+    """Packs `indices` into batches whose padded size stays within budget.
+
+    Examples are sorted by (source, target) length, so that examples of
+    similar lengths share batches. A batch is closed before it exceeds
+    `max_tokens` padded tokens, i.e. batch size times the length of its
+    longest source or target, or `max_sentences` examples, or before the
+    fraction of pad among its source and target tokens exceeds
+    `max_pad_ratio`.
+
+    Returns:
+        List of int64 arrays of example indices, in order of length. Batches
+        are meant to be shuffled as a whole (see EpochBatchIterator).
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    src_sizes = np.asarray(src_sizes, dtype=np.int64)
+    tgt_sizes = (
+        np.zeros_like(src_sizes)
+        if tgt_sizes is None
+        else np.asarray(tgt_sizes, dtype=np.int64)
+    )
+    max_tokens = max_tokens if max_tokens is not None else float("inf")
+    max_sentences = max_sentences if max_sentences is not None else float("inf")
+    bsz_mult = required_batch_size_multiple
+
+    # np.lexsort sorts by the last key first.
+    indices = indices[np.lexsort((tgt_sizes[indices], src_sizes[indices]))]
+    src_lengths = src_sizes[indices].tolist()
+    tgt_lengths = tgt_sizes[indices].tolist()
+
+    batches = []
+    start = 0
+    max_src = max_tgt = num_real = 0
+    for end, (src_len, tgt_len) in enumerate(zip(src_lengths, tgt_lengths)):
+        new_max_src = max(max_src, src_len)
+        new_max_tgt = max(max_tgt, tgt_len)
+        new_num_real = num_real + src_len + tgt_len
+        bsz = end - start + 1
+        num_padded = bsz * (new_max_src + new_max_tgt)
+        if end > start and (
+            bsz > max_sentences
+            or bsz * max(new_max_src, new_max_tgt) > max_tokens
+            or (num_padded > 0 and 1 - new_num_real / num_padded > max_pad_ratio)
+        ):
+            # Round the batch down to a multiple of bsz_mult if possible, and
+            # start the next batch with the remainder.
+            batch_len = end - start
+            mod_len = max(bsz_mult * (batch_len // bsz_mult), batch_len % bsz_mult)
+            batches.append(indices[start : start + mod_len])
+            start += mod_len
+            max_src = max(src_lengths[start : end + 1])
+            max_tgt = max(tgt_lengths[start : end + 1])
+            num_real = sum(src_lengths[start : end + 1]) + sum(
+                tgt_lengths[start : end + 1]
+            )
+        else:
+            max_src, max_tgt, num_real = new_max_src, new_max_tgt, new_num_real
+    if start < len(indices):
+        batches.append(indices[start:])
+    return batches
+
+
+def batch_by_group(
+    indices: np.ndarray,
+    groups: np.ndarray,
+    batch_fn: Callable[[np.ndarray], Sequence[Sequence[int]]],
+) -> List[Sequence[int]]:
+    """Batches the examples of each group separately with `batch_fn`, so that
+    every batch holds examples of a single group. `groups` has the group of
+    each example of the dataset; the order of `indices` is kept within each
+    group."""
+    indices = np.asarray(indices, dtype=np.int64)
+    index_groups = np.asarray(groups)[indices]
+    batches = []
+    for group in np.unique(index_groups):
+        batches.extend(batch_fn(indices[index_groups == group]))
+    return batches
+
+
+def pad_efficiency(batches: Sequence[Sequence[int]], sizes: np.ndarray) -> float:
+    """Fraction of the padded tokens of `batches` which are real tokens, if
+    each batch is padded to the length of its longest example."""
+    batches = [batch for batch in batches if len(batch) > 0]
+    if len(batches) == 0:
+        return 1.0
+    batch_sizes = np.array([len(batch) for batch in batches], dtype=np.int64)
+    lengths = np.asarray(sizes, dtype=np.int64)[
+        np.concatenate([np.asarray(batch, dtype=np.int64) for batch in batches])
+    ]
+    batch_starts = np.concatenate([[0], np.cumsum(batch_sizes)[:-1]])
+    num_padded = int((np.maximum.reduceat(lengths, batch_starts) * batch_sizes).sum())
+    if num_padded == 0:
+        return 1.0
+    return float(lengths.sum()) / num_padded
@@ -3,6 +3,7 @@
 import math
 
 import torch
+import torch.nn.functional as F
 from fairseq import utils
 from fairseq.models import FairseqIncrementalDecoder
 
@@ -24,6 +25,7 @@ class SequenceGenerator(torch.nn.Module):
         word_reward=0,
         model_weights=None,
         use_char_source=False,
+        need_attn=True,
     ):
         """Generates translations of a given source sentence.
 
@@ -43,6 +45,10 @@ class SequenceGenerator(torch.nn.Module):
                 `models` with ensemble interpolation weights.
             use_char_source: if True, encoder inputs consist of (src_tokens,
                 src_lengths, char_inds, word_lengths)
+            need_attn: if False, the attention of the hypotheses is neither
+                kept nor returned, and their "attention" and "alignment" are
+                None. The models may then skip computing it (see
+                make_generation_fast_()).
         """
         self.models = models
         self.pad = tgt_dict.pad()
@@ -69,6 +75,7 @@ class SequenceGenerator(torch.nn.Module):
         else:
             self.model_weights = [1.0 / len(models)] * len(models)
         self.use_char_source = use_char_source
+        self.need_attn = need_attn
 
     def cuda(self):
         for model in self.models:
@@ -150,17 +157,14 @@ class SequenceGenerator(torch.nn.Module):
             beam_size < self.vocab_size
         ), "Beam size must be smaller than target vocabulary"
 
+        encoder_inputs = self._get_encoder_inputs(encoder_input)
+        if beam_size == 1 and self.stop_early:
+            # greedy search
+            return self._generate_without_beam(
+                encoder_inputs, bsz, 1, maxlen, prefix_tokens, self.need_attn
+            )
         # Encode, expanding outputs for each example beam_size times
         reorder_indices = torch.arange(bsz).view(-1, 1).repeat(1, beam_size).view(-1)
-        if self.use_char_source:
-            encoder_inputs = (
-                encoder_input["src_tokens"],
-                encoder_input["src_lengths"],
-                encoder_input["char_inds"],
-                encoder_input["word_lengths"],
-            )
-        else:
-            encoder_inputs = (encoder_input["src_tokens"], encoder_input["src_lengths"])
         encoder_outs, incremental_states = self._encode(
             encoder_input=encoder_inputs,
             reorder_indices=reorder_indices.type_as(src_tokens),
@@ -183,14 +187,25 @@ class SequenceGenerator(torch.nn.Module):
             else:
                 src_encoding_len = encoder_outs[0]["encoder_out"].size(0)
 
-        attn = scores.new(bsz * beam_size, src_encoding_len, maxlen + 2)
-        attn_buf = attn.clone()
-
-        # list of completed sentences
-        finalized = [[] for i in range(bsz)]
-        finished = [False for i in range(bsz)]
-        worst_finalized = [{"idx": None, "score": -math.inf} for i in range(bsz)]
-        num_remaining_sent = bsz
+        attn, attn_buf = None, None
+        if self.need_attn:
+            attn = scores.new(bsz * beam_size, src_encoding_len, maxlen + 2)
+            attn_buf = attn.clone()
+
+        # Finalized hypotheses are stored in tensors, up to beam_size per
+        # sentence in the order they are finalized, and only turned into
+        # dicts at the end. A hypothesis finalized at step t has t + 1 tokens,
+        # the last of which is EOS.
+        num_finalized = tokens.new_zeros(bsz)
+        finalized_tokens = tokens.new(bsz, beam_size, maxlen + 1).fill_(self.pad)
+        finalized_lens = tokens.new_zeros(bsz, beam_size)
+        finalized_scores = scores.new(bsz, beam_size).fill_(-math.inf)
+        finalized_pos_scores = scores.new_zeros(bsz, beam_size, maxlen + 1)
+        finalized_attn = None
+        if self.need_attn:
+            finalized_attn = scores.new_zeros(
+                bsz, beam_size, src_encoding_len, maxlen + 1
+            )
 
         # number of candidate hypos per step
         cand_size = 2 * beam_size  # 2 x beam size in case half are EOS
@@ -198,6 +213,10 @@ class SequenceGenerator(torch.nn.Module):
         # offset arrays for converting between different indexing schemes
         bbsz_offsets = (torch.arange(0, bsz) * beam_size).unsqueeze(1).type_as(tokens)
         cand_offsets = torch.arange(0, cand_size).type_as(tokens)
+        # Finished sentences are removed from the batch, so bsz is the number
+        # of unfinished sentences, and sent_idx maps them to their position in
+        # the input batch (which indexes the finalized hypotheses).
+        sent_idx = torch.arange(0, bsz).unsqueeze(1).type_as(tokens)
 
         # helper function for allocating buffers on the fly
         buffers = {}
@@ -207,102 +226,124 @@ class SequenceGenerator(torch.nn.Module):
                 buffers[name] = type_of.new()
             return buffers[name]
 
-        def is_finished(sent, step, unfinalized_scores=None):
-            """
-            Check whether we've finished generation for a given sentence, by
-            comparing the worst score among finalized hypotheses to the best
-            possible score among unfinalized hypotheses.
-            """
-            assert len(finalized[sent]) <= beam_size
-            if len(finalized[sent]) == beam_size:
-                if self.stop_early or step == maxlen or unfinalized_scores is None:
-                    return True
-                # stop if the best unfinalized score is worse than the worst
-                # finalized one
-                best_unfinalized_score = unfinalized_scores[sent].max()
-                if self.normalize_scores:
-                    best_unfinalized_score /= (maxlen + 1) ** self.len_penalty
-                if worst_finalized[sent]["score"] >= best_unfinalized_score:
-                    return True
-            return False
+        def store_hypos(step, sents, slots, bbsz_idx, eos_scores, norm_scores):
+            """Stores the hypotheses bbsz_idx ending with EOS at this step in
+            the given slots of the finalized hypotheses of sentences sents."""
+            hypo_tokens = tokens[bbsz_idx, 1 : step + 2]  # skip the first EOS
+            hypo_tokens[:, step] = self.eos
+            finalized_tokens[sents, slots, : step + 1] = hypo_tokens
+            if finalized_attn is not None:
+                finalized_attn[sents, slots, :, : step + 1] = attn[
+                    bbsz_idx, :, 1 : step + 2
+                ]
+            # convert from cumulative to per-position scores
+            pos_scores = scores[bbsz_idx, : step + 1]
+            pos_scores[:, step] = eos_scores
+            pos_scores[:, 1:] = pos_scores[:, 1:] - pos_scores[:, :-1]
+            finalized_pos_scores[sents, slots, : step + 1] = pos_scores.type_as(
+                finalized_pos_scores
+            )
+            finalized_scores[sents, slots] = norm_scores.type_as(finalized_scores)
+            finalized_lens[sents, slots] = step + 1
 
-        def finalize_hypos(step, bbsz_idx, eos_scores, unfinalized_scores=None):
+        def finalize_hypos(step, bbsz_idx, eos_scores, mask, unfinalized_scores=None):
             """
             Finalize the given hypotheses at this step, while keeping the total
             number of finalized hypotheses per sentence <= beam_size.
 
-            Note: the input must be in the desired finalization order, so that
-            hypotheses that appear earlier in the input are preferred to those
-            that appear later.
+            Note: hypotheses that appear earlier in a row of the input are
+            preferred to those that appear later.
 
             Args:
                 step: current time step
-                bbsz_idx: A vector of indices in the range [0, bsz*beam_size),
-                    indicating which hypotheses to finalize
-                eos_scores: A vector of the same size as bbsz_idx containing
-                    scores for each hypothesis
-                unfinalized_scores: A vector containing scores for all
-                    unfinalized hypotheses
+                bbsz_idx: A [bsz, n] tensor of indices in the range
+                    [0, bsz*beam_size) of hypotheses of each sentence
+                eos_scores: A [bsz, n] tensor of the scores of the hypotheses
+                mask: A [bsz, n] mask of the hypotheses to finalize
+                unfinalized_scores: A [bsz, cand_size] tensor of the scores of
+                    the unfinalized hypotheses
+
+            Returns:
+                A [bsz] mask of the sentences which are finished.
             """
-            assert bbsz_idx.numel() == eos_scores.numel()
-
-            # clone relevant token and attention tensors
-            tokens_clone = tokens.index_select(0, bbsz_idx)
-            tokens_clone = tokens_clone[
-                :, 1 : step + 2
-            ]  # skip the first index, which is EOS
-            tokens_clone[:, step] = self.eos
-            attn_clone = attn.index_select(0, bbsz_idx)[:, :, 1 : step + 2]
-
-            # compute scores per token position
-            pos_scores = scores.index_select(0, bbsz_idx)[:, : step + 1]
-            pos_scores[:, step] = eos_scores
-            # convert from cumulative to per-position scores
-            pos_scores[:, 1:] = pos_scores[:, 1:] - pos_scores[:, :-1]
-
-            # normalize sentence-level scores
+            sents = sent_idx.view(-1)
+            norm_scores = eos_scores
             if self.normalize_scores:
-                eos_scores /= (step + 1) ** self.len_penalty
-
-            sents_seen = set()
-            for i, (idx, score) in enumerate(
-                zip(bbsz_idx.tolist(), eos_scores.tolist())
-            ):
-                sent = idx // beam_size
-                sents_seen.add(sent)
-
-                def get_hypo():
-                    _, alignment = attn_clone[i].max(dim=0)
-                    return {
-                        "tokens": tokens_clone[i],
-                        "score": score,
-                        "attention": attn_clone[i],  # src_len x tgt_len
-                        "alignment": alignment,
-                        "positional_scores": pos_scores[i],
-                    }
-
-                if len(finalized[sent]) < beam_size:
-                    finalized[sent].append(get_hypo())
-                elif not self.stop_early and score > worst_finalized[sent]["score"]:
-                    # replace worst hypo for this sentence with new/better one
-                    worst_idx = worst_finalized[sent]["idx"]
-                    if worst_idx is not None:
-                        finalized[sent][worst_idx] = get_hypo()
-
-                    # find new worst finalized hypo for this sentence
-                    idx, s = min(
-                        enumerate(finalized[sent]), key=lambda r: r[1]["score"]
-                    )
-                    worst_finalized[sent] = {"score": s["score"], "idx": idx}
+                norm_scores = eos_scores / (step + 1) ** self.len_penalty
+
+            # append hypotheses to sentences with fewer than beam_size
+            slots = num_finalized[sents].unsqueeze(1) + mask.long().cumsum(dim=1) - 1
+            append = mask & slots.lt(beam_size)
+            rows = sent_idx.expand_as(slots)
+            store_hypos(
+                step,
+                rows[append],
+                slots[append],
+                bbsz_idx[append],
+                eos_scores[append],
+                norm_scores[append],
+            )
+            num_finalized.index_add_(0, sents, append.long().sum(dim=1))
+
+            overflow = mask & slots.ge(beam_size)
+            if not self.stop_early and bool(overflow.any()):
+                # Keep the beam_size best of the finalized and overflowing
+                # hypotheses. On equal scores, finalized hypotheses and then
+                # earlier ones are preferred. Dropped finalized hypotheses are
+                # replaced by kept overflowing ones, in order.
+                all_scores = torch.cat(
+                    [
+                        finalized_scores[sents],
+                        norm_scores.type_as(finalized_scores).masked_fill(
+                            overflow.eq(0), -math.inf
+                        ),
+                    ],
+                    dim=1,
+                )
+                num_all = all_scores.size(1)
+                earlier = all_scores.new_ones(num_all, num_all).triu(1).eq(1)
+                ahead = all_scores.unsqueeze(2).gt(all_scores.unsqueeze(1)) | (
+                    all_scores.unsqueeze(2).eq(all_scores.unsqueeze(1))
+                    & earlier.unsqueeze(0)
+                )
+                keep = ahead.long().sum(dim=1).lt(beam_size)
+                replaced = keep[:, :beam_size].eq(0)
+                taken = keep[:, beam_size:] & overflow
+                replaced_rank = replaced.long().cumsum(dim=1) - 1
+                batch_rows = torch.arange(0, bsz).unsqueeze(1).type_as(tokens)
+                replaced_rows = batch_rows.expand(bsz, beam_size)[replaced]
+                beam_slots = cand_offsets[:beam_size].expand(bsz, beam_size)
+                replaced_slots = beam_slots[replaced]
+                slot_of_rank = tokens.new_zeros(bsz, beam_size)
+                slot_of_rank[replaced_rows, replaced_rank[replaced]] = replaced_slots
+                taken_rows = batch_rows.expand_as(taken)[taken]
+                taken_rank = taken.long().cumsum(dim=1) - 1
+                store_hypos(
+                    step,
+                    rows[taken],
+                    slot_of_rank[taken_rows, taken_rank[taken]],
+                    bbsz_idx[taken],
+                    eos_scores[taken],
+                    norm_scores[taken],
+                )
 
-            # return number of hypotheses finished this step
-            num_finished = 0
-            for sent in sents_seen:
-                # check termination conditions for this sentence
-                if not finished[sent] and is_finished(sent, step, unfinalized_scores):
-                    finished[sent] = True
-                    num_finished += 1
-            return num_finished
+            # check termination conditions of the sentences seen this step
+            finished = mask.long().sum(dim=1).gt(0) & num_finalized[sents].eq(
+                beam_size
+            )
+            if not (self.stop_early or step == maxlen or unfinalized_scores is None):
+                # stop if the best unfinalized score is worse than the worst
+                # finalized one
+                best_unfinalized_scores = unfinalized_scores.max(dim=1)[0]
+                if self.normalize_scores:
+                    best_unfinalized_scores = (
+                        best_unfinalized_scores / (maxlen + 1) ** self.len_penalty
+                    )
+                worst_finalized_scores = finalized_scores[sents].min(dim=1)[0]
+                finished = finished & worst_finalized_scores.ge(
+                    best_unfinalized_scores.type_as(finalized_scores)
+                )
+            return finished
 
         reorder_state = None
         for step in range(maxlen + 1):  # one extra step for EOS marker
@@ -327,41 +368,15 @@ class SequenceGenerator(torch.nn.Module):
             else:
                 # make probs contain cumulative scores for each hypothesis
                 logprobs.add_(scores[:, step - 1].view(-1, 1))
-            logprobs[:, self.pad] = -math.inf  # never select pad
-
-            # apply unk reward
-            if possible_translation_tokens is None:
-                # No vocab reduction, so unk is represented by self.unk at
-                # position self.unk
-                unk_index = self.unk
-                logprobs[:, unk_index] += self.unk_reward
-            else:
-                # When we use vocab reduction, the token value self.unk may not
-                # be at the position self.unk, but somewhere else in the list
-                # of possible_translation_tokens. It's also possible not to
-                # show up in possible_translation_tokens at all, meaning we
-                # can't generate an unk.
-                unk_pos = torch.nonzero(possible_translation_tokens == self.unk)
-                if unk_pos.size()[0] != 0:
-                    # only add unk_reward if unk index appears in
-                    # possible_translation_tokens
-                    unk_index = unk_pos[0][0]
-                    logprobs[:, unk_index] += self.unk_reward
-
-            # external lexicon reward
-            logprobs[:, self.lexicon_indices] += self.lexicon_reward
-
-            logprobs += self.word_reward
-            logprobs[:, self.eos] -= self.word_reward
+            self._apply_rewards(logprobs, possible_translation_tokens)
 
             # Record attention scores
-            attn[:, :, step + 1].copy_(avg_attn)
+            if attn is not None:
+                attn[:, :, step + 1].copy_(avg_attn)
 
             cand_scores = buffer("cand_scores", type_of=scores)
             cand_indices = buffer("cand_indices")
             cand_beams = buffer("cand_beams")
-            eos_bbsz_idx = buffer("eos_bbsz_idx")
-            eos_scores = buffer("eos_scores", type_of=scores)
             if step < maxlen:
                 if prefix_tokens is not None and step < prefix_tokens.size(1):
                     logprobs_slice = logprobs.view(bsz, -1, logprobs.size(-1))[:, 0, :]
@@ -405,42 +420,62 @@ class SequenceGenerator(torch.nn.Module):
             else:
                 # finalize all active hypotheses once we hit maxlen
                 # pick the hypothesis with the highest log prob of EOS right now
-                torch.sort(
-                    logprobs[:, self.eos],
-                    descending=True,
-                    out=(eos_scores, eos_bbsz_idx),
+                eos_scores, eos_beams = torch.sort(
+                    logprobs[:, self.eos].view(bsz, beam_size), dim=1, descending=True
                 )
-                num_remaining_sent -= finalize_hypos(step, eos_bbsz_idx, eos_scores)
-                assert num_remaining_sent == 0
+                finished = finalize_hypos(
+                    step, eos_beams + bbsz_offsets, eos_scores, eos_beams.ge(0)
+                )
+                assert bool(finished.all())
                 break
 
             # cand_bbsz_idx contains beam indices for the top candidate
             # hypotheses, with a range of values: [0, bsz*beam_size),
             # and dimensions: [bsz, cand_size]
-            cand_bbsz_idx = cand_beams.add_(bbsz_offsets)
+            cand_bbsz_idx = cand_beams + bbsz_offsets
 
             # finalize hypotheses that end in eos
             eos_mask = cand_indices.eq(self.eos)
+            batch_idxs = None
             if step >= self.minlen:
                 # only consider eos when it's among the top beam_size indices
-                torch.masked_select(
+                finished = finalize_hypos(
+                    step,
                     cand_bbsz_idx[:, :beam_size],
-                    mask=eos_mask[:, :beam_size],
-                    out=eos_bbsz_idx,
+                    cand_scores[:, :beam_size],
+                    eos_mask[:, :beam_size],
+                    cand_scores,
                 )
-                if eos_bbsz_idx.numel() > 0:
-                    torch.masked_select(
-                        cand_scores[:, :beam_size],
-                        mask=eos_mask[:, :beam_size],
-                        out=eos_scores,
-                    )
-                    num_remaining_sent -= finalize_hypos(
-                        step, eos_bbsz_idx, eos_scores, cand_scores
-                    )
+                num_finished = int(finished.long().sum())
+                if num_finished == bsz:
+                    break
+                if num_finished > 0:
+                    # remove the finished sentences from the batch, so that
+                    # the decoder only runs on unfinished hypotheses
+                    new_bsz = bsz - num_finished
+                    batch_idxs = torch.nonzero(finished.eq(0)).squeeze(1)
+                    sent_idx = sent_idx[batch_idxs]
+                    bbsz_offsets = bbsz_offsets[:new_bsz]
+                    eos_mask = eos_mask[batch_idxs]
+                    cand_bbsz_idx = cand_beams[batch_idxs] + bbsz_offsets
+                    cand_scores = cand_scores[batch_idxs]
+                    cand_indices = cand_indices[batch_idxs]
+                    if prefix_tokens is not None:
+                        prefix_tokens = prefix_tokens[batch_idxs]
+
+                    def shrink(t):
+                        return t.view(bsz, -1)[batch_idxs].view(
+                            new_bsz * beam_size, *t.size()[1:]
+                        )
 
-            assert num_remaining_sent >= 0
-            if num_remaining_sent == 0:
-                break
+                    tokens = shrink(tokens)
+                    tokens_buf.resize_as_(tokens)
+                    scores = shrink(scores)
+                    scores_buf.resize_as_(scores)
+                    if attn is not None:
+                        attn = shrink(attn)
+                        attn_buf.resize_as_(attn)
+                    bsz = new_bsz
             assert step < maxlen
 
             # set active_mask so that values > cand_size indicate eos hypos
@@ -502,12 +537,13 @@ class SequenceGenerator(torch.nn.Module):
             )
 
             # copy attention for active hypotheses
-            torch.index_select(
-                attn[:, :, : step + 2],
-                dim=0,
-                index=active_bbsz_idx,
-                out=attn_buf[:, :, : step + 2],
-            )
+            if attn is not None:
+                torch.index_select(
+                    attn[:, :, : step + 2],
+                    dim=0,
+                    index=active_bbsz_idx,
+                    out=attn_buf[:, :, : step + 2],
+                )
 
             # swap buffers
             tokens, tokens_buf = tokens_buf, tokens
@@ -516,15 +552,232 @@ class SequenceGenerator(torch.nn.Module):
 
             # reorder incremental state in decoder
             reorder_state = active_bbsz_idx
+            if batch_idxs is not None:
+                # The decoder states and encoder outputs still have the rows of
+                # the sentences removed at this step, so map the hypotheses to
+                # their rows before the batch was shrunk.
+                row_offsets = batch_idxs - torch.arange(0, bsz).type_as(batch_idxs)
+                reorder_state = (
+                    active_bbsz_idx.view(bsz, beam_size)
+                    + row_offsets.unsqueeze(1) * beam_size
+                ).view(-1)
+                encoder_outs = [
+                    model.encoder.reorder_encoder_out(
+                        encoder_out=encoder_out, new_order=reorder_state
+                    )
+                    for model, encoder_out in zip(self.models, encoder_outs)
+                ]
+
+        # build the hypotheses, sorted by score descending
+        if finalized_attn is not None:
+            alignments = finalized_attn.max(dim=2)[1]
+        lens = finalized_lens.tolist()
+        sent_scores = finalized_scores.tolist()
+        finalized = []
+        for sent, count in enumerate(num_finalized.tolist()):
+            hypos = []
+            for slot in range(count):
+                hypo_len = lens[sent][slot]
+                hypo = {
+                    "tokens": finalized_tokens[sent, slot, :hypo_len],
+                    "score": sent_scores[sent][slot],
+                    "attention": None,
+                    "alignment": None,
+                    "positional_scores": finalized_pos_scores[sent, slot, :hypo_len],
+                }
+                if finalized_attn is not None:
+                    # src_len x tgt_len
+                    hypo["attention"] = finalized_attn[sent, slot, :, :hypo_len]
+                    hypo["alignment"] = alignments[sent, slot, :hypo_len]
+                hypos.append(hypo)
+            finalized.append(sorted(hypos, key=lambda r: r["score"], reverse=True))
+        return finalized
 
-        # sort by score descending
-        for sent in range(bsz):
-            finalized[sent] = sorted(
-                finalized[sent], key=lambda r: r["score"], reverse=True
+    def _generate_without_beam(
+        self, encoder_inputs, bsz, num_hypos, maxlen, prefix_tokens=None, need_attn=True
+    ):
+        """Generates num_hypos translations of each sentence without a beam:
+        each hypothesis is extended with the token picked by _choose_tokens()
+        until it ends with EOS, so there are no candidates to select. With the
+        best token and a single hypothesis, this is greedy search, which gives
+        the same results as the beam search with a beam size of 1 and early
+        stopping.
+
+        Hypotheses which end with EOS are removed from the rows being decoded,
+        together with their decoder states and encoder outputs, so that the
+        decoder only runs on unfinished hypotheses.
+
+        The attention of the hypotheses is only kept if need_attn is True.
+        Otherwise, their "attention" and "alignment" are None.
+        """
+        src_tokens = encoder_inputs[0]
+        # Encode once, expanding outputs for each hypothesis
+        reorder_indices = torch.arange(bsz).view(-1, 1).repeat(1, num_hypos).view(-1)
+        reorder_indices = reorder_indices.type_as(src_tokens)
+        encoder_outs, incremental_states = self._encode(
+            encoder_input=encoder_inputs, reorder_indices=reorder_indices
+        )
+        if prefix_tokens is not None and num_hypos > 1:
+            prefix_tokens = prefix_tokens.index_select(0, reorder_indices)
+
+        num_rows = bsz * num_hypos
+        tokens = src_tokens.new(num_rows, maxlen + 2).fill_(self.pad)
+        tokens[:, 0] = self.eos
+        # Finished hypotheses are moved to the final_* tensors, at their row
+        # in the batch. row_ids maps the rows being decoded to these rows.
+        final_tokens = tokens.clone()
+        row_ids = torch.arange(num_rows).type_as(src_tokens)
+        # number of tokens of each translation, including EOS
+        lens = tokens.new(num_rows).fill_(maxlen + 1)
+        pos_scores, final_pos_scores = None, None
+        attn, final_attn = None, None
+
+        for step in range(maxlen + 1):  # one extra step for EOS marker
+            logprobs, avg_attn, possible_translation_tokens = self._decode(
+                tokens[:, : step + 1], encoder_outs, incremental_states
             )
+            self._apply_rewards(logprobs, possible_translation_tokens)
+            if step == 0:
+                pos_scores = logprobs.new_zeros(num_rows, maxlen + 1)
+                final_pos_scores = pos_scores.clone()
+                if need_attn:
+                    attn = avg_attn.new_zeros(num_rows, avg_attn.size(1), maxlen + 2)
+                    final_attn = attn.clone()
+            if need_attn:
+                attn[:, :, step + 1].copy_(avg_attn)
+
+            if step == maxlen:
+                # end all unfinished translations once we hit maxlen
+                next_tokens = tokens.new(tokens.size(0)).fill_(self.eos)
+                step_scores = logprobs[:, self.eos]
+            elif prefix_tokens is not None and step < prefix_tokens.size(1):
+                next_tokens = prefix_tokens[:, step]
+                step_scores = logprobs.gather(1, next_tokens.view(-1, 1)).view(-1)
+            else:
+                if step < self.minlen:
+                    logprobs[:, self.eos] = -math.inf
+                step_scores, next_tokens = self._choose_tokens(logprobs)
+                if possible_translation_tokens is not None:
+                    next_tokens = possible_translation_tokens[next_tokens]
+            tokens[:, step + 1] = next_tokens
+            pos_scores[:, step] = step_scores
+
+            if step < self.minlen and step < maxlen:
+                continue
+            finished = next_tokens.eq(self.eos)
+            num_finished = int(finished.long().sum())
+            if num_finished == 0:
+                continue
+            finished_idxs = torch.nonzero(finished).squeeze(1)
+            finished_rows = row_ids.index_select(0, finished_idxs)
+            lens.index_fill_(0, finished_rows, step + 1)
+            final_tokens.index_copy_(
+                0, finished_rows, tokens.index_select(0, finished_idxs)
+            )
+            final_pos_scores.index_copy_(
+                0, finished_rows, pos_scores.index_select(0, finished_idxs)
+            )
+            if need_attn:
+                final_attn.index_copy_(
+                    0, finished_rows, attn.index_select(0, finished_idxs)
+                )
+            if num_finished == tokens.size(0):
+                break
 
+            # remove the finished hypotheses from the rows being decoded
+            active_idxs = torch.nonzero(finished.eq(0)).squeeze(1)
+            row_ids = row_ids.index_select(0, active_idxs)
+            tokens = tokens.index_select(0, active_idxs)
+            pos_scores = pos_scores.index_select(0, active_idxs)
+            if need_attn:
+                attn = attn.index_select(0, active_idxs)
+            if prefix_tokens is not None:
+                prefix_tokens = prefix_tokens.index_select(0, active_idxs)
+            for model in self.models:
+                if isinstance(model.decoder, FairseqIncrementalDecoder):
+                    model.decoder.reorder_incremental_state(
+                        incremental_states[model], active_idxs
+                    )
+            encoder_outs = [
+                model.encoder.reorder_encoder_out(
+                    encoder_out=encoder_out, new_order=active_idxs
+                )
+                for model, encoder_out in zip(self.models, encoder_outs)
+            ]
+
+        tokens, pos_scores, attn = final_tokens, final_pos_scores, final_attn
+        scores = pos_scores.cumsum(dim=1).gather(1, (lens - 1).view(-1, 1)).view(-1)
+        if self.normalize_scores:
+            scores /= lens.type_as(scores) ** self.len_penalty
+        if need_attn:
+            alignments = attn.max(dim=1)[1]
+        lens = lens.tolist()
+        scores = scores.tolist()
+        finalized = []
+        for sent in range(bsz):
+            hypos = []
+            for row in range(sent * num_hypos, (sent + 1) * num_hypos):
+                hypo = {
+                    "tokens": tokens[row, 1 : lens[row] + 1],
+                    "score": scores[row],
+                    "attention": None,
+                    "alignment": None,
+                    "positional_scores": pos_scores[row, : lens[row]],
+                }
+                if need_attn:
+                    # src_len x tgt_len
+                    hypo["attention"] = attn[row, :, 1 : lens[row] + 1]
+                    hypo["alignment"] = alignments[row, 1 : lens[row] + 1]
+                hypos.append(hypo)
+            finalized.append(sorted(hypos, key=lambda r: r["score"], reverse=True))
         return finalized
 
+    def _choose_tokens(self, logprobs):
+        """Returns the scores and indices of the tokens which extend the
+        hypotheses of _generate_without_beam(): the best token of each row of
+        logprobs."""
+        return logprobs.max(dim=1)
+
+    def _apply_rewards(self, logprobs, possible_translation_tokens):
+        """Adds the unk, lexicon and word rewards to the scores of a step in
+        place, and prevents pad from being selected."""
+        logprobs[:, self.pad] = -math.inf  # never select pad
+
+        # apply unk reward
+        if possible_translation_tokens is None:
+            # No vocab reduction, so unk is represented by self.unk at
+            # position self.unk
+            unk_index = self.unk
+            logprobs[:, unk_index] += self.unk_reward
+        else:
+            # When we use vocab reduction, the token value self.unk may not
+            # be at the position self.unk, but somewhere else in the list
+            # of possible_translation_tokens. It's also possible not to
+            # show up in possible_translation_tokens at all, meaning we
+            # can't generate an unk.
+            unk_pos = torch.nonzero(possible_translation_tokens == self.unk)
+            if unk_pos.size()[0] != 0:
+                # only add unk_reward if unk index appears in
+                # possible_translation_tokens
+                unk_index = unk_pos[0][0]
+                logprobs[:, unk_index] += self.unk_reward
+
+        # external lexicon reward
+        logprobs[:, self.lexicon_indices] += self.lexicon_reward
+
+        logprobs += self.word_reward
+        logprobs[:, self.eos] -= self.word_reward
+
+    def _get_encoder_inputs(self, encoder_input):
+        if self.use_char_source:
+            return (
+                encoder_input["src_tokens"],
+                encoder_input["src_lengths"],
+                encoder_input["char_inds"],
+                encoder_input["word_lengths"],
+            )
+        return (encoder_input["src_tokens"], encoder_input["src_lengths"])
+
     def _encode(self, encoder_input, reorder_indices):
         encoder_outs = []
         incremental_states = {}
@@ -685,3 +938,74 @@ class SequenceGenerator(torch.nn.Module):
             avg_attn.div_(len(self.models))
 
         return avg_probs, avg_attn, possible_translation_tokens
+
+
+class SamplingSequenceGenerator(SequenceGenerator):
+    def __init__(
+        self,
+        models,
+        tgt_dict,
+        sampling_topk=-1,
+        sampling_topp=-1.0,
+        sampling_temperature=1.0,
+        **kwargs,
+    ):
+        """Generates translations by sampling their tokens, which is cheaper
+        than beam search and gives more diverse translations (e.g. for
+        back-translation). beam_size independent samples are drawn for each
+        source sentence, sharing a single pass of the encoder.
+
+        Args:
+            sampling_topk: If > 0, only sample from the sampling_topk most
+                likely tokens.
+            sampling_topp: If > 0, only sample from the smallest set of most
+                likely tokens whose probability sums to at least sampling_topp
+                (nucleus sampling).
+            sampling_temperature: The scores are divided by the temperature
+                before sampling, so values < 1 make samples more greedy and
+                values > 1 make them more uniform.
+            See SequenceGenerator for the other arguments. stop_early is not
+            used, since each sample ends with its first EOS.
+        """
+        super().__init__(models, tgt_dict, **kwargs)
+        assert sampling_temperature > 0, "Sampling temperature must be positive"
+        assert sampling_topp <= 1, "Sampling top-p must be at most 1"
+        self.sampling_topk = sampling_topk
+        self.sampling_topp = sampling_topp
+        self.sampling_temperature = sampling_temperature
+
+    def _generate(self, encoder_input, beam_size=None, maxlen=None, prefix_tokens=None):
+        bsz = encoder_input["src_tokens"].size(0)
+        maxlen = min(maxlen, self.maxlen) if maxlen is not None else self.maxlen
+        num_samples = beam_size if beam_size is not None else self.beam_size
+        return self._generate_without_beam(
+            self._get_encoder_inputs(encoder_input),
+            bsz,
+            num_samples,
+            maxlen,
+            prefix_tokens,
+            need_attn=False,
+        )
+
+    def _choose_tokens(self, logprobs):
+        """Samples a token for each row of logprobs, and returns their scores
+        and indices."""
+        if self.sampling_topk > 0 or self.sampling_topp > 0:
+            # the candidates are sorted by descending score
+            k = logprobs.size(1)
+            if self.sampling_topk > 0:
+                k = min(k, self.sampling_topk)
+            cand_scores, cand_indices = logprobs.topk(k, dim=1)
+        else:
+            cand_scores, cand_indices = logprobs, None
+        probs = F.softmax(cand_scores / self.sampling_temperature, dim=1)
+        if self.sampling_topp > 0:
+            # Drop the candidates after the first ones whose probability sums
+            # to sampling_topp. The best candidate is always kept.
+            probs = probs.masked_fill(
+                (probs.cumsum(dim=1) - probs).gt(self.sampling_topp), 0
+            )
+        samples = torch.multinomial(probs, 1)
+        if cand_indices is not None:
+            samples = cand_indices.gather(1, samples)
+        return logprobs.gather(1, samples).view(-1), samples.view(-1)
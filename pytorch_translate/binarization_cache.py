@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import os
+import socket
+from typing import Any, Dict, List, Optional, Sequence
+
+from pytorch_translate import data as pytorch_translate_data
+from pytorch_translate.dictionary import Dictionary
+
+
+# Binarized corpora are cached under a key which is a hash of everything the
+# output depends on: the text file, the dictionaries and the parse flags. Each
+# entry is a small JSON file <key>.json pointing to the binarized corpus (a
+# single file, a memory-mapped dataset or a shard manifest) stored next to it.
+# The JSON file is only written once the corpus is complete. Until then, the
+# corpus is binarized to files named <key>.<host>.<pid>*, which are removed by
+# later lookups on the same host if the process died before committing them.
+# An entry may also point to several files, e.g. the filtered source, target
+# and weights of a parallel corpus.
+BINARIZATION_CACHE_VERSION = 2
+
+# Number and size of the blocks of a text file which are hashed, spread
+# evenly over the file. Together with its size and modification time, this
+# catches changes to the file without reading all of it.
+NUM_SAMPLED_BLOCKS = 16
+SAMPLED_BLOCK_SIZE = 1 << 16
+
+
+def text_file_fingerprint(path: str) -> str:
+    """Hash of the size, modification time and sampled content of a file."""
+    stat = os.stat(path)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{stat.st_size} {stat.st_mtime_ns}".encode("utf-8"))
+    with open(path, "rb") as f:
+        if stat.st_size <= NUM_SAMPLED_BLOCKS * SAMPLED_BLOCK_SIZE:
+            h.update(f.read())
+        else:
+            stride = (stat.st_size - SAMPLED_BLOCK_SIZE) // (NUM_SAMPLED_BLOCKS - 1)
+            for i in range(NUM_SAMPLED_BLOCKS):
+                f.seek(i * stride)
+                h.update(f.read(SAMPLED_BLOCK_SIZE))
+    return h.hexdigest()
+
+
+def dictionary_fingerprint(dictionary: Optional[Dictionary]) -> Optional[str]:
+    """Hash of the symbols of a dictionary, which determine the ids of the
+    binarized tokens."""
+    if dictionary is None:
+        return None
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{type(dictionary).__name__} {dictionary.nspecial}\n".encode("utf-8"))
+    h.update("\n".join(dictionary.symbols).encode("utf-8"))
+    return h.hexdigest()
+
+
+def cache_key(
+    text_file: str,
+    dictionary: Dictionary,
+    char_dictionary: Optional[Dictionary] = None,
+    **parse_flags: Any,
+) -> str:
+    """Key of the binarization of `text_file` with the given dictionaries and
+    flags (e.g. append_eos, reverse_order), which must be JSON-serializable.
+    Flags which do not change the output, such as the number of workers, must
+    not be passed."""
+    return _fingerprint_key(
+        {
+            "version": BINARIZATION_CACHE_VERSION,
+            "text_file": text_file_fingerprint(text_file),
+            "dictionary": dictionary_fingerprint(dictionary),
+            "char_dictionary": dictionary_fingerprint(char_dictionary),
+            "flags": parse_flags,
+        }
+    )
+
+
+def multilingual_cache_key(
+    corpus_configs: List[pytorch_translate_data.MultilingualCorpusConfig],
+    **parse_flags: Any,
+) -> str:
+    """Like cache_key(), for the binarization of multilingual corpora into a
+    single dataset."""
+    return _fingerprint_key(
+        {
+            "version": BINARIZATION_CACHE_VERSION,
+            "corpora": [
+                {
+                    "dialect_id": config.dialect_id,
+                    "text_file": text_file_fingerprint(config.data_file),
+                    "dictionary": dictionary_fingerprint(config.dict),
+                    "oversampling": config.oversampling,
+                }
+                for config in corpus_configs
+            ],
+            "flags": parse_flags,
+        }
+    )
+
+
+def derived_cache_key(input_paths: Sequence[Optional[str]], **flags: Any) -> str:
+    """Key of files made from the cached files `input_paths` (e.g. a filtered
+    corpus) with the given flags. Cached files are never modified, so they
+    are identified by their names."""
+    return _fingerprint_key(
+        {
+            "version": BINARIZATION_CACHE_VERSION,
+            "inputs": [
+                None if path is None else os.path.basename(path)
+                for path in input_paths
+            ],
+            "flags": flags,
+        }
+    )
+
+
+def _fingerprint_key(fingerprint: Dict[str, Any]) -> str:
+    return hashlib.blake2b(
+        json.dumps(fingerprint, sort_keys=True).encode("utf-8"), digest_size=16
+    ).hexdigest()
+
+
+def _entry_path(cache_dir: str, key: str) -> str:
+    return os.path.join(cache_dir, f"{key}.json")
+
+
+def _output_prefix(key: str) -> str:
+    """Prefix of the names of the outputs binarized on this host under `key`.
+    Dots in the host name are replaced so that the pid is the next field."""
+    host = socket.gethostname().replace(".", "_")
+    return f"{key}.{host}."
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def remove_stale_outputs(
+    cache_dir: str, key: str, committed_paths: Sequence[str] = ()
+) -> None:
+    """Removes the files written under `key` on this host by processes which
+    are no longer running, other than those of the process which wrote the
+    committed files `committed_paths`."""
+    prefix = _output_prefix(key)
+    committed_pids = set()
+    for path in committed_paths:
+        name = os.path.basename(path)
+        if name.startswith(prefix):
+            committed_pids.add(name[len(prefix) :].split(".")[0])
+    try:
+        names = os.listdir(cache_dir)
+    except OSError:
+        return
+    for name in names:
+        if not name.startswith(prefix):
+            continue
+        pid = name[len(prefix) :].split(".")[0]
+        if pid in committed_pids or not pid.isdigit() or _is_running(int(pid)):
+            continue
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except OSError:
+            # Removed concurrently by another job.
+            pass
+
+
+def lookup_paths(cache_dir: str, key: str) -> Optional[Dict[str, str]]:
+    """Returns the named paths of the files cached under `key` (see
+    commit_paths()), or None if there are none or some are missing. Outputs
+    left behind under `key` by jobs which died before committing them are
+    removed."""
+    paths = None
+    try:
+        with open(_entry_path(cache_dir, key), "r", encoding="utf-8") as f:
+            entry: Dict[str, Any] = json.load(f)
+        paths = {
+            name: os.path.join(cache_dir, path)
+            for name, path in entry["paths"].items()
+        }
+    except (OSError, ValueError, KeyError, AttributeError):
+        pass
+    if paths is not None and not all(os.path.exists(p) for p in paths.values()):
+        paths = None
+    remove_stale_outputs(cache_dir, key, paths.values() if paths else ())
+    return paths
+
+
+def lookup(cache_dir: str, key: str) -> Optional[str]:
+    """Returns the path of the binarized corpus cached under `key`, or None if
+    there is none."""
+    paths = lookup_paths(cache_dir, key)
+    return paths["corpus"] if paths else None
+
+
+def new_output_path(
+    cache_dir: str, key: str, binary_format: Optional[str], suffix: str = ""
+) -> str:
+    """Returns a path in `cache_dir` to binarize a corpus (or other file, if
+    binary_format is None) to, before adding it to the cache with commit().
+    Paths are unique per host and process, so that concurrent jobs binarizing
+    the same corpus do not overwrite each other's files."""
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{_output_prefix(key)}{os.getpid()}{suffix}")
+    if binary_format == pytorch_translate_data.BINARY_FORMAT_NPZ:
+        # numpy silently appends this suffix if it is not present.
+        path += ".npz"
+    return path
+
+
+def commit_paths(
+    cache_dir: str, key: str, paths: Dict[str, str], text_files: Sequence[str]
+) -> None:
+    """Adds the files `paths` (by name), which must be in `cache_dir` and were
+    made from `text_files`, to the cache under `key`."""
+    entry = {
+        "paths": {name: os.path.basename(path) for name, path in paths.items()},
+        "text_files": [os.path.abspath(text_file) for text_file in text_files],
+    }
+    entry_path = _entry_path(cache_dir, key)
+    tmp_path = f"{entry_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(entry, f, indent=2)
+    # Atomic, so that readers never see a partially written entry.
+    os.replace(tmp_path, entry_path)
+
+
+def commit(cache_dir: str, key: str, path: str, text_files: Sequence[str]) -> None:
+    """Adds the binarized corpus at `path`, binarized from `text_files`, to
+    the cache under `key`."""
+    commit_paths(cache_dir, key, {"corpus": path}, text_files)
@@ -1,9 +1,18 @@
 #!/usr/bin/env python3
 
+import itertools
+
 import numpy as np
 import torch
 from fairseq import data, tokenizer
-from pytorch_translate import vocab_constants
+from pytorch_translate import (
+    data as pytorch_translate_data,
+    dictionary as pytorch_translate_dictionary,
+    mmap_format,
+    sharding,
+    vocab_constants,
+    weighted_data,
+)
 from pytorch_translate.dictionary import TAGS
 
 
@@ -22,16 +31,99 @@ class InMemoryNumpyWordCharDataset(data.indexed_dataset.IndexedDataset):
         """Get tensor of token indices for example i"""
         assert i < self.__len__(), f"index {i} out of range!"
         a = self.word_buffer[self.word_offsets[i] : self.word_offsets[i + 1]]
-        return torch.from_numpy(a)
+        return torch.from_numpy(a.astype(np.int64))
+
+    def get_chars(self, i):
+        """Get the character indices of all words of example i as a single
+        contiguous tensor, along with the length of each word in characters.
+        """
+        assert i < self.__len__(), f"index {i} out of range!"
+        char_offsets = self.char_offsets[
+            self.word_offsets[i] : self.word_offsets[i + 1] + 1
+        ]
+        chars = self.char_buffer[char_offsets[0] : char_offsets[-1]]
+        return (
+            torch.from_numpy(chars.astype(np.int64)),
+            torch.from_numpy(np.diff(char_offsets).astype(np.int64)),
+        )
 
     def get_chars_list(self, i):
-        """Get list of tensors of character indices for example i"""
-        result = []
-        for word_index in range(self.word_offsets[i], self.word_offsets[i + 1]):
-            char_indices = self.char_buffer[
-                self.char_offsets[word_index] : self.char_offsets[word_index + 1]
-            ]
-            result.append(torch.from_numpy(char_indices))
+        """Get list of tensors of character indices for example i, which are
+        views of the tensor returned by get_chars()."""
+        chars, word_lengths = self.get_chars(i)
+        return list(torch.split(chars, word_lengths.tolist()))
+
+    def collate_word_chars(self, indices, pad_idx):
+        """Builds the padded word and char tensors of the examples `indices`
+        with one gather from each buffer and one scatter into each tensor.
+
+        Returns:
+            Tuple (src_tokens, src_lengths, char_inds, word_lengths) of
+            LongTensors of shapes (bsz, max_words), (bsz,),
+            (bsz, max_words, max_word_length) and (bsz, max_words).
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        word_starts = self.word_offsets[indices].astype(np.int64)
+        src_lengths = self.word_offsets[indices + 1] - word_starts
+        word_positions = pytorch_translate_data.range_indices(word_starts, src_lengths)
+        # Batch row and column of each word of the batch.
+        word_rows = np.repeat(np.arange(len(indices)), src_lengths)
+        word_columns = np.arange(len(word_positions)) - np.repeat(
+            pytorch_translate_data.sizes_to_offsets(src_lengths, dtype=np.int64)[:-1],
+            src_lengths,
+        )
+        max_words = int(src_lengths.max()) if len(indices) > 0 else 0
+
+        src_tokens = np.full((len(indices), max_words), pad_idx, dtype=np.int64)
+        src_tokens[word_rows, word_columns] = self.word_buffer[word_positions]
+
+        char_starts = self.char_offsets[word_positions].astype(np.int64)
+        word_char_lengths = self.char_offsets[word_positions + 1] - char_starts
+        word_lengths = np.zeros((len(indices), max_words), dtype=np.int64)
+        word_lengths[word_rows, word_columns] = word_char_lengths
+        max_word_length = int(word_lengths.max()) if word_lengths.size > 0 else 0
+
+        char_positions = pytorch_translate_data.range_indices(
+            char_starts, word_char_lengths
+        )
+        # Word of the batch, and column within that word, of each char.
+        char_words = np.repeat(np.arange(len(word_positions)), word_char_lengths)
+        char_columns = np.arange(len(char_positions)) - np.repeat(
+            pytorch_translate_data.sizes_to_offsets(
+                word_char_lengths, dtype=np.int64
+            )[:-1],
+            word_char_lengths,
+        )
+        char_inds = np.full(
+            (len(indices), max_words, max_word_length), pad_idx, dtype=np.int64
+        )
+        char_inds[
+            word_rows[char_words], word_columns[char_words], char_columns
+        ] = self.char_buffer[char_positions]
+
+        return (
+            torch.from_numpy(src_tokens),
+            torch.from_numpy(src_lengths.astype(np.int64)),
+            torch.from_numpy(char_inds),
+            torch.from_numpy(word_lengths),
+        )
+
+    def select(self, indices):
+        """Returns an in-memory dataset of the examples `indices` of this
+        dataset, in that order."""
+        indices = np.asarray(indices, dtype=np.int64)
+        word_starts = self.word_offsets[indices].astype(np.int64)
+        result = InMemoryNumpyWordCharDataset()
+        result.sizes = (self.word_offsets[indices + 1] - word_starts).astype(np.int32)
+        result.word_offsets = pytorch_translate_data.sizes_to_offsets(result.sizes)
+        word_positions = pytorch_translate_data.range_indices(word_starts, result.sizes)
+        result.word_buffer = self.word_buffer[word_positions]
+        char_starts = self.char_offsets[word_positions].astype(np.int64)
+        word_lengths = self.char_offsets[word_positions + 1] - char_starts
+        result.char_offsets = pytorch_translate_data.sizes_to_offsets(word_lengths)
+        result.char_buffer = self.char_buffer[
+            pytorch_translate_data.range_indices(char_starts, word_lengths)
+        ]
         return result
 
     def __len__(self):
@@ -41,11 +133,25 @@ class InMemoryNumpyWordCharDataset(data.indexed_dataset.IndexedDataset):
     def __del__(self):
         pass
 
-    def save(self, path):
+    def save(self, path, binary_format=pytorch_translate_data.BINARY_FORMAT_NPZ):
         assert self.word_buffer is not None
         assert self.word_offsets is not None
         assert self.char_buffer is not None
         assert self.char_offsets is not None
+        if binary_format == pytorch_translate_data.BINARY_FORMAT_MMAP:
+            mmap_format.save_mmap_arrays(
+                path,
+                {
+                    "word_buffer": self.word_buffer,
+                    "word_offsets": self.word_offsets,
+                    "char_buffer": self.char_buffer,
+                    "char_offsets": self.char_offsets,
+                    "sizes": self.sizes,
+                },
+                dataset=type(self).__name__,
+            )
+            return
+        assert binary_format == pytorch_translate_data.BINARY_FORMAT_NPZ, binary_format
         np.savez(
             path,
             word_buffer=self.word_buffer,
@@ -55,26 +161,68 @@ class InMemoryNumpyWordCharDataset(data.indexed_dataset.IndexedDataset):
         )
 
     def load(self, path):
-        npz = np.load(path)
-        if "char_buffer" not in npz or "char_offsets" not in npz:
+        if mmap_format.read_mmap_header(path) is not None:
+            _, arrays = mmap_format.load_mmap_arrays(path)
+        else:
+            arrays = np.load(path)
+        if "char_buffer" not in arrays or "char_offsets" not in arrays:
             raise RuntimeError(f"{path} does not appear to be a word-char dataset!")
-        self.word_buffer = npz["word_buffer"]
-        self.word_offsets = npz["word_offsets"]
-        self.sizes = self.word_offsets[1:] - self.word_offsets[:-1]
-        self.char_buffer = npz["char_buffer"]
-        self.char_offsets = npz["char_offsets"]
+        self.word_buffer = arrays["word_buffer"]
+        self.word_offsets = arrays["word_offsets"]
+        if "sizes" in arrays:
+            self.sizes = arrays["sizes"]
+        else:
+            self.sizes = self.word_offsets[1:] - self.word_offsets[:-1]
+        self.char_buffer = arrays["char_buffer"]
+        self.char_offsets = arrays["char_offsets"]
 
-    def _sent_to_word_ids(self, sent, word_dict, reverse_order=False, append_eos=False):
+    def _sents_to_word_ids(
+        self, sents, word_dict, reverse_order=False, append_eos=False, dtype=np.int64
+    ):
         """
-        Extract the word ids for words associated with the input sentence.
+        Extract the word ids for words associated with a block of input
+        sentences.
+
+        Returns:
+            Tuple (words, word_ids, word_offsets) of the flat list of words of
+            all sentences (reversed per sentence if reverse_order) and their
+            flat ids and per-sentence offsets, see Dictionary.encode_lines().
         """
-        words = tokenizer.tokenize_line(sent)
+        sent_words = [tokenizer.tokenize_line(sent) for sent in sents]
+        word_ids, word_offsets = word_dict.encode_lines(
+            sent_words,
+            tokenize=None,
+            append_eos=append_eos,
+            reverse_order=reverse_order,
+            dtype=dtype,
+        )
         if reverse_order:
-            words.reverse()
-        word_inds = [word_dict.index(w) for w in words]
-        if append_eos:
-            word_inds.append(word_dict.eos_index)
-        return words, word_inds
+            for words in sent_words:
+                words.reverse()
+        return list(itertools.chain.from_iterable(sent_words)), word_ids, word_offsets
+
+    def _words_to_char_ids(self, words, char_dict, embed_bytes=False, dtype=np.int64):
+        """
+        Extract the char/byte ids of a list of words.
+
+        Returns:
+            Tuple (char_ids, char_offsets), see Dictionary.encode_lines().
+        """
+        if embed_bytes:
+            char_lists = [
+                self._word_to_char_ids(word, char_dict, embed_bytes) for word in words
+            ]
+            return pytorch_translate_dictionary.layout_token_ids(
+                pytorch_translate_dictionary.numberized_lookup(
+                    list(itertools.chain.from_iterable(char_lists))
+                ),
+                [len(char_list) for char_list in char_lists],
+                dtype=dtype,
+            )
+        # A single word is split into its characters, or kept if it is a tag.
+        return char_dict.encode_lines(
+            words, tokenize=pytorch_translate_dictionary.char_tokenize_line, dtype=dtype
+        )
 
     def _word_to_char_ids(self, word, char_dict, embed_bytes=False):
         """
@@ -93,42 +241,110 @@ class InMemoryNumpyWordCharDataset(data.indexed_dataset.IndexedDataset):
             char_inds = [char_dict.index(c) for c in chars]
         return char_inds
 
-    def parse(
+    @staticmethod
+    def _buffer_dtypes(word_dict, char_dict, embed_bytes=False):
+        """Narrowest dtypes which hold all word and character ids. Byte ids
+        are shifted by one and followed by the ids of the TAGS."""
+        if embed_bytes:
+            max_char_index = vocab_constants.NUM_BYTE_INDICES + len(TAGS)
+        else:
+            max_char_index = len(char_dict) - 1
+        return (
+            pytorch_translate_data.compact_dtype(len(word_dict) - 1),
+            pytorch_translate_data.compact_dtype(max_char_index),
+        )
+
+    def _parse_shard(
         self,
         path,
+        start,
+        end,
         word_dict,
         char_dict,
         embed_bytes=False,
         reverse_order=False,
         append_eos=False,
     ):
-        word_array_list = []
-        word_offsets = [0]
-        char_array_list = []
-        char_offsets = [0]
-        sizes = []
-        with open(path, "r") as f:
-            for line in f:
-                words, word_inds = self._sent_to_word_ids(
-                    line, word_dict, reverse_order, append_eos
-                )
+        """Numberizes the lines of `path` which start in the byte range
+        [start, end).
+
+        Returns:
+            Tuple (word_buffer, sizes, char_buffer, word_lengths), where sizes
+            are the sentence lengths in words and word_lengths the word
+            lengths in characters (both int32). The buffers use the dtypes
+            returned by _buffer_dtypes().
+        """
+        word_dtype, char_dtype = self._buffer_dtypes(word_dict, char_dict, embed_bytes)
+        word_writer = pytorch_translate_data.ChunkedArrayWriter(dtype=word_dtype)
+        char_writer = pytorch_translate_data.ChunkedArrayWriter(dtype=char_dtype)
+        sizes_writer = pytorch_translate_data.ChunkedArrayWriter(dtype=np.int32)
+        word_lengths_writer = pytorch_translate_data.ChunkedArrayWriter(dtype=np.int32)
+        for lines in sharding.read_line_blocks(path, start, end):
+            words, word_ids, word_offsets = self._sents_to_word_ids(
+                lines, word_dict, reverse_order, append_eos, dtype=word_dtype
+            )
+            word_writer.extend(word_ids)
+            sizes_writer.extend(np.diff(word_offsets))
 
-                word_array_list.append(np.array(word_inds, dtype=np.int32))
-                word_offsets.append(word_offsets[-1] + len(word_inds))
-                sizes.append(len(word_inds))
+            char_ids, char_offsets = self._words_to_char_ids(
+                words, char_dict, embed_bytes, dtype=char_dtype
+            )
+            char_writer.extend(char_ids)
+            word_lengths_writer.extend(np.diff(char_offsets))
+
+        return (
+            word_writer.finalize(),
+            sizes_writer.finalize(),
+            char_writer.finalize(),
+            word_lengths_writer.finalize(),
+        )
 
-                for word in words:
-                    char_inds = self._word_to_char_ids(word, char_dict, embed_bytes)
-                    char_array_list.append(np.array(char_inds, dtype=np.int32))
-                    char_offsets.append(char_offsets[-1] + len(char_inds))
+    def parse(
+        self,
+        path,
+        word_dict,
+        char_dict,
+        embed_bytes=False,
+        reverse_order=False,
+        append_eos=False,
+        num_workers=1,
+    ):
+        """Add sentences from a text file to the dataset, replacing any
+        previously added sentences. If num_workers > 1, the file is split into
+        line-aligned shards which are numberized in a pool of num_workers
+        processes, with the same result as a single process."""
+        offsets = sharding.find_line_offsets(path, num_workers)
+        shard_args = [
+            (
+                path,
+                start,
+                end,
+                word_dict,
+                char_dict,
+                embed_bytes,
+                reverse_order,
+                append_eos,
+            )
+            for start, end in zip(offsets[:-1], offsets[1:])
+        ]
+        shards = sharding.map_shards(_parse_word_char_shard, shard_args, num_workers)
 
-        self.word_buffer = np.concatenate(word_array_list)
-        self.word_offsets = np.array(word_offsets, dtype=np.int32)
-        self.char_buffer = np.concatenate(char_array_list)
-        self.char_offsets = np.array(char_offsets, dtype=np.int32)
-        self.sizes = np.array(sizes, dtype=np.int32)
+        word_dtype, char_dtype = self._buffer_dtypes(word_dict, char_dict, embed_bytes)
+        self.word_buffer = pytorch_translate_data.concatenate_shards(
+            [shard[0] for shard in shards], dtype=word_dtype
+        )
+        self.sizes = pytorch_translate_data.concatenate_shards(
+            [shard[1] for shard in shards]
+        )
+        self.word_offsets = pytorch_translate_data.sizes_to_offsets(self.sizes)
+        self.char_buffer = pytorch_translate_data.concatenate_shards(
+            [shard[2] for shard in shards], dtype=char_dtype
+        )
+        self.char_offsets = pytorch_translate_data.sizes_to_offsets(
+            pytorch_translate_data.concatenate_shards([shard[3] for shard in shards])
+        )
 
-        del word_array_list, word_offsets, char_array_list, char_offsets, sizes
+        del shards
 
     @staticmethod
     def create_from_file(path):
@@ -137,6 +353,12 @@ class InMemoryNumpyWordCharDataset(data.indexed_dataset.IndexedDataset):
         return result
 
 
+def _parse_word_char_shard(*args):
+    # Module-level entry point for worker processes, see
+    # InMemoryNumpyWordCharDataset.parse().
+    return InMemoryNumpyWordCharDataset()._parse_shard(*args)
+
+
 class LanguagePairSourceCharDataset(data.LanguagePairDataset):
     """
     Version of fairseq.data.LanguagePairDataset which represents source
@@ -158,7 +380,7 @@ class LanguagePairSourceCharDataset(data.LanguagePairDataset):
         """
         src : InMemoryNumpyWordCharDataset
         tgt : InMemoryNumpyDataset
-        weights: Optional[IndexedInMemoryDataset]
+        weights: Optional[IndexedWeightsDataset]
         """
         super().__init__(
             src,
@@ -175,18 +397,10 @@ class LanguagePairSourceCharDataset(data.LanguagePairDataset):
         self.weights = weights
 
     def __getitem__(self, i):
-        example = {
-            "id": i,
-            "source_tokens": self.src.get_tokens(i).long(),
-            "source_chars_list": self.src.get_chars_list(i),
-        }
+        # Chars are gathered for the whole batch by the collater.
+        example = {"id": i, "source_tokens": self.src.get_tokens(i).long()}
         if self.tgt:
             example["target"] = self.tgt[i].long()
-        if self.weights:
-            example["weight"] = self.weights[i]
-        else:
-            example["weight"] = 1.0
-
         return example
 
     def __len__(self):
@@ -199,38 +413,13 @@ class LanguagePairSourceCharDataset(data.LanguagePairDataset):
 
         # sort in order of descending number of words
         samples.sort(key=lambda s: len(s["source_tokens"]), reverse=True)
-        max_words = len(samples[0]["source_tokens"])
-
         id = torch.LongTensor([s["id"] for s in samples])
-        src_lengths = torch.LongTensor([len(s["source_tokens"]) for s in samples])
 
-        weights = torch.FloatTensor([s["weight"] for s in samples])
+        weights = weighted_data.gather_weights(self.weights, id)
 
-        word_lengths = torch.LongTensor(len(samples), max_words).fill_(0)
-        for i, s in enumerate(samples):
-            word_lengths_array = np.array([len(w) for w in s["source_chars_list"]])
-            word_lengths[i, : word_lengths_array.size] = torch.LongTensor(
-                word_lengths_array
-            )
-        max_word_length = int(word_lengths.max())
-
-        src_tokens = (
-            samples[0]["source_tokens"].new(len(samples), max_words).fill_(self.pad_idx)
+        src_tokens, src_lengths, char_inds, word_lengths = self.src.collate_word_chars(
+            id.numpy(), self.pad_idx
         )
-        for i, s in enumerate(samples):
-            src_tokens[i, : len(s["source_tokens"])] = s["source_tokens"]
-
-        char_inds = (
-            samples[0]["source_chars_list"][0]
-            .new(len(samples), max_words, max_word_length)
-            .long()
-            .fill_(self.pad_idx)
-        )
-
-        for i, s in enumerate(samples):
-            chars_list = s["source_chars_list"]
-            for j, chars in enumerate(chars_list):
-                char_inds[i, j, : word_lengths[i, j]] = chars
 
         target = None
         prev_output_tokens = None
@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 
 import os
+import shutil
 import tempfile
-from typing import NamedTuple, Optional
+from typing import List, NamedTuple, Optional
 
 import numpy as np
 import torch
-from fairseq import data, tokenizer
-from pytorch_translate import dictionary as pytorch_translate_dictionary
+from fairseq import data
+from pytorch_translate import (
+    dictionary as pytorch_translate_dictionary,
+    mmap_format,
+    sharding,
+)
 
 
 # The n-th source|target language is represented with the token
@@ -17,6 +22,17 @@ MULTILING_DIALECT_ID_OFFSET = 10
 # Read bigger arrays from disc instead of memory
 ARRAY_SIZE_LIMIT_FOR_MEMORY = 10 ** 10  # 10GB
 
+# Binarized datasets are either written as a single .npz archive, which is
+# read into memory at load time, or in the memory-mapped format (see
+# mmap_format), which is mapped read-only into memory, so all processes on a
+# host share a single page-cache copy of the corpus.
+BINARY_FORMAT_NPZ = "npz"
+BINARY_FORMAT_MMAP = "mmap"
+BINARY_FORMATS = [BINARY_FORMAT_NPZ, BINARY_FORMAT_MMAP]
+
+# Number of elements per chunk of a ChunkedArrayWriter (16MB of int32).
+WRITER_CHUNK_SIZE = 2 ** 22
+
 
 class CorpusConfig(NamedTuple):
     dialect: str
@@ -36,51 +52,449 @@ class ParallelCorpusConfig(NamedTuple):
     weights_file: Optional[str]
 
 
+def concatenate_files(paths: List[str], output_path: str) -> None:
+    """Writes the contents of all files in `paths` to `output_path` and
+    removes them."""
+    with open(output_path, "wb") as output_file:
+        for path in paths:
+            with open(path, "rb") as f:
+                shutil.copyfileobj(f, output_file)
+            os.remove(path)
+
+
+class ChunkedArrayWriter:
+    """Flat, growable array of `dtype` which is written chunk by chunk.
+
+    Values are copied in place into a preallocated chunk of `chunk_size`
+    elements, so appending a sentence does not create any intermediate
+    arrays. Full chunks are either kept in memory or, if `spill_path` is
+    given, appended to the raw file at `spill_path` and the chunk is reused.
+    In the latter case memory use is bounded by the chunk size, no matter
+    how many values are written.
+    """
+
+    def __init__(self, dtype=np.int32, chunk_size=WRITER_CHUNK_SIZE, spill_path=None):
+        assert chunk_size > 0, "chunk_size must be positive"
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = chunk_size
+        self.spill_path = spill_path
+        self._spill_file = open(spill_path, "wb") if spill_path else None
+        self._full_chunks = []
+        self._chunk = np.empty(chunk_size, dtype=self.dtype)
+        self._fill = 0
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def extend(self, values):
+        """Appends the values of a list or 1-D array."""
+        num_values = len(values)
+        if self._fill + num_values <= self.chunk_size:
+            # Fast path: everything fits into the current chunk.
+            self._chunk[self._fill : self._fill + num_values] = values
+            self._fill += num_values
+        else:
+            pos = 0
+            while pos < num_values:
+                if self._fill == self.chunk_size:
+                    self._flush_chunk()
+                count = min(num_values - pos, self.chunk_size - self._fill)
+                self._chunk[self._fill : self._fill + count] = values[
+                    pos : pos + count
+                ]
+                self._fill += count
+                pos += count
+        self._length += num_values
+
+    def _flush_chunk(self):
+        if self._spill_file is not None:
+            self._chunk[: self._fill].tofile(self._spill_file)
+        else:
+            self._full_chunks.append(self._chunk)
+            self._chunk = np.empty(self.chunk_size, dtype=self.dtype)
+        self._fill = 0
+
+    def finalize(self) -> np.ndarray:
+        """Returns all values written so far as one flat array. If the writer
+        spills to a file, the file is completed and mapped read-only into
+        memory. No values can be appended afterwards."""
+        if self._spill_file is not None:
+            self._flush_chunk()
+            self._spill_file.close()
+            self._spill_file = None
+            array = mmap_format.map_raw_array(self.spill_path, self.dtype, self._length)
+        else:
+            array = np.concatenate(self._full_chunks + [self._chunk[: self._fill]])
+            self._full_chunks = []
+        self._chunk = None
+        return array
+
+
+def compact_dtype(max_value: int) -> np.dtype:
+    """Returns the narrowest unsigned integer dtype which holds all values in
+    [0, max_value], or int32 if max_value does not fit into 16 bits."""
+    for dtype in (np.uint8, np.uint16):
+        if max_value <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int32)
+
+
+def sizes_to_offsets(sizes: np.ndarray, dtype=np.int64) -> np.ndarray:
+    """Converts an array of n sizes to n + 1 offsets into a flat buffer. The
+    offsets are int64 by default, since large corpora have more than 2^31
+    tokens (or characters) in total."""
+    offsets = np.zeros(len(sizes) + 1, dtype=dtype)
+    np.cumsum(sizes, dtype=dtype, out=offsets[1:])
+    return offsets
+
+
+def range_indices(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Returns the concatenation of the index ranges
+    [starts[i], starts[i] + lengths[i]) as a single int64 array."""
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    range_offsets = sizes_to_offsets(lengths, dtype=np.int64)
+    return np.repeat(starts - range_offsets[:-1], lengths) + np.arange(
+        range_offsets[-1], dtype=np.int64
+    )
+
+
+def concatenate_shards(arrays: List[np.ndarray], dtype=np.int32) -> np.ndarray:
+    if len(arrays) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.concatenate(arrays).astype(dtype, copy=False)
+
+
+def _mix64(x: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer, applied elementwise to a uint64 array. Arithmetic
+    on uint64 arrays wraps around."""
+    x = x ^ (x >> np.uint64(30))
+    x *= np.uint64(0xBF58476D1CE4E5B9)
+    x ^= x >> np.uint64(27)
+    x *= np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    return x
+
+
+def hash_sentences(
+    buffer: np.ndarray, offsets: np.ndarray, max_chunk_tokens: int = 1 << 22
+) -> np.ndarray:
+    """Returns a 64-bit hash of the token ids of each sentence of a flat
+    buffer, which does not depend on the dtype of the buffer.
+
+    Each (token id, position) pair is mixed into a 64-bit value and the values
+    of a sentence are summed, so the hashes are computed with array
+    operations over chunks of up to `max_chunk_tokens` tokens (plus one
+    sentence) rather than per sentence.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    num_sentences = len(offsets) - 1
+    hashes = np.zeros(num_sentences, dtype=np.uint64)
+    start = 0
+    while start < num_sentences:
+        # Last sentence which ends within max_chunk_tokens, but at least one.
+        end = np.searchsorted(offsets, offsets[start] + max_chunk_tokens, "right")
+        end = min(max(int(end) - 1, start + 1), num_sentences)
+        chunk_offsets = offsets[start : end + 1] - offsets[start]
+        sizes = np.diff(chunk_offsets)
+        tokens = np.asarray(buffer[offsets[start] : offsets[end]], dtype=np.uint64)
+        positions = np.arange(len(tokens), dtype=np.int64) - np.repeat(
+            chunk_offsets[:-1], sizes
+        )
+        values = _mix64(tokens | (positions.astype(np.uint64) << np.uint64(32)))
+        sums = np.zeros(len(values) + 1, dtype=np.uint64)
+        np.cumsum(values, out=sums[1:])
+        sentence_sums = sums[chunk_offsets[1:]] - sums[chunk_offsets[:-1]]
+        hashes[start:end] = _mix64(
+            sentence_sums ^ sizes.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+        )
+        start = end
+    return hashes
+
+
+def find_duplicates(
+    hashes: np.ndarray, max_partition_size: int = 1 << 24
+) -> np.ndarray:
+    """Returns a boolean mask of the entries of `hashes` which are equal to
+    an earlier entry.
+
+    The hashes are partitioned by their high bits into partitions of about
+    `max_partition_size` entries, which are deduplicated one at a time. Apart
+    from the hashes and the mask, this needs 3 bytes per entry plus about
+    40 bytes per entry of the partition being processed.
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    duplicates = np.ones(len(hashes), dtype=bool)
+    partition_bits = 0
+    while partition_bits < 16 and len(hashes) >> partition_bits > max_partition_size:
+        partition_bits += 1
+    if partition_bits == 0:
+        _, first_occurrences = np.unique(hashes, return_index=True)
+        duplicates[first_occurrences] = False
+        return duplicates
+    partitions = (hashes >> np.uint64(64 - partition_bits)).astype(np.uint16)
+    for partition in range(1 << partition_bits):
+        ids = np.flatnonzero(partitions == partition)
+        # ids are ascending, so the first occurrence within the partition is
+        # the first occurrence overall.
+        _, first_occurrences = np.unique(hashes[ids], return_index=True)
+        duplicates[ids[first_occurrences]] = False
+    return duplicates
+
+
+def make_oversampling_index(
+    corpus_sizes: List[int], oversampling: List[int]
+) -> Optional[np.ndarray]:
+    """Maps each index of a virtually oversampled dataset to a sentence of the
+    underlying dataset, which holds the sentences of len(corpus_sizes) corpora
+    back to back. Each sentence of the n-th corpus is repeated oversampling[n]
+    times in a row.
+
+    Returns:
+        The index array, or None if no sentence is repeated or left out.
+    """
+    assert len(corpus_sizes) == len(oversampling), (
+        f"Got {len(oversampling)} oversampling rates for "
+        f"{len(corpus_sizes)} corpora."
+    )
+    if all(rate == 1 for rate in oversampling):
+        return None
+    repeats = np.repeat(
+        np.array(oversampling, dtype=np.int64), np.array(corpus_sizes, dtype=np.int64)
+    )
+    return np.repeat(np.arange(len(repeats), dtype=np.int64), repeats)
+
+
+def _parse_multilingual_shard(
+    corpus_config,
+    start,
+    end,
+    reverse_order,
+    append_eos,
+    prepend_language_id,
+    already_numberized,
+    dtype=np.int32,
+    spill_path=None,
+):
+    """Numberizes the lines of `corpus_config.data_file` which start in the
+    byte range [start, end). See InMemoryNumpyDataset.parse_multilingual().
+    Oversampling is not applied here.
+
+    Returns:
+        Tuple (buffer, sizes) of the flat token buffer of `dtype` and the
+        int32 sentence lengths of this shard. If spill_path is given, the
+        buffer is streamed to that file instead and None is returned for it.
+    """
+    prepend_ids = []
+    append_ids = []
+    if corpus_config.dialect_id is not None:
+        if prepend_language_id:
+            prepend_ids.append(corpus_config.dialect_id)
+        else:
+            append_ids.append(corpus_config.dialect_id)
+    lookup = (
+        pytorch_translate_dictionary.numberized_lookup if already_numberized else None
+    )
+    buffer_writer = ChunkedArrayWriter(dtype=dtype, spill_path=spill_path)
+    sizes_writer = ChunkedArrayWriter(dtype=np.int32)
+    for lines in sharding.read_line_blocks(corpus_config.data_file, start, end):
+        ids, offsets = corpus_config.dict.encode_lines(
+            lines,
+            append_eos=append_eos,
+            reverse_order=reverse_order,
+            prepend_ids=prepend_ids,
+            append_ids=append_ids,
+            lookup=lookup,
+            dtype=dtype,
+        )
+        buffer_writer.extend(ids)
+        sizes_writer.extend(np.diff(offsets))
+    buffer = buffer_writer.finalize()
+    if spill_path is not None:
+        # Memory maps would be copied when sent back to the parent process.
+        del buffer
+        buffer = None
+    return buffer, sizes_writer.finalize()
+
+
 class InMemoryNumpyDataset(data.indexed_dataset.IndexedDataset):
-    """analogous to fairseq.data.indexed_dataset.IndexedInMemoryDataset"""
+    """analogous to fairseq.data.indexed_dataset.IndexedInMemoryDataset
+
+    Multilingual datasets store each sentence once, even if its corpus is
+    oversampled. Oversampling is expressed by `index`, which maps the indices
+    of the dataset to sentences in `buffer`, so that it neither costs memory
+    nor disk space and can be changed with set_oversampling() after
+    binarization. `sizes` always has one entry per index of the dataset.
+    """
 
     def __init__(self):
         """Initialize empty dataset"""
         self.buffer = None
         self.offsets = None
         self.sizes = None
+        # Number of unique sentences of each corpus, and the oversampling
+        # rates applied to them. Only set by parse_multilingual().
+        self.corpus_sizes = None
+        self.oversampling = None
+        self.index = None
+        # Set if the buffer of a big legacy .npz has been copied to a
+        # temporary file, which we are responsible for deleting.
+        self._temp_buffer_path = None
 
     def __getitem__(self, i):
         assert i < self.__len__(), f"index {i} out of range!"
+        if self.index is not None:
+            i = self.index[i]
         a = self.buffer[self.offsets[i] : self.offsets[i + 1]]
-        return torch.from_numpy(a).long()
+        # astype() copies the slice, so the returned tensor never aliases a
+        # (possibly read-only, memory-mapped) buffer.
+        return torch.from_numpy(a.astype(np.int64))
 
     def __len__(self):
+        if self.index is not None:
+            return self.index.size
         # offsets includes 0 and end indices for each example
         return self.offsets.size - 1
 
-    def __del__(self):
-        if isinstance(self.buffer, np.memmap):
-            os.remove(self.buffer.filename)
+    def num_unique_sentences(self):
+        return self.offsets.size - 1
+
+    def set_oversampling(self, oversampling):
+        """Repeats each sentence of the n-th corpus oversampling[n] times.
+        Only the index is rebuilt, the stored sentences are unchanged."""
+        if self.corpus_sizes is None:
+            raise RuntimeError(
+                "Oversampling can only be set on datasets parsed with "
+                "parse_multilingual()."
+            )
+        self.oversampling = [int(rate) for rate in oversampling]
+        self.index = make_oversampling_index(self.corpus_sizes, self.oversampling)
+        unique_sizes = self.offsets[1:] - self.offsets[:-1]
+        self.sizes = unique_sizes if self.index is None else unique_sizes[self.index]
+
+    def boundary_tokens(self, last=False):
+        """Returns the first (or last) token of each sentence of the dataset,
+        e.g. the language IDs of multilingual datasets, in one gather over the
+        buffer. Sentences must not be empty."""
+        positions = self.offsets[1:] - 1 if last else self.offsets[:-1]
+        tokens = np.asarray(self.buffer[positions], dtype=np.int64)
+        return tokens if self.index is None else tokens[self.index]
+
+    def slice(self, start, end):
+        """Returns a dataset of the sentences [start, end) of this dataset,
+        which shares its buffer."""
+        assert self.index is None, "Cannot slice an oversampled dataset."
+        result = InMemoryNumpyDataset()
+        first, last = int(self.offsets[start]), int(self.offsets[end])
+        result.buffer = self.buffer[first:last]
+        result.offsets = np.asarray(self.offsets[start : end + 1]) - first
+        result.sizes = result.offsets[1:] - result.offsets[:-1]
+        return result
 
-    def save(self, path):
+    def select(self, indices):
+        """Returns an in-memory dataset of the sentences `indices` of this
+        dataset, in that order."""
+        assert self.index is None, "Cannot select from an oversampled dataset."
+        indices = np.asarray(indices, dtype=np.int64)
+        starts = self.offsets[indices].astype(np.int64)
+        result = InMemoryNumpyDataset()
+        result.sizes = (self.offsets[indices + 1] - starts).astype(np.int32)
+        result.offsets = sizes_to_offsets(result.sizes)
+        result.buffer = self.buffer[range_indices(starts, result.sizes)]
+        return result
+
+    @staticmethod
+    def concatenate(datasets):
+        """Copies the sentences of `datasets` into a single in-memory dataset,
+        in order."""
+        for dataset in datasets:
+            assert dataset.index is None, "Cannot concatenate oversampled datasets."
+        result = InMemoryNumpyDataset()
+        result.sizes = concatenate_shards(
+            [dataset.offsets[1:] - dataset.offsets[:-1] for dataset in datasets]
+        )
+        result.offsets = sizes_to_offsets(result.sizes)
+        result.buffer = concatenate_shards(
+            [dataset.buffer for dataset in datasets],
+            dtype=np.result_type(*[dataset.buffer.dtype for dataset in datasets]),
+        )
+        return result
+
+    def __del__(self):
+        if getattr(self, "_temp_buffer_path", None) is not None:
+            del self.buffer
+            os.remove(self._temp_buffer_path)
+            self._temp_buffer_path = None
+
+    def save(self, path, binary_format=BINARY_FORMAT_NPZ):
+        """Saves the unique sentences, along with the corpus sizes and
+        oversampling rates of multilingual datasets."""
         assert self.buffer is not None
         assert self.offsets is not None
-        np.savez(path, buffer=self.buffer, offsets=self.offsets)
+        arrays = {"buffer": self.buffer, "offsets": self.offsets}
+        if self.corpus_sizes is not None:
+            arrays["corpus_sizes"] = np.array(self.corpus_sizes, dtype=np.int64)
+            arrays["oversampling"] = np.array(self.oversampling, dtype=np.int64)
+        if binary_format == BINARY_FORMAT_MMAP:
+            arrays["sizes"] = self.offsets[1:] - self.offsets[:-1]
+            mmap_format.save_mmap_arrays(path, arrays, dataset=type(self).__name__)
+        else:
+            assert binary_format == BINARY_FORMAT_NPZ, binary_format
+            np.savez(path, **arrays)
+
+    def load(self, path, oversampling=None):
+        """Loads a binarized dataset. For multilingual datasets, the
+        oversampling rates used at binarization time can be overridden by
+        `oversampling`, without re-binarizing."""
+        self.corpus_sizes = None
+        self.oversampling = None
+        self.index = None
+        if mmap_format.read_mmap_header(path) is not None:
+            _, arrays = mmap_format.load_mmap_arrays(path)
+            if "buffer" not in arrays or "offsets" not in arrays:
+                raise RuntimeError(f"{path} does not appear to be a token dataset!")
+            self.buffer = arrays["buffer"]
+            self.offsets = arrays["offsets"]
+            if "sizes" in arrays:
+                self.sizes = arrays["sizes"]
+            else:
+                self.sizes = self.offsets[1:] - self.offsets[:-1]
+            self._load_oversampling(arrays, oversampling)
+            return
 
-    def load(self, path):
         npz = np.load(path)
+        buffer = npz["buffer"]
 
         # For big input data, we don't want the cpu to OOM.
         # Therefore, we are loading the huge buffer array into disc
-        # and reading it from disc instead of memory.
-        if npz["buffer"].nbytes > ARRAY_SIZE_LIMIT_FOR_MEMORY:
+        # and reading it from disc instead of memory. Prefer the memory-mapped
+        # format for such corpora, which avoids this copy entirely.
+        if buffer.nbytes > ARRAY_SIZE_LIMIT_FOR_MEMORY:
+            fd, self._temp_buffer_path = tempfile.mkstemp()
+            os.close(fd)
             self.buffer = np.memmap(
-                tempfile.NamedTemporaryFile().name,
-                dtype="float32",
+                self._temp_buffer_path,
+                dtype=buffer.dtype,
                 mode="w+",
-                shape=npz["buffer"].shape,
+                shape=buffer.shape,
             )
-            self.buffer[:] = npz["buffer"][:]
+            self.buffer[:] = buffer[:]
+            del buffer
         else:
-            self.buffer = npz["buffer"]
+            self.buffer = buffer
         self.offsets = npz["offsets"]
         self.sizes = self.offsets[1:] - self.offsets[:-1]
+        self._load_oversampling(npz, oversampling)
+
+    def _load_oversampling(self, arrays, oversampling=None):
+        if "corpus_sizes" not in arrays:
+            assert not oversampling, "Oversampling requires a multilingual dataset."
+            return
+        self.corpus_sizes = [int(size) for size in arrays["corpus_sizes"]]
+        if not oversampling:
+            oversampling = arrays["oversampling"]
+        self.set_oversampling(oversampling)
 
     def parse(
         self,
@@ -89,6 +503,8 @@ class InMemoryNumpyDataset(data.indexed_dataset.IndexedDataset):
         reverse_order=False,
         append_eos=False,
         already_numberized=False,
+        num_workers=1,
+        spill_path=None,
     ):
         self.parse_multilingual(
             [
@@ -99,7 +515,12 @@ class InMemoryNumpyDataset(data.indexed_dataset.IndexedDataset):
             reverse_order=reverse_order,
             append_eos=append_eos,
             already_numberized=already_numberized,
+            num_workers=num_workers,
+            spill_path=spill_path,
         )
+        # A single corpus without oversampling is a plain dataset.
+        self.corpus_sizes = None
+        self.oversampling = None
 
     def parse_multilingual(
         self,
@@ -108,6 +529,8 @@ class InMemoryNumpyDataset(data.indexed_dataset.IndexedDataset):
         append_eos=False,
         prepend_language_id=True,
         already_numberized=False,
+        num_workers=1,
+        spill_path=None,
     ):
         """Add sentences from text files to the dataset.
 
@@ -132,7 +555,9 @@ class InMemoryNumpyDataset(data.indexed_dataset.IndexedDataset):
 
         Args:
             corpora: List of MultilingualCorpusConfig. If dialect_id is not
-                None, it is added to the token sequence.
+                None, it is added to the token sequence. Each sentence is
+                stored once; oversampling only affects the index of the
+                dataset (see set_oversampling()).
             reverse_order (bool): Whether to reverse the integer token sequence.
             append_eos (bool): Whether to add the end-of-sentence symbol to each
                 sentence.
@@ -145,59 +570,174 @@ class InMemoryNumpyDataset(data.indexed_dataset.IndexedDataset):
                 already_numberized should be False (default) -- in which case
                 each line is tokenized with tokenizer then numberized with the
                 dictionary before being added to the output buffer.
+            num_workers (int): If > 1, each text file is split into
+                num_workers line-aligned shards which are numberized in a
+                pool of num_workers processes. The result is identical to
+                numberizing with a single process.
+            spill_path (str): If given, the token buffer is streamed chunk by
+                chunk to this raw file instead of being accumulated in
+                memory, and the dataset's buffer is memory-mapped from it.
+                Pass mmap_format.mmap_array_path(output_path, "buffer") to write the
+                buffer straight to its final location in the memory-mapped
+                format.
+
+        The token buffer uses the narrowest unsigned dtype which fits the
+        dictionaries (see compact_dtype()), which is stored along with it by
+        save(). Already numberized data is kept in int32.
 
         """
-        array_list = []
-        offsets = [0]
-        sizes = []
-        for corpus_config in corpora:
-            prepend_inds = []
-            append_inds = []
-            if append_eos:
-                append_inds.append(corpus_config.dict.eos_index)
-            if corpus_config.dialect_id is not None:
-                if prepend_language_id:
-                    prepend_inds.append(corpus_config.dialect_id)
-                else:
-                    append_inds.append(corpus_config.dialect_id)
-            with open(corpus_config.data_file, "r") as f:
-                for line in f:
-                    if already_numberized:
-                        inds = line.strip().split()
-                        inds = [int(ind) for ind in inds]
-                    else:
-                        words = tokenizer.tokenize_line(line)
-                        inds = [corpus_config.dict.index(w) for w in words]
-
-                    if reverse_order:
-                        inds.reverse()
-                    inds = prepend_inds + inds + append_inds
-                    for _ in range(corpus_config.oversampling):
-                        array_list.append(np.array(inds, dtype=np.int32))
-                        offsets.append(offsets[-1] + len(inds))
-                        sizes.append(len(inds))
-
-        self.buffer = np.concatenate(array_list)
-        self.offsets = np.array(offsets, dtype=np.int32)
-        self.sizes = np.array(sizes, dtype=np.int32)
-        del array_list
-        del offsets
-        del sizes
+        if already_numberized:
+            dtype = np.dtype(np.int32)
+        else:
+            max_index = max(len(corpus_config.dict) - 1 for corpus_config in corpora)
+            for corpus_config in corpora:
+                if corpus_config.dialect_id is not None:
+                    max_index = max(max_index, corpus_config.dialect_id)
+            dtype = compact_dtype(max_index)
+        shard_args = []
+        shard_corpus_ids = []
+        for corpus_id, corpus_config in enumerate(corpora):
+            offsets = sharding.find_line_offsets(corpus_config.data_file, num_workers)
+            for start, end in zip(offsets[:-1], offsets[1:]):
+                shard_corpus_ids.append(corpus_id)
+                shard_args.append(
+                    (
+                        corpus_config,
+                        start,
+                        end,
+                        reverse_order,
+                        append_eos,
+                        prepend_language_id,
+                        already_numberized,
+                        dtype,
+                    )
+                )
+        if spill_path is None:
+            shard_spill_paths = [None] * len(shard_args)
+        elif len(shard_args) == 1:
+            shard_spill_paths = [spill_path]
+        else:
+            shard_spill_paths = [
+                f"{spill_path}.shard{i}" for i in range(len(shard_args))
+            ]
+        shard_args = [
+            args + (shard_spill_path,)
+            for args, shard_spill_path in zip(shard_args, shard_spill_paths)
+        ]
+        shards = sharding.map_shards(_parse_multilingual_shard, shard_args, num_workers)
+
+        corpus_sizes = [0] * len(corpora)
+        for corpus_id, (_, sizes) in zip(shard_corpus_ids, shards):
+            corpus_sizes[corpus_id] += len(sizes)
+        self.sizes = concatenate_shards([sizes for _, sizes in shards])
+        self.offsets = sizes_to_offsets(self.sizes)
+        if spill_path is None:
+            self.buffer = concatenate_shards(
+                [buffer for buffer, _ in shards], dtype=dtype
+            )
+        else:
+            if len(shard_spill_paths) > 1:
+                concatenate_files(shard_spill_paths, spill_path)
+            self.buffer = mmap_format.map_raw_array(
+                spill_path, dtype, int(self.offsets[-1])
+            )
+        del shards
+        self.corpus_sizes = corpus_sizes
+        self.set_oversampling([corpus_config.oversampling for corpus_config in corpora])
 
     @staticmethod
-    def create_from_file(path):
+    def create_from_file(path, oversampling=None):
         result = InMemoryNumpyDataset()
-        result.load(path)
+        result.load(path, oversampling=oversampling)
         return result
 
 
+class InMemoryNumpyRawTextDataset(InMemoryNumpyDataset):
+    """Numberizes a text file at load time, like IndexedRawTextDataset, into
+    the flat buffer and offsets of an InMemoryNumpyDataset. The original
+    lines are kept as a single UTF-8 blob with offsets for
+    get_original_text(), so that no Python object is kept per sentence."""
+
+    def __init__(self, path, dictionary, append_eos=True, reverse_order=False):
+        super().__init__()
+        self.append_eos = append_eos
+        self.reverse_order = reverse_order
+        self.text = None
+        self.text_offsets = None
+        self.read_data(path, dictionary)
+
+    def read_data(self, path, dictionary):
+        """Numberizes the file a block of lines at a time, so that there is
+        never a Python string per line of the whole file."""
+        dtype = compact_dtype(len(dictionary) - 1)
+        buffer_writer = ChunkedArrayWriter(dtype=dtype)
+        sizes_writer = ChunkedArrayWriter(dtype=np.int32)
+        # Lines are split and their newlines translated to "\n" as in text
+        # mode. Each line of the blob ends with "\n", including the last one.
+        text = bytearray()
+        for lines in sharding.read_line_blocks(path):
+            if not lines[-1].endswith("\n"):
+                lines[-1] += "\n"
+            text += "".join(lines).encode("utf-8")
+            ids, offsets = dictionary.encode_lines(
+                (line[:-1] for line in lines),
+                append_eos=self.append_eos,
+                reverse_order=self.reverse_order,
+                dtype=dtype,
+            )
+            buffer_writer.extend(ids)
+            sizes_writer.extend(np.diff(offsets))
+        self.buffer = buffer_writer.finalize()
+        self.sizes = sizes_writer.finalize()
+        self.offsets = sizes_to_offsets(self.sizes)
+        # A bytearray rather than bytes, which would copy the whole blob.
+        self.text = text
+        # Line i is text[text_offsets[i] : text_offsets[i + 1] - 1], without
+        # its newline.
+        newlines = np.flatnonzero(np.frombuffer(self.text, dtype=np.uint8) == 10)
+        self.text_offsets = np.zeros(len(newlines) + 1, dtype=np.int64)
+        self.text_offsets[1:] = newlines + 1
+
+    def get_original_text(self, i):
+        assert i < self.__len__(), f"index {i} out of range!"
+        start, end = self.text_offsets[i], self.text_offsets[i + 1] - 1
+        return self.text[start:end].decode("utf-8")
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(path)
+
+
 def is_multilingual(args):
     if hasattr(args, "multiling_encoder_lang"):
         return bool(args.multiling_encoder_lang)
     return args.multiling_source_lang is not None
 
 
-class IndexedRawTextDatasetWithLangId(data.IndexedRawTextDataset):
+class IndexedRawTextDataset(data.IndexedRawTextDataset):
+    """fairseq.data.IndexedRawTextDataset which numberizes the whole text file
+    with a single call of Dictionary.encode_lines(). Original lines are also
+    kept in memory."""
+
+    def read_data(self, path, dictionary):
+        self.read_and_encode_lines(path, dictionary)
+
+    def read_and_encode_lines(self, path, dictionary, prepend_ids=(), append_ids=()):
+        with open(path, "r", encoding="utf-8") as f:
+            self.lines = [line.strip("\n") for line in f]
+        ids, offsets = dictionary.encode_lines(
+            self.lines,
+            append_eos=self.append_eos,
+            reverse_order=self.reverse_order,
+            prepend_ids=prepend_ids,
+            append_ids=append_ids,
+        )
+        self.sizes = offsets[1:] - offsets[:-1]
+        # Views into a single tensor holding the ids of all lines.
+        self.tokens_list = list(torch.from_numpy(ids).split(self.sizes.tolist()))
+
+
+class IndexedRawTextDatasetWithLangId(IndexedRawTextDataset):
     """Adds language IDs to an IndexedRawTextDataset"""
 
     def __init__(
@@ -219,14 +759,8 @@ class IndexedRawTextDatasetWithLangId(data.IndexedRawTextDataset):
         )
 
     def read_data(self, path, dictionary):
-        super(IndexedRawTextDatasetWithLangId, self).read_data(path, dictionary)
-        # Postprocess self.tokens_list and self.sizes
-        self.sizes += 1
-        lang_id_tensor = torch.LongTensor([self.lang_id + MULTILING_DIALECT_ID_OFFSET])
-
-        def add_lang_id(tokens):
-            if self.prepend_language_id:
-                return torch.cat([lang_id_tensor, tokens])
-            return torch.cat([tokens, lang_id_tensor])
-
-        self.tokens_list = [add_lang_id(t) for t in self.tokens_list]
+        lang_ids = [self.lang_id + MULTILING_DIALECT_ID_OFFSET]
+        if self.prepend_language_id:
+            self.read_and_encode_lines(path, dictionary, prepend_ids=lang_ids)
+        else:
+            self.read_and_encode_lines(path, dictionary, append_ids=lang_ids)
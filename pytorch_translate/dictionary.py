@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
 
+import itertools
 import os
 import re
-from typing import Dict, List, Optional, Set
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
 
+import numpy as np
 from fairseq.data import dictionary
-from pytorch_translate import vocab_constants
+from pytorch_translate import mmap_format, sharding, vocab_constants
 
 
 TAGS = [
@@ -22,6 +25,11 @@ TAGS = [
 
 SPACE_NORMALIZER = re.compile(r"\s+")
 
+# Dictionaries are saved as text files, and additionally in the memory-mapped
+# format next to them, which is much faster to load. The binary copy is only
+# used while the text file is unchanged.
+BINARY_DICTIONARY_SUFFIX = ".mmap"
+
 
 def default_dictionary_path(save_dir: str, dialect: str) -> str:
     return os.path.join(save_dir, f"dictionary-{dialect}.txt")
@@ -31,6 +39,15 @@ def default_char_dictionary_path(save_dir: str, dialect: str) -> str:
     return os.path.join(save_dir, f"char-dictionary-{dialect}.txt")
 
 
+def binary_dictionary_path(path: str) -> str:
+    return f"{path}{BINARY_DICTIONARY_SUFFIX}"
+
+
+def _file_stamp(path: str) -> List[int]:
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
 def tokenize_line(line, embed_bytes=False):
     line = SPACE_NORMALIZER.sub(" ", line)
     line = line.strip()
@@ -48,6 +65,52 @@ def char_tokenize_line(line):
     return chars
 
 
+def numberized_lookup(tokens: List) -> np.ndarray:
+    """Lookup backend for encode_lines() if the tokens already are indices,
+    either as ints or as strings of digits."""
+    return np.array(tokens, dtype=np.int64)
+
+
+def layout_token_ids(
+    token_ids: np.ndarray,
+    num_tokens: np.ndarray,
+    prefix_ids: Sequence[int] = (),
+    suffix_ids: Sequence[int] = (),
+    reverse_order: bool = False,
+    dtype=np.int64,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Scatters the flat ids of the tokens of several lines, where line i has
+    num_tokens[i] tokens, into the layout
+        prefix_ids + line tokens (reversed if reverse_order) + suffix_ids
+    per line, without a Python-level loop over lines or tokens.
+
+    Returns:
+        Tuple (ids, offsets) of the flat ids of all lines and the
+        len(num_tokens) + 1 offsets of the lines into them.
+    """
+    num_tokens = np.asarray(num_tokens, dtype=np.int64)
+    num_lines = len(num_tokens)
+    sizes = num_tokens + len(prefix_ids) + len(suffix_ids)
+    offsets = np.zeros(num_lines + 1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+    ids = np.empty(offsets[-1], dtype=dtype)
+    # Position of the first token of each line.
+    starts = offsets[:-1] + len(prefix_ids)
+    if len(token_ids) > 0:
+        # Position of each token in token_ids relative to its line.
+        line_of_token = np.repeat(np.arange(num_lines), num_tokens)
+        token_starts = np.cumsum(num_tokens) - num_tokens
+        position = np.arange(len(token_ids)) - token_starts[line_of_token]
+        if reverse_order:
+            position = num_tokens[line_of_token] - 1 - position
+        ids[starts[line_of_token] + position] = token_ids
+    for i, prefix_id in enumerate(prefix_ids):
+        ids[offsets[:-1] + i] = prefix_id
+    for i, suffix_id in enumerate(suffix_ids):
+        ids[starts + num_tokens + i] = suffix_id
+    return ids, offsets
+
+
 def add_file_to_dictionary(filename, dict, tokenize):
     with open(filename, "r", encoding="utf-8") as f:
         for line in f:
@@ -56,6 +119,55 @@ def add_file_to_dictionary(filename, dict, tokenize):
             dict.add_symbol(dict.eos_word)
 
 
+def count_tokens_in_shard(
+    filename: str, start: int, end: int, tokenize: Callable, eos_word: str
+) -> Counter:
+    """Counts the tokens of the lines of `filename` which start in the byte
+    range [start, end), plus one `eos_word` per line."""
+    counts = Counter()
+    num_lines = 0
+    for line in sharding.read_lines(filename, start, end):
+        counts.update(tokenize(line))
+        num_lines += 1
+    if num_lines > 0:
+        counts[eos_word] += num_lines
+    return counts
+
+
+def count_tokens(
+    corpus_files: List[str], tokenize: Callable, eos_word: str, num_workers: int = 1
+) -> Counter:
+    """Counts the tokens of all corpus files, which are split into
+    line-aligned shards counted in a pool of `num_workers` processes.
+
+    The per-shard counts are merged in file order, so tokens are ordered by
+    their first occurrence like with add_file_to_dictionary(). This keeps the
+    order of equally frequent tokens in the finalized dictionary unchanged.
+    """
+    shard_args = []
+    for corpus_file in corpus_files:
+        offsets = sharding.find_line_offsets(corpus_file, num_workers)
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            shard_args.append((corpus_file, start, end, tokenize, eos_word))
+    counts = Counter()
+    for shard_counts in sharding.map_shards(
+        count_tokens_in_shard, shard_args, num_workers
+    ):
+        counts.update(shard_counts)
+    return counts
+
+
+def read_lexicon(filename: str) -> Set[str]:
+    """Reads the single-token lines of `filename`."""
+    lexicon = set()
+    with open(filename, "r", encoding="utf-8") as f:
+        for line in f:
+            tokens = line.strip().split()
+            if len(tokens) == 1:
+                lexicon.add(tokens[0])
+    return lexicon
+
+
 class Dictionary(dictionary.Dictionary):
     """A mapping from symbols to consecutive integers"""
 
@@ -69,7 +181,7 @@ class Dictionary(dictionary.Dictionary):
         self.unk_word, self.pad_word, self.eos_word = unk, pad, eos
         self.symbols: List[str] = []
         self.count: List[int] = []
-        self.indices: Dict[str, int] = {}
+        self.indices = {}
         self.lexicon_indices: Set[int] = set()
 
         self.pad_index = self.add_symbol(pad)
@@ -92,9 +204,150 @@ class Dictionary(dictionary.Dictionary):
         self.nspecial = len(self.symbols)
         assert self.nspecial == max_special_tokens
 
+    @property
+    def indices(self) -> Dict[str, int]:
+        # Dictionaries loaded from the binary format build the mapping from
+        # symbols to indices on first use.
+        if self._indices is None:
+            self._indices = {symbol: i for i, symbol in enumerate(self.symbols)}
+        return self._indices
+
+    @indices.setter
+    def indices(self, indices: Optional[Dict[str, int]]) -> None:
+        self._indices = indices
+
     def lexicon_indices_list(self) -> List[int]:
         return list(self.lexicon_indices)
 
+    def save(self, f) -> None:
+        """Saves the dictionary as text. If `f` is a path, the dictionary is
+        also saved in the binary format next to it."""
+        super().save(f)
+        if isinstance(f, str):
+            self.save_binary(f)
+
+    def save_binary(self, path: str) -> None:
+        """Saves the symbols and counts of the text dictionary at `path` to
+        binary_dictionary_path(path): the symbols as one UTF-8 blob with the
+        character offsets of each symbol, the counts, and the special tokens.
+        """
+        symbols = self.symbols[self.nspecial :]
+        symbol_offsets = np.zeros(len(symbols) + 1, dtype=np.int64)
+        np.cumsum([len(symbol) for symbol in symbols], out=symbol_offsets[1:])
+        mmap_format.save_mmap_arrays(
+            binary_dictionary_path(path),
+            {
+                "symbols": np.frombuffer(
+                    "".join(symbols).encode("utf-8"), dtype=np.uint8
+                ),
+                "symbol_offsets": symbol_offsets,
+                "counts": np.array(self.count[self.nspecial :], dtype=np.int64),
+            },
+            dictionary=type(self).__name__,
+            nspecial=self.nspecial,
+            special_words=[self.pad_word, self.eos_word, self.unk_word],
+            text_file=_file_stamp(path),
+        )
+
+    @classmethod
+    def load(cls, f, ignore_utf_errors=False):
+        """Loads a text dictionary, from its binary copy if possible."""
+        if isinstance(f, str):
+            d = cls.load_binary(f)
+            if d is not None:
+                return d
+        return super().load(f, ignore_utf_errors)
+
+    @classmethod
+    def load_binary(cls, path: str) -> Optional["Dictionary"]:
+        """Loads the binary copy of the text dictionary at `path`. Returns
+        None if there is none, or if it does not match the text file or the
+        special tokens of this class."""
+        binary_path = binary_dictionary_path(path)
+        if not os.path.isfile(path) or not os.path.isfile(binary_path):
+            return None
+        header = mmap_format.read_mmap_header(binary_path)
+        if header is None or header.get("text_file") != _file_stamp(path):
+            return None
+        d = cls()
+        special_words = [d.pad_word, d.eos_word, d.unk_word]
+        if (
+            header["nspecial"] != d.nspecial
+            or header["special_words"] != special_words
+        ):
+            return None
+        _, arrays = mmap_format.load_mmap_arrays(binary_path)
+        text = arrays["symbols"].tobytes().decode("utf-8")
+        symbol_offsets = arrays["symbol_offsets"].tolist()
+        d.symbols.extend(
+            text[start:end]
+            for start, end in zip(symbol_offsets[:-1], symbol_offsets[1:])
+        )
+        d.count.extend(arrays["counts"].tolist())
+        d.indices = None
+        return d
+
+    def lookup_tokens(self, tokens: List[str]) -> np.ndarray:
+        """Maps each token to its index, or to unk_index if it is unknown.
+        This is the default lookup backend of encode_lines(): the dictionary
+        look-ups run in a single pass of C code over the token list."""
+        return np.fromiter(
+            map(self.indices.get, tokens, itertools.repeat(self.unk_index)),
+            dtype=np.int64,
+            count=len(tokens),
+        )
+
+    def encode_lines(
+        self,
+        lines: Iterable,
+        tokenize: Optional[Callable[[str], List[str]]] = tokenize_line,
+        append_eos: bool = False,
+        reverse_order: bool = False,
+        prepend_ids: Sequence[int] = (),
+        append_ids: Sequence[int] = (),
+        lookup: Optional[Callable[[List], np.ndarray]] = None,
+        dtype=np.int64,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Numberizes a block of lines at once. Each line is encoded as
+
+            prepend_ids + token ids + [eos_index] + append_ids
+
+        where the token ids are reversed if reverse_order is True, and the
+        EOS index is only added if append_eos is True.
+
+        Args:
+            lines: Strings, or lists of tokens if tokenize is None.
+            tokenize: Splits a line into tokens.
+            lookup: Maps a flat list with the tokens of all lines to an array
+                of their indices. Defaults to lookup_tokens(). Can be replaced
+                by a faster backend, or by numberized_lookup() for lines of
+                indices.
+            dtype: dtype of the returned ids.
+
+        Returns:
+            Tuple (ids, offsets), where ids[offsets[i] : offsets[i + 1]] are
+            the ids of the i-th line.
+        """
+        if tokenize is None:
+            token_lists = list(lines)
+        else:
+            token_lists = [tokenize(line) for line in lines]
+        num_tokens = np.fromiter(
+            map(len, token_lists), dtype=np.int64, count=len(token_lists)
+        )
+        if lookup is None:
+            lookup = self.lookup_tokens
+        token_ids = lookup(list(itertools.chain.from_iterable(token_lists)))
+        suffix_ids = ([self.eos_index] if append_eos else []) + list(append_ids)
+        return layout_token_ids(
+            token_ids,
+            num_tokens,
+            prefix_ids=prepend_ids,
+            suffix_ids=suffix_ids,
+            reverse_order=reverse_order,
+            dtype=dtype,
+        )
+
     @classmethod
     def build_vocab_file(
         cls,
@@ -105,6 +358,7 @@ class Dictionary(dictionary.Dictionary):
         is_char_vocab: bool = False,
         embed_bytes: bool = False,
         padding_factor: int = 8,
+        num_workers: int = 1,
     ) -> "Dictionary":  # https://www.python.org/dev/peps/pep-0484/#forward-references
         d = cls()
 
@@ -114,19 +368,15 @@ class Dictionary(dictionary.Dictionary):
         # if we are embedding byte ids then no need to add these to the dict
         # the ids an be obtained directly from the character
         if not embed_bytes:
-            for corpus_file in corpus_files:
-                add_file_to_dictionary(filename=corpus_file, dict=d, tokenize=tokenize)
+            counts = count_tokens(
+                corpus_files, tokenize, eos_word=d.eos_word, num_workers=num_workers
+            )
+            for token, count in counts.items():
+                d.add_symbol(token, n=count)
 
         # Set indices to receive penalty
         if tokens_with_penalty:
-            # Assume input tokens are unique
-            lexicon = []
-            with open(tokens_with_penalty, "r", encoding="utf-8") as f:
-                for line in f:
-                    tokens = line.strip().split()
-                    if len(tokens) == 1:
-                        lexicon.append(tokens[0])
-
+            lexicon = read_lexicon(tokens_with_penalty)
             for token, token_index in d.indices.items():
                 if token in lexicon:
                     d.lexicon_indices.add(token_index)
@@ -151,6 +401,7 @@ class Dictionary(dictionary.Dictionary):
         is_char_vocab: bool = False,
         embed_bytes: bool = False,
         padding_factor: int = 8,
+        num_workers: int = 1,
     ) -> "Dictionary":  # https://www.python.org/dev/peps/pep-0484/#forward-references
         if os.path.isfile(vocab_file):
             d = cls.load(vocab_file)
@@ -172,6 +423,7 @@ class Dictionary(dictionary.Dictionary):
             is_char_vocab=is_char_vocab,
             embed_bytes=embed_bytes,
             padding_factor=padding_factor,
+            num_workers=num_workers,
         )
 
 
@@ -68,6 +68,19 @@ class TranslationInfo(NamedTuple):
     hypo_score: float
 
 
+def need_attention(args):
+    """Whether generation needs the attention of the models. Beam search and
+    sampling only use it for the alignments of --replace-unk and
+    --print-alignment."""
+    if getattr(args, "source_ensembling", False) or getattr(
+        args, "competing_completed_beam_search", False
+    ):
+        return True
+    return bool(getattr(args, "replace_unk", None)) or getattr(
+        args, "print_alignment", False
+    )
+
+
 def build_sequence_generator(args, task, models):
     use_cuda = torch.cuda.is_available() and not args.cpu
     # Initialize generator
@@ -75,13 +88,22 @@ def build_sequence_generator(args, task, models):
     if args.model_weights:
         model_weights = [float(w.strip()) for w in args.model_weights.split(",")]
     use_char_source = isinstance(models[0], char_source_model.CharSourceModel)
+    translator_kwargs = {}
     # Use a different sequence generator in the multisource setting
     if getattr(args, "source_ensembling", False):
         translator_class = multisource_decode.MultiSourceSequenceGenerator
     elif getattr(args, "competing_completed_beam_search", False):
         translator_class = competing_completed.CompetingCompletedSequenceGenerator
+    elif getattr(args, "sampling", False):
+        translator_class = beam_decode.SamplingSequenceGenerator
+        translator_kwargs = {
+            "sampling_topk": args.sampling_topk,
+            "sampling_topp": args.sampling_topp,
+            "sampling_temperature": args.sampling_temperature,
+        }
     else:
         translator_class = beam_decode.SequenceGenerator
+        translator_kwargs = {"need_attn": need_attention(args)}
     translator = translator_class(
         models,
         tgt_dict=task.target_dictionary,
@@ -93,6 +115,7 @@ def build_sequence_generator(args, task, models):
         word_reward=args.word_reward,
         model_weights=model_weights,
         use_char_source=use_char_source,
+        **translator_kwargs,
     )
     if use_cuda:
         translator.cuda()
@@ -126,7 +149,7 @@ def _generate_score(models, args, task, dataset, optimize=True):
         for model in models:
             model.make_generation_fast_(
                 beamable_mm_beam_size=None if args.no_beamable_mm else args.beam,
-                need_attn=True,
+                need_attn=need_attention(args),
             )
 
     translator = build_sequence_generator(args, task, models)
@@ -234,10 +257,13 @@ def _iter_first_best_bilingual(args, task, dataset, translations, align_dict):
 
         # Process top predictions
         for i, hypo in enumerate(hypos[: min(len(hypos), args.nbest)]):
+            # There are no alignments when sampling or without --replace-unk
+            # and --print-alignment.
+            alignment = hypo["alignment"]
             hypo_tokens, hypo_str, alignment = utils.post_process_prediction(
                 hypo_tokens=hypo["tokens"].int().cpu(),
                 src_str=src_str,
-                alignment=hypo["alignment"].int().cpu(),
+                alignment=alignment.int().cpu() if alignment is not None else None,
                 align_dict=align_dict,
                 tgt_dict=task.target_dictionary,
                 remove_bpe=args.remove_bpe,
@@ -245,12 +271,13 @@ def _iter_first_best_bilingual(args, task, dataset, translations, align_dict):
 
             if not args.quiet:
                 print(f"H-{sample_id}\t{hypo['score']}\t{hypo_str}")
-                print(
-                    "A-{}\t{}".format(
-                        sample_id,
-                        " ".join(map(lambda x: str(utils.item(x)), alignment)),
+                if alignment is not None:
+                    print(
+                        "A-{}\t{}".format(
+                            sample_id,
+                            " ".join(map(lambda x: str(utils.item(x)), alignment)),
+                        )
                     )
-                )
 
             if i == 0:
                 if align_dict is not None or args.remove_bpe is not None:
@@ -316,10 +343,13 @@ def _iter_first_best_multilingual(args, task, dataset, translations, align_dict)
 
         # Process top predictions
         for i, hypo in enumerate(hypos[: min(len(hypos), args.nbest)]):
+            # There are no alignments when sampling or without --replace-unk
+            # and --print-alignment.
+            alignment = hypo["alignment"]
             hypo_tokens, hypo_str, alignment = utils.post_process_prediction(
                 hypo_tokens=hypo["tokens"].int().cpu()[1:],
                 src_str=src_str,
-                alignment=hypo["alignment"].int().cpu()[1:],
+                alignment=alignment.int().cpu()[1:] if alignment is not None else None,
                 align_dict=align_dict,
                 tgt_dict=target_dict,
                 remove_bpe=args.remove_bpe,
@@ -327,12 +357,13 @@ def _iter_first_best_multilingual(args, task, dataset, translations, align_dict)
 
             if not args.quiet:
                 print(f"H-{sample_id}\t{hypo['score']}\t{hypo_str}")
-                print(
-                    "A-{}\t{}".format(
-                        sample_id,
-                        " ".join(map(lambda x: str(utils.item(x)), alignment)),
+                if alignment is not None:
+                    print(
+                        "A-{}\t{}".format(
+                            sample_id,
+                            " ".join(map(lambda x: str(utils.item(x)), alignment)),
+                        )
                     )
-                )
 
             # Score only the top hypothesis
             if i == 0:
@@ -499,6 +530,10 @@ def main():
 
 def validate_args(args):
     pytorch_translate_options.validate_generation_args(args)
+    if args.sampling:
+        assert (
+            not args.replace_unk
+        ), "--replace-unk needs alignments, which --sampling does not compute"
 
     assert args.path is not None, "--path required for generation!"
     assert args.source_vocab_file and os.path.isfile(
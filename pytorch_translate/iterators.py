@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+import queue
+import threading
+from typing import Any, Iterable
+
+import torch
+
+
+def pin_memory(sample: Any) -> Any:
+    """Copies the tensors of a (nested) sample to page-locked memory, so that
+    they can be copied to the GPU asynchronously."""
+    if torch.is_tensor(sample):
+        return sample.pin_memory()
+    if isinstance(sample, dict):
+        return {key: pin_memory(value) for key, value in sample.items()}
+    if isinstance(sample, list):
+        return [pin_memory(value) for value in sample]
+    if isinstance(sample, tuple):
+        return tuple(pin_memory(value) for value in sample)
+    return sample
+
+
+class PrefetchIterator(object):
+    """Iterates over `iterable` while a background thread collates up to
+    `num_batches` batches ahead of the consumer (fairseq's iterators collate
+    each batch when it is requested). Batches are yielded in the order of
+    `iterable`, so the number of batches consumed is the same as without
+    prefetching.
+
+    Exceptions raised by `iterable`, including BaseExceptions such as
+    KeyboardInterrupt, are re-raised in the consumer. close() must be called
+    if the iteration is stopped early, to stop the thread.
+    """
+
+    _END = object()
+
+    def __init__(self, iterable: Iterable, num_batches: int, pin_memory=False):
+        assert num_batches > 0, "num_batches must be positive."
+        self.iterable = iterable
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self._queue = queue.Queue(maxsize=num_batches)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+
+    def _put(self, item) -> bool:
+        """Blocks until there is room for item in the queue, unless the
+        iterator is closed. Returns whether item was queued."""
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self):
+        # The consumer blocks until it gets an item, so one is always queued
+        # when the thread ends, whatever is raised (e.g. KeyboardInterrupt).
+        last_item = (None, RuntimeError("Prefetch thread ended unexpectedly."))
+        try:
+            for sample in self.iterable:
+                if self.pin_memory:
+                    sample = pin_memory(sample)
+                if not self._put((sample, None)):
+                    return
+            last_item = (self._END, None)
+        except BaseException as e:
+            last_item = (None, e)
+        finally:
+            self._put(last_item)
+
+    def __len__(self):
+        return len(self.iterable)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._stop.is_set():
+            raise StopIteration
+        sample, error = self._queue.get()
+        if error is not None:
+            self.close()
+            raise error
+        if sample is self._END:
+            self.close()
+            raise StopIteration
+        return sample
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
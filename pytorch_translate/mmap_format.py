@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import zipfile
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+
+# Arrays in the memory-mapped format are stored as a small JSON header at
+# `path`, and one raw, uncompressed file per array stored next to it
+# (<path>.buffer, <path>.offsets, ...), which is mapped read-only into memory.
+MMAP_FORMAT_NAME = "pytorch_translate_mmap"
+MMAP_FORMAT_VERSION = 1
+
+
+def mmap_array_path(path: str, name: str) -> str:
+    """Path of the raw file holding array `name` of the dataset at `path`."""
+    return f"{path}.{name}"
+
+
+def read_mmap_header(path: str) -> Optional[Dict[str, Any]]:
+    """Returns the header of a memory-mapped binary dataset, or None if the
+    file at `path` is not in the memory-mapped format (e.g. a legacy .npz)."""
+    if zipfile.is_zipfile(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            header = json.load(f)
+    except (UnicodeDecodeError, ValueError):
+        return None
+    if not isinstance(header, dict) or header.get("format") != MMAP_FORMAT_NAME:
+        return None
+    return header
+
+
+def save_mmap_arrays(
+    path: str, arrays: Dict[str, np.ndarray], **metadata
+) -> Dict[str, Any]:
+    """Writes each array of `arrays` uncompressed to its own file next to
+    `path`, and a JSON header describing them to `path` itself. Additional
+    keyword arguments are stored in the header as is.
+
+    The header is written last, so that a partially written dataset is never
+    mistaken for a complete one."""
+    header = {
+        "format": MMAP_FORMAT_NAME,
+        "version": MMAP_FORMAT_VERSION,
+        "arrays": {},
+    }
+    header.update(metadata)
+    for name, array in arrays.items():
+        array_path = mmap_array_path(path, name)
+        # Arrays which have been streamed to their final location (see
+        # data.ChunkedArrayWriter) are already in place.
+        if not _is_mapped_from(array, array_path):
+            array = np.ascontiguousarray(array)
+            array.tofile(array_path)
+        header["arrays"][name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+        }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(header, f, indent=2)
+    return header
+
+
+def _is_mapped_from(array: np.ndarray, path: str) -> bool:
+    """Whether `array` is a memory map of the complete file at `path`."""
+    return (
+        isinstance(array, np.memmap)
+        and array.filename == os.path.abspath(path)
+        and array.offset == 0
+        and array.flags["C_CONTIGUOUS"]
+        and os.path.getsize(path) == array.nbytes
+    )
+
+
+def load_mmap_arrays(path: str) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    """Maps all arrays of the memory-mapped binary dataset at `path` read-only
+    into memory. Nothing is read from disk until the arrays are accessed."""
+    header = read_mmap_header(path)
+    if header is None:
+        raise RuntimeError(f"{path} is not a memory-mapped binary dataset!")
+    if header["version"] > MMAP_FORMAT_VERSION:
+        raise RuntimeError(
+            f"{path} was written with version {header['version']} of the "
+            f"memory-mapped format, but only versions up to "
+            f"{MMAP_FORMAT_VERSION} are supported."
+        )
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        shape = tuple(spec["shape"])
+        if int(np.prod(shape)) == 0:
+            # Empty files cannot be memory-mapped.
+            arrays[name] = np.zeros(shape, dtype=dtype)
+        else:
+            arrays[name] = np.memmap(
+                mmap_array_path(path, name), dtype=dtype, mode="r", shape=shape
+            )
+    return header, arrays
+
+
+def map_raw_array(path: str, dtype, length: int) -> np.ndarray:
+    """Maps the flat array of `length` elements stored in the raw file at
+    `path` read-only into memory."""
+    if length == 0:
+        # Empty files cannot be memory-mapped.
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(length,))
@@ -2,6 +2,7 @@
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from fairseq.models import FairseqEncoder, FairseqIncrementalDecoder
 from pytorch_translate import data as pytorch_translate_data, utils
 
@@ -23,6 +24,37 @@ def register_hooks(module, submodules):
             p.register_hook(create_hook_fn(module, idx))
 
 
+def single_lang_id(lang_ids, modules):
+    """Returns the language ID shared by all examples of a batch if there is a
+    module for it (e.g. with --multiling-homogeneous-batches), or None."""
+    lang_id = int(lang_ids[0])
+    if (
+        0 <= lang_id < len(modules)
+        and modules[lang_id] is not None
+        and bool((lang_ids == lang_id).all())
+    ):
+        return lang_id
+    return None
+
+
+def set_missing_grads(module, lang_id, submodules):
+    """Sets the bookkeeping of a batch in which all `module.last_bsz` examples
+    are in language `lang_id`. Parameters of the other languages only get zero
+    gradients if they have none yet; otherwise the gradients left by
+    optimizer.zero_grad() and earlier batches are kept as they are."""
+    module.last_lang_bszs = []
+    for idx, submodule in enumerate(submodules):
+        if submodule is None:
+            continue
+        if idx == lang_id:
+            module.last_lang_bszs.append(module.last_bsz)
+            continue
+        module.last_lang_bszs.append(0)
+        for p in submodule.parameters():
+            if p.grad is None:
+                p.grad = torch.zeros_like(p.data)
+
+
 class MultilingualEncoder(FairseqEncoder):
     """Multilingual encoder.
 
@@ -56,8 +88,15 @@ class MultilingualEncoder(FairseqEncoder):
         )
         src_tokens = src_tokens[:, :-1]
         src_lengths -= 1
-        # Create tensors for collecting encoder outputs
         bsz, seq_len = src_tokens.size()[:2]
+        self.last_bsz = bsz
+        lang_id = single_lang_id(lang_ids, self.encoders)
+        if lang_id is not None:
+            # The whole batch goes through one encoder, without gathering
+            # sub-batches and scattering their outputs.
+            set_missing_grads(self, lang_id, self.encoders)
+            return self.encoders[lang_id](src_tokens, src_lengths)
+        # Create tensors for collecting encoder outputs
         all_encoder_outs = utils.maybe_cuda(torch.zeros(seq_len, bsz, self.hidden_dim))
         all_final_hidden = utils.maybe_cuda(
             torch.zeros(self.num_layers, bsz, self.hidden_dim)
@@ -70,7 +109,6 @@ class MultilingualEncoder(FairseqEncoder):
         all_src_lengths = utils.maybe_cuda(torch.zeros(bsz, dtype=torch.int))
         all_src_tokens = torch.zeros_like(src_tokens)
         all_embedded_words = utils.maybe_cuda(torch.zeros(seq_len, bsz, self.word_dim))
-        self.last_bsz = bsz
         self.last_lang_bszs = []
         for lang_id, encoder in enumerate(self.encoders):
             if encoder is None:
@@ -165,6 +203,22 @@ class MultilingualDecoder(FairseqIncrementalDecoder):
             incremental_state = {lang_id: None for lang_id in range(len(self.decoders))}
         else:
             seq_len = 1
+        self.last_bsz = bsz
+        incremental_state["lang_ids"] = lang_ids
+        lang_id = single_lang_id(lang_ids, self.decoders)
+        if lang_id is not None:
+            set_missing_grads(self, lang_id, self.decoders)
+            if lang_id not in incremental_state:
+                incremental_state[lang_id] = {}
+            lang_logits, attn_scores, _ = self.decoders[lang_id](
+                input_tokens, encoder_out, incremental_state[lang_id]
+            )
+            # As below, the logits of the language ID position and of indices
+            # beyond the vocab of this language are zero.
+            logits = F.pad(
+                lang_logits, (0, self.max_vocab_size - lang_logits.size(2), 1, 0)
+            )
+            return logits, attn_scores, None
         # Create tensors for collecting encoder outputs
         # +1 for language ID
         all_logits = utils.maybe_cuda(
@@ -173,7 +227,6 @@ class MultilingualDecoder(FairseqIncrementalDecoder):
         all_attn_scores = utils.maybe_cuda(
             torch.zeros(bsz, seq_len, encoder_out[0].size(0))
         )
-        self.last_bsz = bsz
         self.last_lang_bszs = []
         for lang_id, decoder in enumerate(self.decoders):
             if decoder is None:
@@ -203,27 +256,36 @@ class MultilingualDecoder(FairseqIncrementalDecoder):
             )
             all_attn_scores[indices, :, :max_source_length] = lang_attn_scores
             all_logits[indices, 1:, : lang_logits.size(2)] = lang_logits
-        incremental_state["lang_ids"] = lang_ids
         return all_logits, all_attn_scores, None
 
     def reorder_incremental_state(self, incremental_state, new_order):
         """Reorder buffered internal state (for incremental generation)."""
         if not incremental_state:
             return
-        bsz = new_order.size(0)
+        lang_id = single_lang_id(incremental_state["lang_ids"], self.decoders)
+        if lang_id is not None:
+            if lang_id in incremental_state:
+                self.decoders[lang_id].reorder_incremental_state(
+                    incremental_state[lang_id], new_order
+                )
+            return
+        # new_order may drop rows (e.g. of finished sentences in beam search),
+        # so the rows of each language are reordered by their position among
+        # the rows of that language before reordering.
+        lang_ids = incremental_state["lang_ids"]
+        new_lang_ids = lang_ids[new_order]
         for lang_id, decoder in enumerate(self.decoders):
             if decoder is None:
                 continue
-            indices = torch.nonzero(incremental_state["lang_ids"] == lang_id)
-            lang_bsz = indices.size(0)
-            if lang_bsz > 0:
-                if lang_bsz == bsz:
-                    lang_new_order = new_order
-                else:
-                    lang_new_order = utils.densify(new_order[indices.squeeze(1)])
+            lang_mask = lang_ids == lang_id
+            new_indices = torch.nonzero(new_lang_ids == lang_id)
+            if new_indices.size(0) > 0:
+                lang_positions = lang_mask.long().cumsum(dim=0) - 1
+                lang_new_order = lang_positions[new_order[new_indices.squeeze(1)]]
                 decoder.reorder_incremental_state(
                     incremental_state[lang_id], lang_new_order
                 )
+        incremental_state["lang_ids"] = new_lang_ids
 
     def max_positions(self):
         """Maximum output length supported by the decoder."""
@@ -36,6 +36,30 @@ def add_dataset_args(parser, train=False, gen=False):
         metavar="N",
         help="maximum number of sentences in a batch",
     )
+    group.add_argument(
+        "--padded-token-batching",
+        action="store_true",
+        help="Sort examples by (source, target) length and pack batches so "
+        "that the number of padded tokens (batch size times the longest "
+        "source or target) stays within --max-tokens. Batches are shuffled "
+        "as a whole.",
+    )
+    group.add_argument(
+        "--max-pad-ratio",
+        default=1.0,
+        type=float,
+        metavar="R",
+        help="With --padded-token-batching, close a batch before more than "
+        "this fraction of its source and target tokens are padding.",
+    )
+    group.add_argument(
+        "--multiling-homogeneous-batches",
+        action="store_true",
+        help="For multilingual models only. Batch the examples of each "
+        "(source language, target language) pair separately, so that each "
+        "batch runs through a single encoder and decoder. Batches of "
+        "different pairs are shuffled together.",
+    )
     if train:
         group.add_argument(
             "--train-subset",
@@ -58,6 +82,21 @@ def add_dataset_args(parser, train=False, gen=False):
             help="maximum number of sentences in a validation batch"
             " (defaults to --max-sentences)",
         )
+        group.add_argument(
+            "--prefetch-batches",
+            default=0,
+            type=int,
+            metavar="N",
+            help="If > 0, training batches (groups of --update-freq batches) "
+            "are collated up to N ahead by a background thread while the model "
+            "trains. The order of batches is unchanged.",
+        )
+        group.add_argument(
+            "--pin-memory",
+            action="store_true",
+            help="With --prefetch-batches, copy prefetched batches to "
+            "page-locked memory for faster transfers to the GPU.",
+        )
     if gen:
         group.add_argument(
             "--gen-subset",
@@ -218,6 +257,14 @@ def add_preprocessing_args(parser):
         help="Path to text file of weight (0 to 1) for each train example.."
         "If left empty, all examples will receive equal weights.",
     )
+    group.add_argument(
+        "--train-weights-binary-path",
+        default="",
+        metavar="FILE",
+        help="Path for the binary float32 .npy file of train example weights, "
+        "written from --train-weights-path during preprocessing and "
+        "memory-mapped during training.",
+    )
     group.add_argument(
         "--eval-source-binary-path",
         default="",
@@ -230,6 +277,71 @@ def add_preprocessing_args(parser):
         help="Path for the binary file containing target eval examples for "
         "calculating validation loss and BLEU scores.",
     )
+    group.add_argument(
+        "--binary-format",
+        default="npz",
+        choices=["npz", "mmap"],
+        help="Format of the binary files written when binarizing text files. "
+        "'npz' files are read into memory at load time. 'mmap' files are "
+        "memory-mapped read-only without copying, so that all training "
+        "processes on a host share one copy of the corpus. Existing binary "
+        "files are read in either format regardless of this flag.",
+    )
+    group.add_argument(
+        "--preprocess-workers",
+        default=1,
+        type=int,
+        metavar="N",
+        help="Number of processes used to build vocabularies and to binarize "
+        "each text file. Files are split into N line-aligned shards which are "
+        "counted or numberized in parallel. The output does not depend on N.",
+    )
+    group.add_argument(
+        "--train-binary-shards",
+        default=1,
+        type=int,
+        metavar="N",
+        help="If > 1, the binarized train source and target corpora are split "
+        "into N shards of equal numbers of examples, which are stored next to "
+        "a JSON manifest at --train-{source,target}-binary-path. Only the "
+        "shards of the current epoch are loaded during training "
+        "(see --train-shard-window). Not supported for char source models.",
+    )
+    group.add_argument(
+        "--train-shard-window",
+        default=0,
+        type=int,
+        metavar="N",
+        help="Number of shards of a sharded train corpus trained on per epoch. "
+        "Every pass over the corpus visits the shards in a new random order, "
+        "N shards at a time, while the shards of the next epoch are loaded in "
+        "the background. 0 trains on all shards every epoch.",
+    )
+    group.add_argument(
+        "--binarization-cache-dir",
+        default="",
+        metavar="DIR",
+        help="If set, text files are binarized into DIR instead of the "
+        "--*-binary-path locations, and binarized corpora in DIR are reused as "
+        "long as the text file (size, modification time and sampled content), "
+        "the vocabs and the binarization flags are unchanged. This skips "
+        "preprocessing when restarting or relaunching jobs on the same data.",
+    )
+    group.add_argument(
+        "--train-dedup",
+        action="store_true",
+        help="After binarizing, remove all but the first occurrence of each "
+        "(source, target) pair of numberized train sentences. The train "
+        "source, target and binarized weights files stay aligned.",
+    )
+    group.add_argument(
+        "--train-max-length-ratio",
+        default=0.0,
+        type=float,
+        metavar="R",
+        help="If > 0, remove train pairs after binarizing whose longer side "
+        "has more than R times as many tokens as the shorter side.",
+    )
 
     group.add_argument(
         "--multiling-encoder-lang",
@@ -303,7 +415,9 @@ def add_preprocessing_args(parser):
         type=int,
         help="For multilingual models only. Use this argument repeatedly to "
         "oversample corpora. The n-th training corpus is oversampled by the n-"
-        "the entry. No oversampling if not specified.",
+        "the entry. No oversampling if not specified. Sentences are stored "
+        "only once in binarized data, so the rates used at training time can "
+        "differ from the ones used for preprocessing.",
     )
     group.add_argument(
         "--multiling-eval-source-text-file",
@@ -613,6 +727,18 @@ def expand_generation_args(group, train=False):
             "floats with length equal to the number of models in the ensemble."
         ),
     )
+    group.add_argument(
+        "--sampling-topp",
+        default=-1.0,
+        type=float,
+        metavar="P",
+        help=(
+            "With --sampling, sample from the smallest set of most likely next "
+            "words whose probability sums to at least P (nucleus sampling). "
+            "Can be combined with --sampling-topk and --sampling-temperature. "
+            "--beam sets the number of samples per source sentence."
+        ),
+    )
     # These arguments are only used during training
     if train:
         group.add_argument(
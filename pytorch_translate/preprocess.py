@@ -3,13 +3,18 @@
 import argparse
 import os
 import tempfile
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
+import numpy as np
 from pytorch_translate import (
+    binarization_cache,
     char_data,
     constants,
     data as pytorch_translate_data,
+    mmap_format,
     options as pytorch_translate_options,
+    sharded_data,
+    weighted_data,
 )
 from pytorch_translate.dictionary import Dictionary
 
@@ -64,7 +69,9 @@ def validate_args(args):
             )
 
 
-def maybe_generate_temp_file_path(output_path=None):
+def maybe_generate_temp_file_path(
+    output_path=None, binary_format=pytorch_translate_data.BINARY_FORMAT_NPZ
+):
     """
     This function generates a temp file path if output_path is empty or None.
     This is useful to do before calling any preprocessing function that has a
@@ -77,7 +84,10 @@ def maybe_generate_temp_file_path(output_path=None):
         os.close(fd)
     # numpy silently appends this suffix if it is not present, so this ensures
     # that the correct path is returned
-    if not output_path.endswith(".npz"):
+    if (
+        binary_format == pytorch_translate_data.BINARY_FORMAT_NPZ
+        and not output_path.endswith(".npz")
+    ):
         output_path += ".npz"
     return output_path
 
@@ -92,8 +102,41 @@ def binarize_text_file(
     embed_bytes: bool = False,
     char_dictionary: Optional[Dictionary] = None,
     already_numberized: bool = False,
+    binary_format: str = pytorch_translate_data.BINARY_FORMAT_NPZ,
+    num_workers: int = 1,
+    num_shards: int = 1,
+    cache_dir: Optional[str] = None,
 ) -> str:
-    output_path = maybe_generate_temp_file_path(output_path)
+    if cache_dir:
+        return binarize_text_file_cached(
+            cache_dir=cache_dir,
+            text_file=text_file,
+            dictionary=dictionary,
+            append_eos=append_eos,
+            reverse_order=reverse_order,
+            use_char_data=use_char_data,
+            embed_bytes=embed_bytes,
+            char_dictionary=char_dictionary,
+            already_numberized=already_numberized,
+            binary_format=binary_format,
+            num_workers=num_workers,
+            num_shards=num_shards,
+        )
+    output_path = maybe_generate_temp_file_path(output_path, binary_format)
+    if num_shards > 1:
+        if use_char_data:
+            raise ValueError("Sharded binarization does not support char data.")
+        return binarize_text_file_sharded(
+            text_file=text_file,
+            dictionary=dictionary,
+            output_path=output_path,
+            append_eos=append_eos,
+            reverse_order=reverse_order,
+            already_numberized=already_numberized,
+            binary_format=binary_format,
+            num_workers=num_workers,
+            num_shards=num_shards,
+        )
     if use_char_data:
         dataset = char_data.InMemoryNumpyWordCharDataset()
         dataset.parse(
@@ -103,6 +146,7 @@ def binarize_text_file(
             embed_bytes=embed_bytes,
             reverse_order=reverse_order,
             append_eos=append_eos,
+            num_workers=num_workers,
         )
     else:
         dataset = pytorch_translate_data.InMemoryNumpyDataset()
@@ -112,11 +156,270 @@ def binarize_text_file(
             reverse_order=reverse_order,
             append_eos=append_eos,
             already_numberized=already_numberized,
+            num_workers=num_workers,
+            spill_path=get_spill_path(output_path, binary_format),
         )
-    dataset.save(output_path)
+    dataset.save(output_path, binary_format=binary_format)
+    return output_path
+
+
+def binarize_text_file_cached(
+    cache_dir: str,
+    text_file: str,
+    dictionary: Dictionary,
+    append_eos: bool,
+    reverse_order: bool,
+    use_char_data: bool = False,
+    embed_bytes: bool = False,
+    char_dictionary: Optional[Dictionary] = None,
+    already_numberized: bool = False,
+    binary_format: str = pytorch_translate_data.BINARY_FORMAT_NPZ,
+    num_workers: int = 1,
+    num_shards: int = 1,
+) -> str:
+    """Returns the path of the binarization of `text_file` in `cache_dir`,
+    binarizing it only if the text file, the dictionaries or the flags changed
+    since it was last binarized there (see binarization_cache)."""
+    key = binarization_cache.cache_key(
+        text_file,
+        dictionary,
+        char_dictionary if use_char_data else None,
+        append_eos=append_eos,
+        reverse_order=reverse_order,
+        use_char_data=use_char_data,
+        embed_bytes=embed_bytes,
+        already_numberized=already_numberized,
+        binary_format=binary_format,
+        num_shards=num_shards,
+    )
+    cached_path = binarization_cache.lookup(cache_dir, key)
+    if cached_path is not None:
+        print(f"| Using {cached_path} binarized from {text_file}")
+        return cached_path
+    output_path = binarize_text_file(
+        text_file=text_file,
+        dictionary=dictionary,
+        output_path=binarization_cache.new_output_path(cache_dir, key, binary_format),
+        append_eos=append_eos,
+        reverse_order=reverse_order,
+        use_char_data=use_char_data,
+        embed_bytes=embed_bytes,
+        char_dictionary=char_dictionary,
+        already_numberized=already_numberized,
+        binary_format=binary_format,
+        num_workers=num_workers,
+        num_shards=num_shards,
+    )
+    binarization_cache.commit(cache_dir, key, output_path, [text_file])
     return output_path
 
 
+def binarize_text_file_sharded(
+    text_file: str,
+    dictionary: Dictionary,
+    output_path: str,
+    append_eos: bool,
+    reverse_order: bool,
+    already_numberized: bool = False,
+    binary_format: str = pytorch_translate_data.BINARY_FORMAT_NPZ,
+    num_workers: int = 1,
+    num_shards: int = 1,
+) -> str:
+    """Binarizes `text_file` into `num_shards` shards, and writes their
+    manifest to `output_path` (see sharded_data.save_shards())."""
+    # In the memory-mapped format, the whole corpus is streamed to a
+    # temporary raw file rather than accumulated in memory.
+    spill_path = get_spill_path(f"{output_path}.unsharded", binary_format)
+    dataset = pytorch_translate_data.InMemoryNumpyDataset()
+    dataset.parse(
+        path=text_file,
+        dictionary=dictionary,
+        reverse_order=reverse_order,
+        append_eos=append_eos,
+        already_numberized=already_numberized,
+        num_workers=num_workers,
+        spill_path=spill_path,
+    )
+    sharded_data.save_shards(dataset, output_path, num_shards, binary_format)
+    del dataset
+    if spill_path is not None:
+        os.remove(spill_path)
+    return output_path
+
+
+def load_binarized_corpus(path: str, use_char_data: bool = False):
+    """Loads a binarized corpus, including all shards of a sharded one."""
+    if sharded_data.is_shard_manifest(path):
+        corpus = sharded_data.ShardedCorpus(path)
+        return corpus.load(range(len(corpus)))
+    if use_char_data:
+        return char_data.InMemoryNumpyWordCharDataset.create_from_file(path)
+    return pytorch_translate_data.InMemoryNumpyDataset.create_from_file(path)
+
+
+def save_binarized_corpus(
+    dataset, path: str, binary_format: str, output_path: Optional[str] = None
+) -> None:
+    """Saves `dataset` in place of the binarized corpus at `path` (or at
+    `output_path` if given), with the same number of shards if it is
+    sharded."""
+    output_path = output_path or path
+    manifest = sharded_data.read_shard_manifest(path)
+    if manifest is not None:
+        sharded_data.save_shards(
+            dataset, output_path, len(manifest["shards"]), binary_format=binary_format
+        )
+    else:
+        dataset.save(output_path, binary_format=binary_format)
+
+
+def filter_parallel_corpus(
+    source_path: str,
+    target_path: str,
+    weights_path: Optional[str] = None,
+    dedup: bool = False,
+    max_length_ratio: float = 0.0,
+    use_char_source: bool = False,
+    binary_format: str = pytorch_translate_data.BINARY_FORMAT_NPZ,
+    source_output_path: Optional[str] = None,
+    target_output_path: Optional[str] = None,
+    weights_output_path: Optional[str] = None,
+) -> int:
+    """Removes pairs from a binarized parallel corpus, rewriting the source,
+    target and (binarized) weights files so that they stay aligned. The
+    filtered corpora and weights are written to source_output_path,
+    target_output_path and weights_output_path instead if given, and only if
+    pairs are removed.
+
+    Args:
+        dedup: Remove all but the first occurrence of each (source ids,
+            target ids) pair. Pairs are compared by a 64-bit hash, which is
+            computed with array operations over the binarized token buffers.
+            Memory use is up to three 8-byte arrays per pair (hashes and pair
+            indices), plus that of data.find_duplicates().
+        max_length_ratio: If > 0, remove pairs whose longer side has more
+            than max_length_ratio times as many tokens as the shorter side.
+
+    Returns:
+        The number of pairs removed.
+    """
+    src_dataset = load_binarized_corpus(source_path, use_char_data=use_char_source)
+    tgt_dataset = load_binarized_corpus(target_path)
+    num_pairs = len(src_dataset)
+    assert len(tgt_dataset) == num_pairs, "Source and target are not aligned."
+    src_sizes = np.asarray(src_dataset.sizes, dtype=np.int64)
+    tgt_sizes = np.asarray(tgt_dataset.sizes, dtype=np.int64)
+
+    keep = np.ones(num_pairs, dtype=bool)
+    if max_length_ratio > 0:
+        keep &= np.maximum(src_sizes, tgt_sizes) <= max_length_ratio * np.maximum(
+            np.minimum(src_sizes, tgt_sizes), 1
+        )
+    num_ratio_removed = num_pairs - int(np.count_nonzero(keep))
+    num_duplicates = 0
+    if dedup:
+        if use_char_source:
+            src_hashes = pytorch_translate_data.hash_sentences(
+                src_dataset.word_buffer, src_dataset.word_offsets
+            )
+        else:
+            src_hashes = pytorch_translate_data.hash_sentences(
+                src_dataset.buffer, src_dataset.offsets
+            )
+        tgt_hashes = pytorch_translate_data.hash_sentences(
+            tgt_dataset.buffer, tgt_dataset.offsets
+        )
+        # Arithmetic on uint64 arrays wraps around.
+        pair_hashes = src_hashes * np.uint64(0x9E3779B97F4A7C15) ^ tgt_hashes
+        kept_ids = np.flatnonzero(keep)
+        duplicates = pytorch_translate_data.find_duplicates(pair_hashes[kept_ids])
+        keep[kept_ids[duplicates]] = False
+        num_duplicates = int(np.count_nonzero(duplicates))
+
+    print(
+        f"| Removed {num_duplicates} duplicate pairs and {num_ratio_removed} "
+        f"pairs exceeding a length ratio of {max_length_ratio} from "
+        f"{source_path} and {target_path}: {num_pairs} -> "
+        f"{int(np.count_nonzero(keep))} pairs."
+    )
+    if keep.all():
+        return 0
+
+    kept_ids = np.flatnonzero(keep)
+    # The selected datasets are copies in memory, so that the (possibly
+    # memory-mapped) original files can be overwritten.
+    src_dataset = src_dataset.select(kept_ids)
+    save_binarized_corpus(src_dataset, source_path, binary_format, source_output_path)
+    tgt_dataset = tgt_dataset.select(kept_ids)
+    save_binarized_corpus(tgt_dataset, target_path, binary_format, target_output_path)
+    if weights_path:
+        weights = weighted_data.IndexedWeightsDataset(weights_path).select(kept_ids)
+        save_atomically(weights.save, weights_output_path or weights_path)
+    return num_pairs - len(kept_ids)
+
+
+def filter_parallel_corpus_cached(
+    cache_dir: str,
+    source_path: str,
+    target_path: str,
+    weights_path: Optional[str],
+    dedup: bool,
+    max_length_ratio: float,
+    use_char_source: bool,
+    binary_format: str,
+    text_files: List[str],
+) -> Tuple[str, str, Optional[str]]:
+    """Like filter_parallel_corpus(), for a parallel corpus (and weights) in
+    `cache_dir`. The filtered corpus is cached as well, under a key derived
+    from the input files and the filter settings.
+
+    Returns:
+        The paths of the filtered source, target and weights in cache_dir.
+    """
+    key = binarization_cache.derived_cache_key(
+        [source_path, target_path, weights_path],
+        dedup=dedup,
+        max_length_ratio=max_length_ratio,
+        use_char_source=use_char_source,
+        binary_format=binary_format,
+    )
+    paths = binarization_cache.lookup_paths(cache_dir, key)
+    if paths is not None:
+        print(f"| Using {paths['source']} and {paths['target']} filtered before")
+        return paths["source"], paths["target"], paths.get("weights")
+    paths = {
+        "source": binarization_cache.new_output_path(
+            cache_dir, key, binary_format, suffix=".source"
+        ),
+        "target": binarization_cache.new_output_path(
+            cache_dir, key, binary_format, suffix=".target"
+        ),
+    }
+    if weights_path:
+        paths["weights"] = binarization_cache.new_output_path(
+            cache_dir, key, None, suffix=".weights.npy"
+        )
+    num_removed = filter_parallel_corpus(
+        source_path=source_path,
+        target_path=target_path,
+        weights_path=weights_path,
+        dedup=dedup,
+        max_length_ratio=max_length_ratio,
+        use_char_source=use_char_source,
+        binary_format=binary_format,
+        source_output_path=paths["source"],
+        target_output_path=paths["target"],
+        weights_output_path=paths.get("weights"),
+    )
+    if num_removed == 0:
+        # Nothing was written: the filtered corpus is the input corpus.
+        paths = {"source": source_path, "target": target_path}
+        if weights_path:
+            paths["weights"] = weights_path
+    binarization_cache.commit_paths(cache_dir, key, paths, text_files)
+    return paths["source"], paths["target"], paths.get("weights")
+
+
 def make_multiling_corpus_configs(
     language_ids, text_files, dictionaries, oversampling_rates=None
 ):
@@ -140,6 +443,50 @@ def make_multiling_corpus_configs(
     ]
 
 
+def binarize_weights_file(
+    text_file: str, output_path: str, cache_dir: Optional[str] = None
+) -> str:
+    """Binarizes the example weights of `text_file` (see
+    weighted_data.binarize_weights_file()) into `cache_dir` if given, or to
+    `output_path` unless that file is newer than the text file.
+
+    Returns:
+        The path of the binarized weights.
+    """
+    if cache_dir:
+        key = binarization_cache.cache_key(text_file, None, weights=True)
+        cached_path = binarization_cache.lookup(cache_dir, key)
+        if cached_path is not None:
+            print(f"| Using {cached_path} binarized from {text_file}")
+            return cached_path
+        output_path = binarization_cache.new_output_path(
+            cache_dir, key, None, suffix=".npy"
+        )
+        weighted_data.binarize_weights_file(text_file, output_path)
+        binarization_cache.commit(cache_dir, key, output_path, [text_file])
+        return output_path
+    if (
+        os.path.exists(output_path)
+        and os.path.getmtime(output_path) >= os.path.getmtime(text_file)
+        and weighted_data.is_binarized_weights_file(output_path)
+    ):
+        print(f"| Using {output_path}, which is newer than {text_file}")
+        return output_path
+    save_atomically(
+        lambda path: weighted_data.binarize_weights_file(text_file, path),
+        output_path,
+    )
+    return output_path
+
+
+def save_atomically(save_fn, path: str) -> None:
+    """Calls save_fn(tmp_path) and moves the file to `path`, so that jobs
+    reading or writing the same file concurrently never see a partial one."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    save_fn(tmp_path)
+    os.replace(tmp_path, path)
+
+
 def binarize_text_file_multilingual(
     corpus_configs: List[pytorch_translate_data.MultilingualCorpusConfig],
     output_path: str,
@@ -147,8 +494,22 @@ def binarize_text_file_multilingual(
     reverse_order: bool,
     prepend_language_id: bool,
     already_numberized: bool = False,
+    binary_format: str = pytorch_translate_data.BINARY_FORMAT_NPZ,
+    num_workers: int = 1,
+    cache_dir: Optional[str] = None,
 ) -> str:
-    output_path = maybe_generate_temp_file_path(output_path)
+    if cache_dir:
+        return binarize_text_file_multilingual_cached(
+            cache_dir=cache_dir,
+            corpus_configs=corpus_configs,
+            append_eos=append_eos,
+            reverse_order=reverse_order,
+            prepend_language_id=prepend_language_id,
+            already_numberized=already_numberized,
+            binary_format=binary_format,
+            num_workers=num_workers,
+        )
+    output_path = maybe_generate_temp_file_path(output_path, binary_format)
     dataset = pytorch_translate_data.InMemoryNumpyDataset()
     dataset.parse_multilingual(
         corpus_configs,
@@ -156,23 +517,90 @@ def binarize_text_file_multilingual(
         append_eos=append_eos,
         prepend_language_id=prepend_language_id,
         already_numberized=already_numberized,
+        num_workers=num_workers,
+        spill_path=get_spill_path(output_path, binary_format),
+    )
+    dataset.save(output_path, binary_format=binary_format)
+    return output_path
+
+
+def binarize_text_file_multilingual_cached(
+    cache_dir: str,
+    corpus_configs: List[pytorch_translate_data.MultilingualCorpusConfig],
+    append_eos: bool,
+    reverse_order: bool,
+    prepend_language_id: bool,
+    already_numberized: bool = False,
+    binary_format: str = pytorch_translate_data.BINARY_FORMAT_NPZ,
+    num_workers: int = 1,
+) -> str:
+    """Like binarize_text_file_cached(), for the multilingual corpora of
+    binarize_text_file_multilingual()."""
+    key = binarization_cache.multilingual_cache_key(
+        corpus_configs,
+        append_eos=append_eos,
+        reverse_order=reverse_order,
+        prepend_language_id=prepend_language_id,
+        already_numberized=already_numberized,
+        binary_format=binary_format,
+    )
+    text_files = [config.data_file for config in corpus_configs]
+    cached_path = binarization_cache.lookup(cache_dir, key)
+    if cached_path is not None:
+        print(f"| Using {cached_path} binarized from {', '.join(text_files)}")
+        return cached_path
+    output_path = binarize_text_file_multilingual(
+        corpus_configs=corpus_configs,
+        output_path=binarization_cache.new_output_path(cache_dir, key, binary_format),
+        append_eos=append_eos,
+        reverse_order=reverse_order,
+        prepend_language_id=prepend_language_id,
+        already_numberized=already_numberized,
+        binary_format=binary_format,
+        num_workers=num_workers,
     )
-    dataset.save(output_path)
+    binarization_cache.commit(cache_dir, key, output_path, text_files)
     return output_path
 
 
+def get_spill_path(output_path: str, binary_format: str) -> Optional[str]:
+    """In the memory-mapped format, the token buffer is streamed straight to
+    its final location while binarizing, so that memory use does not grow
+    with the size of the corpus."""
+    if binary_format == pytorch_translate_data.BINARY_FORMAT_MMAP:
+        return mmap_format.mmap_array_path(output_path, "buffer")
+    return None
+
+
+def get_binary_format(args) -> str:
+    return getattr(args, "binary_format", pytorch_translate_data.BINARY_FORMAT_NPZ)
+
+
+def get_preprocess_workers(args) -> int:
+    return max(getattr(args, "preprocess_workers", 1), 1)
+
+
+def get_train_binary_shards(args) -> int:
+    return max(getattr(args, "train_binary_shards", 1), 1)
+
+
+def get_binarization_cache_dir(args) -> Optional[str]:
+    return getattr(args, "binarization_cache_dir", None) or None
+
+
 def preprocess_corpora(args):
+    binary_format = get_binary_format(args)
     args.train_source_binary_path = maybe_generate_temp_file_path(
-        args.train_source_binary_path
+        args.train_source_binary_path, binary_format
     )
     args.train_target_binary_path = maybe_generate_temp_file_path(
-        args.train_target_binary_path
+        args.train_target_binary_path, binary_format
     )
     args.eval_source_binary_path = maybe_generate_temp_file_path(
-        args.eval_source_binary_path
+        args.eval_source_binary_path, binary_format
     )
     args.eval_target_binary_path = maybe_generate_temp_file_path(
-        args.eval_target_binary_path
+        args.eval_target_binary_path, binary_format
     )
 
     # Additional text preprocessing options could be added here before
@@ -196,10 +624,12 @@ def preprocess_corpora(args):
         # task
         if args.task == constants.SEMI_SUPERVISED_TASK:
             args.train_mono_source_binary_path = maybe_generate_temp_file_path(
-                output_path=getattr(args, "train_mono_source_binary_path", None)
+                output_path=getattr(args, "train_mono_source_binary_path", None),
+                binary_format=binary_format,
             )
             args.train_mono_target_binary_path = maybe_generate_temp_file_path(
-                output_path=getattr(args, "train_mono_target_binary_path", None)
+                output_path=getattr(args, "train_mono_target_binary_path", None),
+                binary_format=binary_format,
             )
             preprocess_monolingual_corpora(
                 args,
@@ -220,6 +650,9 @@ def preprocess_monolingual_corpora(
     Prerequisite: Vocabs are already built (see build_vocabs)
     """
     use_char_source = char_source_dict is not None
+    binary_format = get_binary_format(args)
+    num_workers = get_preprocess_workers(args)
+    cache_dir = get_binarization_cache_dir(args)
     if getattr(args, "train_mono_source_text_file", None):
         args.train_mono_source_binary_path = binarize_text_file(
             text_file=args.train_mono_source_text_file,
@@ -229,6 +662,9 @@ def preprocess_monolingual_corpora(
             reverse_order=args.reverse_source,
             use_char_data=use_char_source,
             char_dictionary=char_source_dict,
+            binary_format=binary_format,
+            num_workers=num_workers,
+            cache_dir=cache_dir,
         )
 
     # For target sentences, we always append EOS tokens, and never reverse
@@ -248,6 +684,9 @@ def preprocess_monolingual_corpora(
             # even if the source sentence is fed to the model backwards,
             # we still want the model to start outputting from the first word.
             reverse_order=False,
+            binary_format=binary_format,
+            num_workers=num_workers,
+            cache_dir=cache_dir,
         )
 
 
@@ -268,11 +707,13 @@ def build_vocabs(args: argparse.Namespace):
         if getattr(args, "train_mono_target_text_file", None):
             target_files.append(args.train_mono_target_text_file)
 
+    num_workers = get_preprocess_workers(args)
     source_dict = Dictionary.build_vocab_file_if_nonexistent(
         corpus_files=source_files,
         vocab_file=args.source_vocab_file,
         max_vocab_size=args.source_max_vocab_size,
         tokens_with_penalty=None,
+        num_workers=num_workers,
     )
     use_char_source = (args.char_source_vocab_file != "") or (
         getattr(args, "arch", "") == "char_source"
@@ -287,6 +728,7 @@ def build_vocabs(args: argparse.Namespace):
             tokens_with_penalty=None,
             is_char_vocab=True,
             embed_bytes=embed_bytes,
+            num_workers=num_workers,
         )
 
     target_dict = Dictionary.build_vocab_file_if_nonexistent(
@@ -294,6 +736,7 @@ def build_vocabs(args: argparse.Namespace):
         vocab_file=args.target_vocab_file,
         max_vocab_size=args.target_max_vocab_size,
         tokens_with_penalty=args.penalized_target_tokens_file,
+        num_workers=num_workers,
     )
     return source_dict, char_source_dict, target_dict
 
@@ -310,6 +753,18 @@ def preprocess_bilingual_corpora(
     """
     use_char_source = args.char_source_vocab_file != ""
     embed_bytes = getattr(args, "embed_bytes", False)
+    binary_format = get_binary_format(args)
+    num_workers = get_preprocess_workers(args)
+    cache_dir = get_binarization_cache_dir(args)
+    num_shards = get_train_binary_shards(args)
+    if getattr(args, "train_weights_path", None):
+        args.train_weights_binary_path = binarize_weights_file(
+            text_file=args.train_weights_path,
+            # By default, next to the binarized train source corpus.
+            output_path=getattr(args, "train_weights_binary_path", None)
+            or f"{args.train_source_binary_path}.weights.npy",
+            cache_dir=cache_dir,
+        )
     if args.train_source_text_file:
         args.train_source_binary_path = binarize_text_file(
             text_file=args.train_source_text_file,
@@ -320,6 +775,10 @@ def preprocess_bilingual_corpora(
             use_char_data=use_char_source,
             embed_bytes=embed_bytes,
             char_dictionary=char_source_dict,
+            binary_format=binary_format,
+            num_workers=num_workers,
+            num_shards=num_shards,
+            cache_dir=cache_dir,
         )
     if args.eval_source_text_file:
         args.eval_source_binary_path = binarize_text_file(
@@ -331,6 +790,9 @@ def preprocess_bilingual_corpora(
             use_char_data=use_char_source,
             embed_bytes=embed_bytes,
             char_dictionary=char_source_dict,
+            binary_format=binary_format,
+            num_workers=num_workers,
+            cache_dir=cache_dir,
         )
 
     # For target sentences, we always append EOS tokens, and never reverse
@@ -350,6 +812,10 @@ def preprocess_bilingual_corpora(
             # even if the source sentence is fed to the model backwards,
             # we still want the model to start outputting from the first word.
             reverse_order=False,
+            binary_format=binary_format,
+            num_workers=num_workers,
+            num_shards=num_shards,
+            cache_dir=cache_dir,
         )
     if args.eval_target_text_file:
         args.eval_target_binary_path = binarize_text_file(
@@ -358,8 +824,56 @@ def preprocess_bilingual_corpora(
             output_path=args.eval_target_binary_path,
             append_eos=True,
             reverse_order=False,
+            binary_format=binary_format,
+            num_workers=num_workers,
+            cache_dir=cache_dir,
         )
 
+    dedup = getattr(args, "train_dedup", False)
+    max_length_ratio = getattr(args, "train_max_length_ratio", 0.0)
+    if (
+        args.train_source_text_file
+        and args.train_target_text_file
+        and (dedup or max_length_ratio > 0)
+    ):
+        weights_path = getattr(args, "train_weights_binary_path", None)
+        if cache_dir:
+            # Cached corpora may be shared with other jobs, so the filtered
+            # corpora are cached as new files rather than written in place.
+            (
+                args.train_source_binary_path,
+                args.train_target_binary_path,
+                args.train_weights_binary_path,
+            ) = filter_parallel_corpus_cached(
+                cache_dir=cache_dir,
+                source_path=args.train_source_binary_path,
+                target_path=args.train_target_binary_path,
+                weights_path=weights_path,
+                dedup=dedup,
+                max_length_ratio=max_length_ratio,
+                use_char_source=use_char_source,
+                binary_format=binary_format,
+                text_files=[args.train_source_text_file, args.train_target_text_file],
+            )
+        else:
+            # The binarized weights are only rebinarized when the text file
+            # changes, so they are never filtered in place.
+            weights_output_path = None
+            if weights_path:
+                weights_output_path = f"{args.train_source_binary_path}.filtered.npy"
+            num_removed = filter_parallel_corpus(
+                source_path=args.train_source_binary_path,
+                target_path=args.train_target_binary_path,
+                weights_path=weights_path,
+                dedup=dedup,
+                max_length_ratio=max_length_ratio,
+                use_char_source=use_char_source,
+                binary_format=binary_format,
+                weights_output_path=weights_output_path,
+            )
+            if num_removed > 0 and weights_path:
+                args.train_weights_binary_path = weights_output_path
+
 
 def build_vocab_multicorpus(
     corpus_langs,
@@ -368,6 +882,7 @@ def build_vocab_multicorpus(
     vocab_files,
     max_vocab_size,
     tokens_with_penalty=None,
+    num_workers=1,
 ):
     lang2corpus = {lang: [] for lang in vocab_langs}
     for lang, corpus_file in zip(corpus_langs, corpus_files):
@@ -378,24 +893,29 @@ def build_vocab_multicorpus(
             vocab_file=vocab_file,
             max_vocab_size=max_vocab_size,
             tokens_with_penalty=tokens_with_penalty,
+            num_workers=num_workers,
         )
         for lang, vocab_file in zip(vocab_langs, vocab_files)
     }
 
 
 def preprocess_corpora_multilingual(args):
+    binary_format = get_binary_format(args)
+    num_workers = get_preprocess_workers(args)
+    cache_dir = get_binarization_cache_dir(args)
     source_dicts = build_vocab_multicorpus(
         args.multiling_source_lang,
         args.multiling_train_source_text_file,
         args.multiling_encoder_lang,
         args.multiling_source_vocab_file,
         args.source_max_vocab_size,
+        num_workers=num_workers,
     )
     source_corpus_lang_ids = [
         args.multiling_encoder_lang.index(l) for l in args.multiling_source_lang
     ]
     source_corpus_dicts = [source_dicts[l] for l in args.multiling_source_lang]
-    binarize_text_file_multilingual(
+    args.train_source_binary_path = binarize_text_file_multilingual(
         corpus_configs=make_multiling_corpus_configs(
             source_corpus_lang_ids,
             args.multiling_train_source_text_file,
@@ -406,8 +926,11 @@ def preprocess_corpora_multilingual(args):
         append_eos=args.append_eos_to_source,
         reverse_order=args.reverse_source,
         prepend_language_id=False,
+        binary_format=binary_format,
+        num_workers=num_workers,
+        cache_dir=cache_dir,
     )
-    binarize_text_file_multilingual(
+    args.eval_source_binary_path = binarize_text_file_multilingual(
         corpus_configs=make_multiling_corpus_configs(
             source_corpus_lang_ids,
             args.multiling_eval_source_text_file,
@@ -418,6 +941,9 @@ def preprocess_corpora_multilingual(args):
         append_eos=args.append_eos_to_source,
         reverse_order=args.reverse_source,
         prepend_language_id=False,
+        binary_format=binary_format,
+        num_workers=num_workers,
+        cache_dir=cache_dir,
     )
 
     target_dicts = build_vocab_multicorpus(
@@ -427,12 +953,13 @@ def preprocess_corpora_multilingual(args):
         args.multiling_target_vocab_file,
         args.target_max_vocab_size,
         args.penalized_target_tokens_file,
+        num_workers=num_workers,
     )
     target_corpus_lang_ids = [
         args.multiling_decoder_lang.index(l) for l in args.multiling_target_lang
     ]
     target_corpus_dicts = [target_dicts[l] for l in args.multiling_target_lang]
-    binarize_text_file_multilingual(
+    args.train_target_binary_path = binarize_text_file_multilingual(
         corpus_configs=make_multiling_corpus_configs(
             target_corpus_lang_ids,
             args.multiling_train_target_text_file,
@@ -443,8 +970,11 @@ def preprocess_corpora_multilingual(args):
         append_eos=True,
         reverse_order=False,
         prepend_language_id=True,
+        binary_format=binary_format,
+        num_workers=num_workers,
+        cache_dir=cache_dir,
     )
-    binarize_text_file_multilingual(
+    args.eval_target_binary_path = binarize_text_file_multilingual(
         corpus_configs=make_multiling_corpus_configs(
             target_corpus_lang_ids,
             args.multiling_eval_target_text_file,
@@ -455,6 +985,9 @@ def preprocess_corpora_multilingual(args):
         append_eos=True,
         reverse_order=False,
         prepend_language_id=True,
+        binary_format=binary_format,
+        num_workers=num_workers,
+        cache_dir=cache_dir,
     )
 
 
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+
+import argparse
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from pytorch_translate import (
+    batching,
+    data as pytorch_translate_data,
+    mmap_format,
+    sharded_data,
+)
+
+
+def read_sizes(path: str) -> np.ndarray:
+    """Returns the length of each example of a binarized dataset, either an
+    InMemoryNumpyDataset, an InMemoryNumpyWordCharDataset (in words) or a
+    shard manifest. Only the offsets are read, never the token buffers."""
+    if sharded_data.is_shard_manifest(path):
+        corpus = sharded_data.ShardedCorpus(path)
+        return np.concatenate(
+            [np.zeros(0, dtype=np.int64)]
+            + [read_sizes(shard_path) for shard_path in corpus.shard_paths]
+        )
+    if mmap_format.read_mmap_header(path) is not None:
+        _, arrays = mmap_format.load_mmap_arrays(path)
+    else:
+        # Arrays of an .npz are only read when accessed.
+        arrays = np.load(path)
+    if "word_offsets" in arrays:
+        offsets = arrays["word_offsets"]
+    elif "offsets" in arrays:
+        offsets = arrays["offsets"]
+    else:
+        raise RuntimeError(f"{path} does not appear to be a binarized dataset!")
+    sizes = np.diff(np.asarray(offsets, dtype=np.int64))
+    if "corpus_sizes" in arrays:
+        index = pytorch_translate_data.make_oversampling_index(
+            [int(size) for size in arrays["corpus_sizes"]],
+            [int(rate) for rate in arrays["oversampling"]],
+        )
+        if index is not None:
+            sizes = sizes[index]
+    return sizes
+
+
+def length_histogram(sizes: np.ndarray) -> List[Tuple[int, int, int]]:
+    """Counts lengths in buckets [0, 1), [1, 2), [2, 4), [4, 8), ...
+
+    Returns:
+        List of (lower bound, upper bound, count) of the non-empty buckets.
+    """
+    if len(sizes) == 0:
+        return []
+    num_buckets = int(np.max(sizes)).bit_length() + 1
+    bounds = [0] + [2 ** i for i in range(num_buckets)]
+    counts, _ = np.histogram(sizes, bins=bounds)
+    return [
+        (bounds[i], bounds[i + 1], int(count))
+        for i, count in enumerate(counts)
+        if count > 0
+    ]
+
+
+def simulate_batching(
+    src_sizes: np.ndarray,
+    tgt_sizes: Optional[np.ndarray],
+    max_tokens: Optional[int],
+    max_sentences: Optional[int],
+    max_pad_ratio: float = 1.0,
+    required_batch_size_multiple: int = 1,
+    sample_size: int = 0,
+    seed: int = 1,
+) -> Dict[str, Any]:
+    """Batches examples of the given lengths with
+    batching.batch_by_padded_size(), like --padded-token-batching (the default
+    fairseq batching packs length-sorted examples against the same budget
+    without the pad ratio cap).
+
+    If sample_size > 0 and smaller than the corpus, only a random sample of
+    up to that many examples is batched, and the number of batches is scaled
+    up to the size of the corpus. With length-sorted batching, batch sizes
+    hardly depend on the number of examples once it is large. The sample is
+    drawn with replacement (and deduplicated), so that its cost does not
+    depend on the size of the corpus.
+    """
+    num_examples = len(src_sizes)
+    if 0 < sample_size < num_examples:
+        indices = np.unique(
+            np.random.RandomState(seed).randint(0, num_examples, size=sample_size)
+        )
+    else:
+        indices = np.arange(num_examples)
+    batches = batching.batch_by_padded_size(
+        indices,
+        src_sizes,
+        tgt_sizes,
+        max_tokens=max_tokens,
+        max_sentences=max_sentences,
+        max_pad_ratio=max_pad_ratio,
+        required_batch_size_multiple=required_batch_size_multiple,
+    )
+    num_tokens = src_sizes[indices].sum()
+    if tgt_sizes is not None:
+        num_tokens = np.maximum(src_sizes[indices], tgt_sizes[indices]).sum()
+    stats = {
+        "num_batches": len(batches) * num_examples / max(len(indices), 1),
+        "sentences_per_batch": len(indices) / max(len(batches), 1),
+        "tokens_per_batch": float(num_tokens) / max(len(batches), 1),
+        "source_pad_efficiency": batching.pad_efficiency(batches, src_sizes),
+        "target_pad_efficiency": None,
+    }
+    if tgt_sizes is not None:
+        stats["target_pad_efficiency"] = batching.pad_efficiency(batches, tgt_sizes)
+    return stats
+
+
+def print_length_stats(name: str, sizes: np.ndarray) -> None:
+    print(f"| {name}: {len(sizes)} examples, {int(sizes.sum())} tokens")
+    if len(sizes) == 0:
+        return
+    p50, p90, p99 = np.percentile(sizes, [50, 90, 99])
+    print(
+        f"| {name} length: mean {sizes.mean():.1f}, median {p50:.0f}, "
+        f"p90 {p90:.0f}, p99 {p99:.0f}, max {int(sizes.max())}"
+    )
+    for lower, upper, count in length_histogram(sizes):
+        print(f"|   [{lower:6d}, {upper:6d}): {count:12d} ({count / len(sizes):6.1%})")
+
+
+def print_ratio_stats(src_sizes: np.ndarray, tgt_sizes: np.ndarray) -> None:
+    ratios = tgt_sizes / np.maximum(src_sizes, 1)
+    p1, p50, p99 = np.percentile(ratios, [1, 50, 99])
+    print(
+        f"| target/source length ratio: p1 {p1:.2f}, median {p50:.2f}, "
+        f"p99 {p99:.2f}, max {ratios.max():.2f}"
+    )
+    for threshold in (2, 3, 5):
+        extreme = np.count_nonzero((ratios > threshold) | (ratios < 1 / threshold))
+        print(
+            f"|   ratio beyond {threshold}x either way: {extreme} "
+            f"({extreme / len(ratios):.2%})"
+        )
+
+
+def profile_corpus(args) -> None:
+    src_sizes = read_sizes(args.source_binary_path)
+    tgt_sizes = None
+    print_length_stats("source", src_sizes)
+    if args.target_binary_path:
+        tgt_sizes = read_sizes(args.target_binary_path)
+        if len(tgt_sizes) != len(src_sizes):
+            raise ValueError(
+                f"{args.source_binary_path} has {len(src_sizes)} examples but "
+                f"{args.target_binary_path} has {len(tgt_sizes)}."
+            )
+        print_length_stats("target", tgt_sizes)
+        if len(src_sizes) > 0:
+            print_ratio_stats(src_sizes, tgt_sizes)
+    if len(src_sizes) == 0:
+        return
+
+    batches_per_step = args.distributed_world_size * args.update_freq
+    for max_tokens in args.max_tokens:
+        for max_sentences in args.max_sentences or [None]:
+            stats = simulate_batching(
+                src_sizes,
+                tgt_sizes,
+                max_tokens=max_tokens,
+                max_sentences=max_sentences,
+                max_pad_ratio=args.max_pad_ratio,
+                required_batch_size_multiple=args.required_batch_size_multiple,
+                sample_size=args.sample_size,
+                seed=args.seed,
+            )
+            message = (
+                f"| max_tokens={max_tokens} max_sentences={max_sentences}: "
+                f"{stats['sentences_per_batch']:.1f} sentences and "
+                f"{stats['tokens_per_batch']:.0f} tokens per batch, "
+                f"pad efficiency source {stats['source_pad_efficiency']:.1%}"
+            )
+            if stats["target_pad_efficiency"] is not None:
+                message += f" target {stats['target_pad_efficiency']:.1%}"
+            message += (
+                f", ~{stats['num_batches']:.0f} batches and "
+                f"~{stats['num_batches'] / batches_per_step:.0f} steps per epoch"
+            )
+            print(message)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="PyTorch Translate - profile the lengths and batching of a "
+        "binarized corpus"
+    )
+    parser.add_argument(
+        "--source-binary-path",
+        required=True,
+        metavar="FILE",
+        help="Binarized source corpus (token, word-char or shard manifest).",
+    )
+    parser.add_argument(
+        "--target-binary-path",
+        default="",
+        metavar="FILE",
+        help="Binarized target corpus, for length ratios and target padding.",
+    )
+    parser.add_argument(
+        "--max-tokens",
+        nargs="+",
+        default=[5000],
+        type=int,
+        metavar="N",
+        help="One or more --max-tokens settings to simulate.",
+    )
+    parser.add_argument(
+        "--max-sentences",
+        nargs="+",
+        type=int,
+        metavar="N",
+        help="One or more --max-sentences settings to simulate.",
+    )
+    parser.add_argument(
+        "--max-pad-ratio",
+        default=1.0,
+        type=float,
+        metavar="R",
+        help="--max-pad-ratio setting to simulate.",
+    )
+    parser.add_argument(
+        "--required-batch-size-multiple",
+        default=8,
+        type=int,
+        metavar="N",
+        help="Batch sizes are rounded down to a multiple of N, as in training.",
+    )
+    parser.add_argument(
+        "--distributed-world-size",
+        default=1,
+        type=int,
+        metavar="N",
+        help="Number of GPUs, for the number of steps per epoch.",
+    )
+    parser.add_argument(
+        "--update-freq",
+        default=1,
+        type=int,
+        metavar="N",
+        help="Batches per update, for the number of steps per epoch.",
+    )
+    parser.add_argument(
+        "--sample-size",
+        default=1000000,
+        type=int,
+        metavar="N",
+        help="Simulate batching on a random sample of N examples, and scale "
+        "the number of batches to the whole corpus. 0 batches all examples.",
+    )
+    parser.add_argument("--seed", default=1, type=int, metavar="N")
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    profile_corpus(args)
+
+
+if __name__ == "__main__":
+    main()
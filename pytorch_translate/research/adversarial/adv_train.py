@@ -277,6 +277,9 @@ def setup_training(args):
             )
     print(f"| extra_state: {extra_state}")
 
+    # Sharded training corpora are only loaded for the restored epoch.
+    if hasattr(task, "load_shard_window"):
+        task.load_shard_window(args.train_subset, extra_state["epoch"])
     epoch_itr = task.get_batch_iterator(
         dataset=task.dataset(args.train_subset),
         max_tokens=args.max_tokens,
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import zipfile
+from concurrent import futures
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from pytorch_translate import data as pytorch_translate_data, weighted_data
+
+
+# A sharded corpus is stored as a small JSON manifest at the binary path of
+# the corpus, which lists the binarized shards (<path>.shard0, ...) stored
+# next to it. Each shard is a regular binary dataset (npz or mmap).
+SHARD_MANIFEST_FORMAT_NAME = "pytorch_translate_shards"
+SHARD_MANIFEST_VERSION = 1
+
+
+def shard_path(path: str, shard_id: int, binary_format: str) -> str:
+    """Path of shard `shard_id` of the sharded corpus at `path`."""
+    result = f"{path}.shard{shard_id}"
+    if binary_format == pytorch_translate_data.BINARY_FORMAT_NPZ:
+        # numpy silently appends this suffix if it is not present.
+        result += ".npz"
+    return result
+
+
+def read_shard_manifest(path: str) -> Optional[Dict[str, Any]]:
+    """Returns the manifest of a sharded corpus, or None if the file at
+    `path` is not a shard manifest (e.g. an unsharded binary dataset)."""
+    if not os.path.isfile(path) or zipfile.is_zipfile(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (UnicodeDecodeError, ValueError):
+        return None
+    if (
+        not isinstance(manifest, dict)
+        or manifest.get("format") != SHARD_MANIFEST_FORMAT_NAME
+    ):
+        return None
+    if manifest["version"] > SHARD_MANIFEST_VERSION:
+        raise RuntimeError(
+            f"{path} was written with version {manifest['version']} of the "
+            f"shard manifest, but only versions up to {SHARD_MANIFEST_VERSION} "
+            f"are supported."
+        )
+    return manifest
+
+
+def is_shard_manifest(path: str) -> bool:
+    return read_shard_manifest(path) is not None
+
+
+def write_shard_manifest(
+    path: str, shard_paths: List[str], shard_sizes: List[int]
+) -> None:
+    """Writes the manifest of the shards at `shard_paths`, which hold
+    `shard_sizes` examples each. Shard paths are stored relative to the
+    manifest, so that the corpus can be moved as a whole."""
+    directory = os.path.dirname(os.path.abspath(path))
+    manifest = {
+        "format": SHARD_MANIFEST_FORMAT_NAME,
+        "version": SHARD_MANIFEST_VERSION,
+        "shards": [
+            {"path": os.path.relpath(os.path.abspath(p), directory), "size": int(n)}
+            for p, n in zip(shard_paths, shard_sizes)
+        ],
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def save_shards(
+    dataset: pytorch_translate_data.InMemoryNumpyDataset,
+    path: str,
+    num_shards: int,
+    binary_format: str = pytorch_translate_data.BINARY_FORMAT_NPZ,
+) -> List[str]:
+    """Splits `dataset` into `num_shards` contiguous shards of (nearly) equal
+    numbers of examples, and saves them along with a manifest at `path`.
+    Corpora with the same number of examples, like the source and target
+    sides of a bitext, are split at the same examples."""
+    num_examples = len(dataset)
+    bounds = [num_examples * i // num_shards for i in range(num_shards + 1)]
+    shard_paths = []
+    for shard_id, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+        shard_paths.append(shard_path(path, shard_id, binary_format))
+        dataset.slice(start, end).save(shard_paths[-1], binary_format=binary_format)
+    # The manifest is written last, so that a partially written corpus is
+    # never mistaken for a complete one.
+    write_shard_manifest(
+        path, shard_paths, [end - start for start, end in zip(bounds[:-1], bounds[1:])]
+    )
+    return shard_paths
+
+
+def shard_window(
+    num_shards: int, window_size: int, epoch: int, seed: int = 1
+) -> List[int]:
+    """Returns the ids of the shards trained on in `epoch` (starting at 1).
+
+    Each pass over the corpus visits the shards in a new random order, which
+    only depends on `seed` and the pass, `window_size` shards per epoch. If
+    window_size is 0 or covers all shards, every epoch trains on all shards.
+    """
+    if window_size <= 0 or window_size >= num_shards:
+        return list(range(num_shards))
+    windows_per_pass = -(-num_shards // window_size)
+    pass_id, window_id = divmod(epoch - 1, windows_per_pass)
+    order = np.random.RandomState(seed + pass_id).permutation(num_shards)
+    window = order[window_id * window_size : (window_id + 1) * window_size]
+    # Examples are shuffled by the batch iterator anyway, and a canonical
+    # order lets identical windows be reused.
+    return sorted(int(shard_id) for shard_id in window)
+
+
+class ShardedCorpus:
+    """One side of a sharded binarized corpus, described by its manifest."""
+
+    def __init__(self, path: str):
+        manifest = read_shard_manifest(path)
+        if manifest is None:
+            raise RuntimeError(f"{path} is not a shard manifest!")
+        directory = os.path.dirname(os.path.abspath(path))
+        self.path = path
+        self.shard_paths = [
+            os.path.join(directory, shard["path"]) for shard in manifest["shards"]
+        ]
+        self.shard_sizes = [int(shard["size"]) for shard in manifest["shards"]]
+        # Index of the first example of each shard in the whole corpus.
+        self.shard_offsets = pytorch_translate_data.sizes_to_offsets(
+            np.array(self.shard_sizes, dtype=np.int64), dtype=np.int64
+        )
+
+    def __len__(self):
+        return len(self.shard_paths)
+
+    def num_examples(self) -> int:
+        return int(self.shard_offsets[-1])
+
+    def example_ranges(self, shard_ids: Sequence[int]) -> List[Tuple[int, int]]:
+        return [
+            (int(self.shard_offsets[i]), int(self.shard_offsets[i + 1]))
+            for i in shard_ids
+        ]
+
+    def load(self, shard_ids: Sequence[int]):
+        """Loads the shards `shard_ids` as a single dataset."""
+        datasets = [
+            pytorch_translate_data.InMemoryNumpyDataset.create_from_file(
+                self.shard_paths[i]
+            )
+            for i in shard_ids
+        ]
+        if len(datasets) == 1:
+            return datasets[0]
+        return pytorch_translate_data.InMemoryNumpyDataset.concatenate(datasets)
+
+
+class ShardedParallelCorpus:
+    """The source and target sides of a sharded bitext, and optionally the
+    weights of its examples, which are loaded a window of shards at a time.
+
+    While the current window is being trained on, the next one is loaded by
+    a background thread, so that at most two windows are resident at once.
+    """
+
+    def __init__(
+        self,
+        source_path: str,
+        target_path: str,
+        weights_file: Optional[str] = None,
+        window_size: int = 0,
+        seed: int = 1,
+        prefetch: bool = True,
+    ):
+        self.source = ShardedCorpus(source_path)
+        self.target = ShardedCorpus(target_path)
+        if self.source.shard_sizes != self.target.shard_sizes:
+            raise ValueError(
+                f"The shards of {source_path} and {target_path} do not have "
+                f"the same numbers of examples."
+            )
+        self.weights = None
+        if weights_file and os.path.exists(weights_file):
+            # Memory-mapped if binarized, so only the slices of each window
+            # are read.
+            self.weights = weighted_data.IndexedWeightsDataset(weights_file)
+            assert len(self.weights) == self.source.num_examples()
+        self.window_size = window_size
+        self.seed = seed
+        self._executor = futures.ThreadPoolExecutor(max_workers=1) if prefetch else None
+        self._current = None
+        self._prefetched = None
+
+    def __len__(self):
+        return len(self.source)
+
+    def window_for_epoch(self, epoch: int) -> List[int]:
+        return shard_window(len(self), self.window_size, epoch, self.seed)
+
+    def load_window(
+        self, shard_ids: Sequence[int], prefetch_shard_ids: Optional[Sequence] = None
+    ):
+        """Returns the (source, target, weights) datasets of the shards
+        `shard_ids`, and starts loading `prefetch_shard_ids` in the
+        background. weights is None for unweighted corpora."""
+        key = tuple(shard_ids)
+        if self._current is not None and self._current[0] == key:
+            window = self._current[1]
+        elif self._prefetched is not None and self._prefetched[0] == key:
+            window = self._prefetched[1].result()
+        else:
+            window = self._load(key)
+        self._current = (key, window)
+        self._prefetched = None
+        if (
+            self._executor is not None
+            and prefetch_shard_ids is not None
+            and tuple(prefetch_shard_ids) != key
+        ):
+            prefetch_key = tuple(prefetch_shard_ids)
+            self._prefetched = (
+                prefetch_key,
+                self._executor.submit(self._load, prefetch_key),
+            )
+        return window
+
+    def _load(self, shard_ids: Tuple[int, ...]):
+        source = self.source.load(shard_ids)
+        target = self.target.load(shard_ids)
+        weights = None
+        if self.weights is not None:
+            weights = self.weights.select_ranges(self.source.example_ranges(shard_ids))
+        return source, target, weights
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import itertools
+import multiprocessing
+import os
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+
+def find_line_offsets(path: str, num_shards: int) -> List[int]:
+    """Splits the file at `path` into `num_shards` byte ranges of roughly
+    equal size which all start at the beginning of a line.
+
+    Returns:
+        List of num_shards + 1 byte offsets. Shard i consists of the lines
+        starting in [offsets[i], offsets[i + 1]).
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        offsets = [0]
+        for i in range(1, num_shards):
+            f.seek(size * i // num_shards)
+            # Skip ahead to the beginning of the next line. A line starting
+            # exactly at the seek position belongs to the previous shard.
+            f.readline()
+            offsets.append(max(f.tell(), offsets[-1]))
+        offsets.append(size)
+    return offsets
+
+
+def read_lines(path: str, start: int = 0, end: Optional[int] = None) -> Iterator[str]:
+    """Yields the lines of the text file at `path` which start in the byte
+    range [start, end). `start` must be the beginning of a line.
+
+    Lines are split as when reading the file in text mode with universal
+    newlines: "\r", "\n" and "\r\n" all end a line, and are translated to
+    "\n". Shards only start after a "\n", which is never within a line
+    ending, so the lines of all shards are those of the whole file."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        position = start
+        for line in f:
+            if end is not None and position >= end:
+                break
+            position += len(line)
+            text = line.decode("utf-8")
+            if "\r" not in text:
+                yield text
+                continue
+            # Binary lines are only split at "\n", so this one may hold
+            # several lines ending with a bare "\r".
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+            lines = text.split("\n")
+            for split_line in lines[:-1]:
+                yield split_line + "\n"
+            if lines[-1]:
+                yield lines[-1]
+
+
+def read_line_blocks(
+    path: str, start: int = 0, end: Optional[int] = None, block_size: int = 10000
+) -> Iterator[List[str]]:
+    """Like read_lines(), but yields lists of up to `block_size` lines."""
+    lines = read_lines(path, start, end)
+    while True:
+        block = list(itertools.islice(lines, block_size))
+        if not block:
+            return
+        yield block
+
+
+def map_shards(
+    shard_fn: Callable, shard_args: List[Tuple], num_workers: int = 1
+) -> List[Any]:
+    """Calls `shard_fn(*args)` for each entry of `shard_args`, in a pool of
+    `num_workers` processes if num_workers > 1. Results are returned in the
+    order of `shard_args`."""
+    if num_workers > 1 and len(shard_args) > 1:
+        with multiprocessing.Pool(processes=num_workers) as pool:
+            return pool.starmap(shard_fn, shard_args)
+    return [shard_fn(*args) for args in shard_args]
@@ -1,16 +1,20 @@
 #!/usr/bin/env python3
 
+import math
 import os
 from collections import OrderedDict
 from typing import List, Optional
 
+import numpy as np
 from fairseq import data, options
 from fairseq.tasks import FairseqTask, register_task
 from pytorch_translate import (
+    batching,
     char_data,
     data as pytorch_translate_data,
     data_utils,
     dictionary as pytorch_translate_dictionary,
+    sharded_data,
     weighted_data,
 )
 from pytorch_translate.research.multisource import multisource_data
@@ -58,6 +62,96 @@ class PytorchTranslateTask(FairseqTask):
         self.src_dict = src_dict
         self.tgt_dict = tgt_dict
         self.char_source_dict = char_source_dict
+        # Sharded corpora of each split, see load_sharded_dataset(), and the
+        # (epoch, shard ids) of the window which is currently loaded.
+        self.sharded_corpora = {}
+        self.shard_windows = {}
+
+    def get_batch_iterator(
+        self,
+        dataset,
+        max_tokens=None,
+        max_sentences=None,
+        max_positions=None,
+        ignore_invalid_inputs=False,
+        required_batch_size_multiple=1,
+        seed=1,
+        num_shards=1,
+        shard_id=0,
+    ):
+        """Same as FairseqTask.get_batch_iterator(), but with
+        --padded-token-batching, batches are packed against a budget of padded
+        tokens by batching.batch_by_padded_size(). If get_batch_groups()
+        returns groups for the dataset, each batch holds examples of a single
+        group."""
+        padded_token_batching = getattr(
+            self.args, "padded_token_batching", False
+        ) and hasattr(dataset, "src_sizes")
+        groups = self.get_batch_groups(dataset)
+        if not padded_token_batching and groups is None:
+            return super().get_batch_iterator(
+                dataset,
+                max_tokens=max_tokens,
+                max_sentences=max_sentences,
+                max_positions=max_positions,
+                ignore_invalid_inputs=ignore_invalid_inputs,
+                required_batch_size_multiple=required_batch_size_multiple,
+                seed=seed,
+                num_shards=num_shards,
+                shard_id=shard_id,
+            )
+        with data.data_utils.numpy_seed(seed):
+            indices = dataset.ordered_indices()
+        # filter_by_size() may return a generator.
+        indices = np.fromiter(
+            data.data_utils.filter_by_size(
+                indices,
+                dataset.size,
+                max_positions,
+                raise_exception=(not ignore_invalid_inputs),
+            ),
+            dtype=np.int64,
+        )
+
+        def make_batches(indices):
+            if padded_token_batching:
+                return batching.batch_by_padded_size(
+                    indices,
+                    dataset.src_sizes,
+                    dataset.tgt_sizes,
+                    max_tokens=max_tokens,
+                    max_sentences=max_sentences,
+                    max_pad_ratio=getattr(self.args, "max_pad_ratio", 1.0),
+                    required_batch_size_multiple=required_batch_size_multiple,
+                )
+            return list(
+                data.data_utils.batch_by_size(
+                    indices,
+                    dataset.num_tokens,
+                    max_tokens=max_tokens,
+                    max_sentences=max_sentences,
+                    required_batch_size_multiple=required_batch_size_multiple,
+                )
+            )
+
+        if groups is None:
+            batch_sampler = make_batches(indices)
+        else:
+            batch_sampler = batching.batch_by_group(indices, groups, make_batches)
+        # Batches are shuffled as a whole at the start of each epoch.
+        return data.iterators.EpochBatchIterator(
+            dataset=dataset,
+            collate_fn=dataset.collater,
+            batch_sampler=batch_sampler,
+            seed=seed,
+            num_shards=num_shards,
+            shard_id=shard_id,
+        )
+
+    def get_batch_groups(self, dataset) -> Optional[np.ndarray]:
+        """Returns the group of each example of `dataset` if batches must not
+        mix examples of different groups, or None."""
+        return None
 
     def build_model(self, args):
         # set defaults for old model checkpoints
@@ -101,6 +195,10 @@ class PytorchTranslateTask(FairseqTask):
         return cls(args, source_dict, target_dict, char_source_dict)
 
     def load_dataset(self, split, src_bin_path, tgt_bin_path, weights_file=None):
+        if sharded_data.is_shard_manifest(src_bin_path):
+            self.load_sharded_dataset(split, src_bin_path, tgt_bin_path, weights_file)
+            return
+
         corpus = pytorch_translate_data.ParallelCorpusConfig(
             source=pytorch_translate_data.CorpusConfig(
                 dialect=self.args.source_lang, data_file=src_bin_path
@@ -115,8 +213,9 @@ class PytorchTranslateTask(FairseqTask):
             print("Starting to load binarized data files.", flush=True)
         data_utils.validate_corpus_exists(corpus=corpus, split=split)
 
+        oversampling = self.get_oversampling(split)
         dst_dataset = pytorch_translate_data.InMemoryNumpyDataset.create_from_file(
-            corpus.target.data_file
+            corpus.target.data_file, oversampling=oversampling
         )
         weights_dataset = None
         if corpus.weights_file and os.path.exists(corpus.weights_file):
@@ -138,7 +237,7 @@ class PytorchTranslateTask(FairseqTask):
             )
         else:
             src_dataset = pytorch_translate_data.InMemoryNumpyDataset.create_from_file(
-                corpus.source.data_file
+                corpus.source.data_file, oversampling=oversampling
             )
             self.datasets[split] = weighted_data.WeightedLanguagePairDataset(
                 src=src_dataset,
@@ -155,6 +254,91 @@ class PytorchTranslateTask(FairseqTask):
 
         print(f"| {split} {len(self.datasets[split])} examples")
 
+    def load_sharded_dataset(
+        self, split, src_manifest_path, tgt_manifest_path, weights_file=None
+    ):
+        """Sets up a corpus binarized in shards (see --train-binary-shards),
+        of which only a window of --train-shard-window shards is loaded at a
+        time. No shards are loaded yet, since the epoch to start from is only
+        known once a checkpoint is restored: call load_shard_window() with
+        that epoch. Until then, the dataset of `split` has no examples and
+        only serves dummy batches."""
+        assert (
+            self.char_source_dict is None
+        ), "Sharded corpora are not supported for char source models."
+        self.sharded_corpora[split] = sharded_data.ShardedParallelCorpus(
+            source_path=src_manifest_path,
+            target_path=tgt_manifest_path,
+            weights_file=weights_file,
+            window_size=getattr(self.args, "train_shard_window", 0),
+            seed=self.args.seed,
+        )
+        print(
+            f"| {split} {len(self.sharded_corpora[split])} shards, "
+            f"{self.sharded_corpora[split].source.num_examples()} examples"
+        )
+        empty_dataset = pytorch_translate_data.InMemoryNumpyDataset()
+        empty_dataset.buffer = np.zeros(0, dtype=np.int32)
+        empty_dataset.sizes = np.zeros(0, dtype=np.int32)
+        empty_dataset.offsets = pytorch_translate_data.sizes_to_offsets(
+            empty_dataset.sizes
+        )
+        self.datasets[split] = weighted_data.WeightedLanguagePairDataset(
+            src=empty_dataset,
+            src_sizes=empty_dataset.sizes,
+            src_dict=self.source_dictionary,
+            tgt=empty_dataset,
+            tgt_sizes=empty_dataset.sizes,
+            tgt_dict=self.target_dictionary,
+        )
+        self.shard_windows.pop(split, None)
+
+    def load_shard_window(
+        self, split: str, epoch: int, shard_ids: Optional[List[int]] = None
+    ) -> Optional[List[int]]:
+        """Makes the shards of `epoch`, or `shard_ids` if given, the dataset
+        of a sharded split, and prefetches the shards of the next epoch in
+        the background unless `epoch` is the last one (--max-epoch). Nothing
+        is done if these shards are already loaded for `epoch`.
+
+        Returns:
+            The ids of the loaded shards, or None if `split` is not sharded.
+        """
+        corpus = self.sharded_corpora.get(split)
+        if corpus is None:
+            return None
+        if shard_ids is None:
+            shard_ids = corpus.window_for_epoch(epoch)
+        window = (epoch, tuple(shard_ids))
+        if self.shard_windows.get(split) == window:
+            return list(shard_ids)
+        prefetch_shard_ids = None
+        if epoch < (getattr(self.args, "max_epoch", 0) or math.inf):
+            prefetch_shard_ids = corpus.window_for_epoch(epoch + 1)
+        src_dataset, dst_dataset, weights_dataset = corpus.load_window(
+            shard_ids, prefetch_shard_ids=prefetch_shard_ids
+        )
+        self.shard_windows[split] = window
+        self.datasets[split] = weighted_data.WeightedLanguagePairDataset(
+            src=src_dataset,
+            src_sizes=src_dataset.sizes,
+            src_dict=self.source_dictionary,
+            tgt=dst_dataset,
+            tgt_sizes=dst_dataset.sizes,
+            tgt_dict=self.target_dictionary,
+            weights=weights_dataset,
+        )
+        print(
+            f"| {split} shards {shard_ids} of epoch {epoch}: "
+            f"{len(self.datasets[split])} examples"
+        )
+        return list(shard_ids)
+
+    def get_oversampling(self, split: str) -> Optional[List[int]]:
+        """Oversampling rates which override the ones stored in binarized
+        multilingual datasets, or None to keep the stored ones."""
+        return None
+
     def load_dataset_from_text(
         self,
         split: str,
@@ -163,7 +347,7 @@ class PytorchTranslateTask(FairseqTask):
         append_eos: Optional[bool] = False,
         reverse_source: Optional[bool] = True,
     ):
-        dst_dataset = data.IndexedRawTextDataset(
+        dst_dataset = pytorch_translate_data.InMemoryNumpyRawTextDataset(
             path=target_text_file,
             dictionary=self.target_dictionary,
             # We always append EOS to the target sentence since we still want
@@ -196,7 +380,7 @@ class PytorchTranslateTask(FairseqTask):
                 self.target_dictionary,
             )
         else:
-            src_dataset = data.IndexedRawTextDataset(
+            src_dataset = pytorch_translate_data.InMemoryNumpyRawTextDataset(
                 path=source_text_file,
                 dictionary=self.source_dictionary,
                 append_eos=append_eos,
@@ -227,7 +411,7 @@ class PytorchTranslateTask(FairseqTask):
             append_eos=append_eos,
             reverse_order=reverse_source,
         )
-        dst_dataset = data.IndexedRawTextDataset(
+        dst_dataset = pytorch_translate_data.InMemoryNumpyRawTextDataset(
             path=target_text_file,
             dictionary=self.target_dictionary,
             # We always append EOS to the target sentence since we still want
@@ -331,6 +515,36 @@ class PytorchTranslateMultilingualTask(PytorchTranslateTask):
 
         return cls(args, src_dicts, tgt_dicts)
 
+    def get_oversampling(self, split: str) -> Optional[List[int]]:
+        # Oversampling is applied lazily through an index over the unique
+        # sentences, so the rates can be changed without re-binarizing.
+        if split != getattr(self.args, "train_subset", "train"):
+            return None
+        return getattr(self.args, "multiling_train_oversampling", None)
+
+    def get_batch_groups(self, dataset) -> Optional[np.ndarray]:
+        """With --multiling-homogeneous-batches, each batch only holds
+        examples of one (source language, target language) pair, so that the
+        multilingual encoder and decoder run a single language model on it."""
+        if not getattr(self.args, "multiling_homogeneous_batches", False):
+            return None
+        if not isinstance(
+            getattr(dataset, "src", None), pytorch_translate_data.InMemoryNumpyDataset
+        ) or not isinstance(
+            getattr(dataset, "tgt", None), pytorch_translate_data.InMemoryNumpyDataset
+        ):
+            return None
+        # Language IDs are the last source token and the first target token.
+        lang_pairs = np.stack(
+            [
+                dataset.src.boundary_tokens(last=True),
+                dataset.tgt.boundary_tokens(last=False),
+            ],
+            axis=1,
+        )
+        _, groups = np.unique(lang_pairs, axis=0, return_inverse=True)
+        return groups
+
     def load_dataset_from_text_multilingual(
         self,
         split: str,
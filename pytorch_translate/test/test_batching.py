@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import numpy as np
+from pytorch_translate import batching
+
+
+class TestBatching(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.src_sizes = rng.randint(1, 50, size=200)
+        self.tgt_sizes = rng.randint(1, 50, size=200)
+
+    def _check_batches(self, batches):
+        self.assertListEqual(
+            list(range(len(self.src_sizes))), sorted(np.concatenate(batches).tolist())
+        )
+
+    def test_max_tokens(self):
+        max_tokens = 400
+        batches = batching.batch_by_padded_size(
+            np.arange(len(self.src_sizes)),
+            self.src_sizes,
+            self.tgt_sizes,
+            max_tokens=max_tokens,
+        )
+        self._check_batches(batches)
+        for batch in batches:
+            max_len = max(self.src_sizes[batch].max(), self.tgt_sizes[batch].max())
+            self.assertTrue(len(batch) == 1 or len(batch) * max_len <= max_tokens)
+        # Sorting by length packs better than batching in random order.
+        self.assertGreater(
+            batching.pad_efficiency(batches, self.src_sizes),
+            batching.pad_efficiency(
+                np.array_split(np.arange(len(self.src_sizes)), len(batches)),
+                self.src_sizes,
+            ),
+        )
+
+    def test_max_pad_ratio(self):
+        batches = batching.batch_by_padded_size(
+            np.arange(len(self.src_sizes)),
+            self.src_sizes,
+            self.tgt_sizes,
+            max_tokens=4000,
+            max_pad_ratio=0.3,
+        )
+        self._check_batches(batches)
+        for batch in batches:
+            num_real = self.src_sizes[batch].sum() + self.tgt_sizes[batch].sum()
+            num_padded = len(batch) * (
+                self.src_sizes[batch].max() + self.tgt_sizes[batch].max()
+            )
+            self.assertTrue(len(batch) == 1 or 1 - num_real / num_padded <= 0.3)
+
+    def test_required_batch_size_multiple(self):
+        batches = batching.batch_by_padded_size(
+            np.arange(len(self.src_sizes)),
+            self.src_sizes,
+            max_sentences=20,
+            required_batch_size_multiple=8,
+        )
+        self._check_batches(batches)
+        for batch in batches[:-1]:
+            self.assertEqual(16, len(batch))
+
+    def test_batch_by_group(self):
+        groups = np.arange(len(self.src_sizes)) % 3
+        batches = batching.batch_by_group(
+            np.arange(len(self.src_sizes)),
+            groups,
+            lambda indices: batching.batch_by_padded_size(
+                indices, self.src_sizes, self.tgt_sizes, max_tokens=400
+            ),
+        )
+        self._check_batches(batches)
+        for batch in batches:
+            self.assertEqual(1, len(np.unique(groups[batch])))
+
+    def test_pad_efficiency(self):
+        sizes = np.array([2, 4, 3, 3])
+        efficiency = batching.pad_efficiency([[0, 1], [2, 3]], sizes)
+        self.assertAlmostEqual(12 / 14, efficiency)
+        self.assertEqual(1.0, batching.pad_efficiency([], sizes))
@@ -25,6 +25,151 @@ class TestBeamDecode(unittest.TestCase):
         encoder_input = {"src_tokens": src_tokens, "src_lengths": src_lengths}
         translator.generate(encoder_input, maxlen=7)
 
+    @unittest.skipIf(torch.cuda.device_count() < 1, "No GPU available for test.")
+    def test_finalized_hypos(self):
+        test_args = test_utils.ModelParamsDict()
+        _, src_dict, tgt_dict = test_utils.prepare_inputs(test_args)
+        task = tasks.DictionaryHolderTask(src_dict, tgt_dict)
+        model = task.build_model(test_args)
+        src_tokens = torch.LongTensor([[0, 0, 0], [0, 0, 0]])
+        src_lengths = torch.LongTensor([3, 3])
+        encoder_input = {"src_tokens": src_tokens, "src_lengths": src_lengths}
+        for stop_early in [True, False]:
+            translator = beam_decode.SequenceGenerator(
+                [model], task.target_dictionary, beam_size=3, stop_early=stop_early
+            )
+            finalized = translator.generate(encoder_input, maxlen=7)
+            self.assertEqual(len(finalized), 2)
+            for hypos in finalized:
+                self.assertEqual(len(hypos), 3)
+                scores = [hypo["score"] for hypo in hypos]
+                self.assertListEqual(scores, sorted(scores, reverse=True))
+                for hypo in hypos:
+                    tgt_len = hypo["tokens"].numel()
+                    self.assertEqual(hypo["tokens"][-1].item(), tgt_dict.eos())
+                    self.assertEqual(hypo["attention"].size(), (3, tgt_len))
+                    self.assertEqual(hypo["alignment"].numel(), tgt_len)
+                    self.assertEqual(hypo["positional_scores"].numel(), tgt_len)
+
+    @unittest.skipIf(torch.cuda.device_count() < 1, "No GPU available for test.")
+    def test_generate_batch_matches_single(self):
+        """Sentences finishing early are removed from the batch, which must
+        not change their translations or those of the other sentences."""
+        test_args = test_utils.ModelParamsDict()
+        _, src_dict, tgt_dict = test_utils.prepare_inputs(test_args)
+        task = tasks.DictionaryHolderTask(src_dict, tgt_dict)
+        model = task.build_model(test_args)
+        translator = beam_decode.SequenceGenerator(
+            [model], task.target_dictionary, beam_size=2
+        )
+        src_tokens = torch.LongTensor([[4, 5, 6], [7, 8, 9], [6, 5, 4], [9, 9, 9]])
+        src_lengths = torch.LongTensor([3, 3, 3, 3])
+        finalized = translator.generate(
+            {"src_tokens": src_tokens, "src_lengths": src_lengths}, maxlen=10
+        )
+        for i in range(src_tokens.size(0)):
+            single = translator.generate(
+                {"src_tokens": src_tokens[i : i + 1], "src_lengths": src_lengths[:1]},
+                maxlen=10,
+            )[0]
+            self.assertListEqual(
+                [hypo["tokens"].tolist() for hypo in finalized[i]],
+                [hypo["tokens"].tolist() for hypo in single],
+            )
+
+    @unittest.skipIf(torch.cuda.device_count() < 1, "No GPU available for test.")
+    def test_greedy_generate(self):
+        test_args = test_utils.ModelParamsDict()
+        _, src_dict, tgt_dict = test_utils.prepare_inputs(test_args)
+        task = tasks.DictionaryHolderTask(src_dict, tgt_dict)
+        model = task.build_model(test_args)
+        translator = beam_decode.SequenceGenerator(
+            [model], task.target_dictionary, beam_size=1, normalize_scores=False
+        )
+        src_tokens = torch.LongTensor([[4, 5, 6], [7, 8, 9]])
+        src_lengths = torch.LongTensor([3, 3])
+        finalized = translator.generate(
+            {"src_tokens": src_tokens, "src_lengths": src_lengths}, maxlen=7
+        )
+        self.assertEqual(len(finalized), 2)
+        for hypos in finalized:
+            self.assertEqual(len(hypos), 1)
+            hypo = hypos[0]
+            tgt_len = hypo["tokens"].numel()
+            self.assertLessEqual(tgt_len, 8)
+            self.assertEqual(hypo["tokens"][-1].item(), tgt_dict.eos())
+            self.assertNotIn(tgt_dict.eos(), hypo["tokens"][:-1].tolist())
+            self.assertEqual(hypo["attention"].size(), (3, tgt_len))
+            self.assertEqual(hypo["positional_scores"].numel(), tgt_len)
+            self.assertAlmostEqual(
+                hypo["score"], hypo["positional_scores"].sum().item(), places=4
+            )
+
+    @unittest.skipIf(torch.cuda.device_count() < 1, "No GPU available for test.")
+    def test_sampling_generate(self):
+        test_args = test_utils.ModelParamsDict()
+        _, src_dict, tgt_dict = test_utils.prepare_inputs(test_args)
+        task = tasks.DictionaryHolderTask(src_dict, tgt_dict)
+        model = task.build_model(test_args)
+        src_tokens = torch.LongTensor([[4, 5, 6], [7, 8, 9]])
+        src_lengths = torch.LongTensor([3, 3])
+        encoder_input = {"src_tokens": src_tokens, "src_lengths": src_lengths}
+        greedy = beam_decode.SequenceGenerator(
+            [model], task.target_dictionary, beam_size=1
+        ).generate(encoder_input, maxlen=7)
+        # Sampling from the most likely token only is greedy search.
+        translator = beam_decode.SamplingSequenceGenerator(
+            [model], task.target_dictionary, beam_size=3, sampling_topk=1
+        )
+        samples = translator.generate(encoder_input, maxlen=7)
+        self.assertEqual(len(samples), 2)
+        for hypos, greedy_hypos in zip(samples, greedy):
+            self.assertEqual(len(hypos), 3)
+            for hypo in hypos:
+                self.assertListEqual(
+                    hypo["tokens"].tolist(), greedy_hypos[0]["tokens"].tolist()
+                )
+                self.assertAlmostEqual(
+                    hypo["score"], greedy_hypos[0]["score"], places=4
+                )
+                self.assertIsNone(hypo["attention"])
+                self.assertIsNone(hypo["alignment"])
+
+        translator = beam_decode.SamplingSequenceGenerator(
+            [model], task.target_dictionary, beam_size=3, sampling_topp=0.9
+        )
+        for hypos in translator.generate(encoder_input, maxlen=7):
+            self.assertEqual(len(hypos), 3)
+            scores = [hypo["score"] for hypo in hypos]
+            self.assertListEqual(scores, sorted(scores, reverse=True))
+            for hypo in hypos:
+                self.assertEqual(hypo["tokens"][-1].item(), tgt_dict.eos())
+
+    @unittest.skipIf(torch.cuda.device_count() < 1, "No GPU available for test.")
+    def test_generate_without_attention(self):
+        test_args = test_utils.ModelParamsDict()
+        _, src_dict, tgt_dict = test_utils.prepare_inputs(test_args)
+        task = tasks.DictionaryHolderTask(src_dict, tgt_dict)
+        model = task.build_model(test_args)
+        src_tokens = torch.LongTensor([[4, 5, 6], [7, 8, 9]])
+        src_lengths = torch.LongTensor([3, 3])
+        encoder_input = {"src_tokens": src_tokens, "src_lengths": src_lengths}
+        for beam_size in [1, 3]:
+            finalized = beam_decode.SequenceGenerator(
+                [model], task.target_dictionary, beam_size=beam_size
+            ).generate(encoder_input, maxlen=7)
+            finalized_without_attn = beam_decode.SequenceGenerator(
+                [model], task.target_dictionary, beam_size=beam_size, need_attn=False
+            ).generate(encoder_input, maxlen=7)
+            for hypos, hypos_without_attn in zip(finalized, finalized_without_attn):
+                self.assertListEqual(
+                    [hypo["tokens"].tolist() for hypo in hypos],
+                    [hypo["tokens"].tolist() for hypo in hypos_without_attn],
+                )
+                for hypo in hypos_without_attn:
+                    self.assertIsNone(hypo["attention"])
+                    self.assertIsNone(hypo["alignment"])
+
     @unittest.skipIf(torch.cuda.device_count() < 1, "No GPU available for test.")
     def test_char_rnn_generate(self):
         test_args = test_utils.ModelParamsDict(sequence_lstm=True)
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import numpy as np
+from pytorch_translate import char_data, data
+
+
+class TestInMemoryNumpyWordCharDataset(unittest.TestCase):
+    def setUp(self):
+        self.pad_idx = 1
+        # Words of each sentence, as lists of char ids.
+        self.sentences = [
+            [[10, 11], [12]],
+            [[13, 14, 15], [16], [17, 18]],
+            [[19]],
+            [[20, 21, 22, 23], [24, 25]],
+        ]
+        words = [word for sentence in self.sentences for word in sentence]
+        self.dataset = char_data.InMemoryNumpyWordCharDataset()
+        self.dataset.sizes = np.array([len(s) for s in self.sentences], dtype=np.int32)
+        self.dataset.word_offsets = data.sizes_to_offsets(self.dataset.sizes)
+        self.dataset.word_buffer = np.arange(100, 100 + len(words), dtype=np.uint16)
+        self.dataset.char_offsets = data.sizes_to_offsets(
+            np.array([len(word) for word in words], dtype=np.int32)
+        )
+        self.dataset.char_buffer = np.array(sum(words, []), dtype=np.uint8)
+
+    def test_collate_word_chars(self):
+        indices = [1, 3, 0, 2]
+        batch = self.dataset.collate_word_chars(indices, self.pad_idx)
+        src_tokens, src_lengths, char_inds, word_lengths = batch
+        max_words = max(len(self.sentences[i]) for i in indices)
+        max_word_length = max(len(word) for i in indices for word in self.sentences[i])
+        self.assertEqual((4, max_words), tuple(src_tokens.shape))
+        self.assertEqual((4, max_words, max_word_length), tuple(char_inds.shape))
+        for row, i in enumerate(indices):
+            tokens = np.asarray(self.dataset.get_tokens(i))
+            num_words = len(tokens)
+            self.assertEqual(num_words, int(src_lengths[row]))
+            self.assertListEqual(
+                tokens.tolist() + [self.pad_idx] * (max_words - num_words),
+                np.asarray(src_tokens[row]).tolist(),
+            )
+            for column in range(max_words):
+                chars = self.sentences[i][column] if column < num_words else []
+                self.assertEqual(len(chars), int(word_lengths[row, column]))
+                self.assertListEqual(
+                    chars + [self.pad_idx] * (max_word_length - len(chars)),
+                    np.asarray(char_inds[row, column]).tolist(),
+                )
+
+    def test_get_chars(self):
+        for i, sentence in enumerate(self.sentences):
+            chars, word_lengths = self.dataset.get_chars(i)
+            self.assertListEqual(sum(sentence, []), np.asarray(chars).tolist())
+            self.assertListEqual(
+                [len(word) for word in sentence], np.asarray(word_lengths).tolist()
+            )
@@ -3,7 +3,8 @@
 import os
 import unittest
 
-from pytorch_translate import data, dictionary
+import numpy as np
+from pytorch_translate import data, dictionary, mmap_format, sharding
 from pytorch_translate.test import utils as test_utils
 
 
@@ -104,6 +105,55 @@ class TestInMemoryNumpyDataset(unittest.TestCase):
             ]
             dataset.parse_multilingual(corpora)
             self.assertEqual((o1 + o2) * self.num_sentences, len(dataset))
+            self.assertEqual(len(dataset), len(dataset.sizes))
+            # Oversampled sentences are not stored repeatedly.
+            self.assertEqual(2 * self.num_sentences, dataset.num_unique_sentences())
+            for i in range(o1 * self.num_sentences):
+                self.assertListEqual(self.trg_ref[i // o1], dataset[i].tolist())
+
+    def test_change_oversampling(self):
+        corpora = [
+            data.MultilingualCorpusConfig(
+                dialect_id=10, data_file=self.src_txt, dict=self.d, oversampling=1
+            ),
+            data.MultilingualCorpusConfig(
+                dialect_id=11, data_file=self.trg_txt, dict=self.d, oversampling=3
+            ),
+        ]
+        dataset = data.InMemoryNumpyDataset()
+        dataset.parse_multilingual(corpora, append_eos=False)
+        for binary_format in data.BINARY_FORMATS:
+            path = test_utils.make_temp_file()
+            if binary_format == data.BINARY_FORMAT_NPZ:
+                path += ".npz"
+            dataset.save(path, binary_format=binary_format)
+            loaded = data.InMemoryNumpyDataset.create_from_file(path)
+            self.assertEqual(4 * self.num_sentences, len(loaded))
+            self.assertListEqual([1, 3], loaded.oversampling)
+            # Change the oversampling rates without re-binarizing.
+            loaded = data.InMemoryNumpyDataset.create_from_file(
+                path, oversampling=[2, 1]
+            )
+            self.assertEqual(3 * self.num_sentences, len(loaded))
+            self.assertListEqual(loaded[0].tolist(), loaded[1].tolist())
+            self.assertListEqual(
+                [11] + self.trg_ref[0], loaded[2 * self.num_sentences].tolist()
+            )
+            self.assertEqual(
+                len(loaded[2 * self.num_sentences]),
+                loaded.sizes[2 * self.num_sentences],
+            )
+            if binary_format == data.BINARY_FORMAT_MMAP:
+                for name in (
+                    "buffer",
+                    "offsets",
+                    "sizes",
+                    "corpus_sizes",
+                    "oversampling",
+                ):
+                    os.remove(mmap_format.mmap_array_path(path, name))
+            del loaded
+            os.remove(path)
 
     def test_parse_multiling(self):
         prepend_dataset = data.InMemoryNumpyDataset()
@@ -137,3 +187,214 @@ class TestInMemoryNumpyDataset(unittest.TestCase):
                 self.trg_ref[i] + [lang2],
                 append_dataset[i + self.num_sentences].tolist(),
             )
+        self.assertListEqual(
+            [lang1] * self.num_sentences + [lang2] * self.num_sentences,
+            prepend_dataset.boundary_tokens().tolist(),
+        )
+        self.assertListEqual(
+            prepend_dataset.boundary_tokens().tolist(),
+            append_dataset.boundary_tokens(last=True).tolist(),
+        )
+        # Oversampled sentences are repeated.
+        append_dataset.set_oversampling([1, 2])
+        self.assertListEqual(
+            [lang1] * self.num_sentences + [lang2] * 2 * self.num_sentences,
+            append_dataset.boundary_tokens(last=True).tolist(),
+        )
+
+    def test_save_load(self):
+        dataset = data.InMemoryNumpyDataset()
+        dataset.parse(self.src_txt, self.d, reverse_order=True, append_eos=False)
+        for binary_format in data.BINARY_FORMATS:
+            path = test_utils.make_temp_file()
+            if binary_format == data.BINARY_FORMAT_NPZ:
+                path += ".npz"
+            dataset.save(path, binary_format=binary_format)
+            loaded = data.InMemoryNumpyDataset.create_from_file(path)
+            self.assertEqual(self.num_sentences, len(loaded))
+            self.assertListEqual(dataset.sizes.tolist(), loaded.sizes.tolist())
+            # The compact dtype of the buffer is preserved.
+            self.assertEqual(np.uint8, loaded.buffer.dtype)
+            for i in range(self.num_sentences):
+                self.assertListEqual(self.src_ref[i], loaded[i].tolist())
+            if binary_format == data.BINARY_FORMAT_MMAP:
+                # The memory-mapped format is used without copying.
+                self.assertIsInstance(loaded.buffer, np.memmap)
+                self.assertEqual("r", loaded.buffer.mode)
+                for name in ("buffer", "offsets", "sizes"):
+                    os.remove(mmap_format.mmap_array_path(path, name))
+            del loaded
+            os.remove(path)
+
+    def test_raw_text_dataset(self):
+        src_dataset = data.InMemoryNumpyRawTextDataset(
+            self.src_txt, self.d, append_eos=False, reverse_order=True
+        )
+        trg_dataset = data.InMemoryNumpyRawTextDataset(self.trg_txt, self.d)
+        with open(self.src_txt, "r", encoding="utf-8") as f:
+            src_lines = [line.strip("\n") for line in f]
+        self.assertEqual(self.num_sentences, len(src_dataset))
+        self.assertEqual(self.num_sentences, len(trg_dataset))
+        self.assertEqual(np.uint8, src_dataset.buffer.dtype)
+        for i in range(self.num_sentences):
+            self.assertListEqual(self.src_ref[i], src_dataset[i].tolist())
+            self.assertListEqual(
+                self.trg_ref[i] + [self.d.eos_index], trg_dataset[i].tolist()
+            )
+            self.assertEqual(src_lines[i], src_dataset.get_original_text(i))
+        self.assertListEqual(
+            [len(ref) for ref in self.src_ref], src_dataset.sizes.tolist()
+        )
+
+        # The last line need not end with a newline.
+        path = test_utils.write_lines_to_temp_file(["b a", "c \u00e9"])
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("a")
+        dataset = data.InMemoryNumpyRawTextDataset(path, self.d, append_eos=False)
+        self.assertEqual(3, len(dataset))
+        self.assertListEqual([2, 2, 1], dataset.sizes.tolist())
+        self.assertListEqual(
+            ["b a", "c \u00e9", "a"],
+            [dataset.get_original_text(i) for i in range(len(dataset))],
+        )
+        os.remove(path)
+
+    def test_parse_multiple_workers(self):
+        corpora = [
+            data.MultilingualCorpusConfig(
+                dialect_id=10, data_file=self.src_txt, dict=self.d, oversampling=2
+            ),
+            data.MultilingualCorpusConfig(
+                dialect_id=11, data_file=self.trg_txt, dict=self.d, oversampling=1
+            ),
+        ]
+        single_dataset = data.InMemoryNumpyDataset()
+        single_dataset.parse_multilingual(corpora, append_eos=True)
+        for num_workers in (2, 3, 8):
+            offsets = sharding.find_line_offsets(self.src_txt, num_workers)
+            self.assertEqual(num_workers + 1, len(offsets))
+            self.assertEqual(os.path.getsize(self.src_txt), offsets[-1])
+            dataset = data.InMemoryNumpyDataset()
+            dataset.parse_multilingual(
+                corpora, append_eos=True, num_workers=num_workers
+            )
+            np.testing.assert_array_equal(single_dataset.buffer, dataset.buffer)
+            np.testing.assert_array_equal(single_dataset.offsets, dataset.offsets)
+            np.testing.assert_array_equal(single_dataset.sizes, dataset.sizes)
+
+    def test_parse_spill(self):
+        in_memory_dataset = data.InMemoryNumpyDataset()
+        in_memory_dataset.parse(
+            self.src_txt, self.d, reverse_order=True, append_eos=False
+        )
+        for num_workers in (1, 3):
+            path = test_utils.make_temp_file()
+            spill_path = mmap_format.mmap_array_path(path, "buffer")
+            dataset = data.InMemoryNumpyDataset()
+            dataset.parse(
+                self.src_txt,
+                self.d,
+                reverse_order=True,
+                append_eos=False,
+                num_workers=num_workers,
+                spill_path=spill_path,
+            )
+            self.assertIsInstance(dataset.buffer, np.memmap)
+            np.testing.assert_array_equal(in_memory_dataset.buffer, dataset.buffer)
+            # The buffer is already in place and is not written again.
+            dataset.save(path, binary_format=data.BINARY_FORMAT_MMAP)
+            loaded = data.InMemoryNumpyDataset.create_from_file(path)
+            for i in range(self.num_sentences):
+                self.assertListEqual(self.src_ref[i], loaded[i].tolist())
+            del dataset, loaded
+            for name in ("buffer", "offsets", "sizes"):
+                os.remove(mmap_format.mmap_array_path(path, name))
+            os.remove(path)
+
+
+class TestReadLines(unittest.TestCase):
+    def test_universal_newlines(self):
+        path = test_utils.make_temp_file()
+        with open(path, "wb") as f:
+            f.write(b"a b\rc\r\n\nd\re\nf\r")
+        with open(path, "r") as f:
+            expected = list(f)
+        self.assertListEqual(["a b\n", "c\n", "\n", "d\n", "e\n", "f\n"], expected)
+        for num_shards in (1, 2, 3):
+            offsets = sharding.find_line_offsets(path, num_shards)
+            lines = []
+            for start, end in zip(offsets[:-1], offsets[1:]):
+                lines.extend(sharding.read_lines(path, start, end))
+            self.assertListEqual(expected, lines)
+        os.remove(path)
+
+
+class TestCompactDtype(unittest.TestCase):
+    def test_compact_dtype(self):
+        self.assertEqual(np.uint8, data.compact_dtype(255))
+        self.assertEqual(np.uint16, data.compact_dtype(256))
+        self.assertEqual(np.uint16, data.compact_dtype(65535))
+        self.assertEqual(np.int32, data.compact_dtype(65536))
+
+
+class TestSizesToOffsets(unittest.TestCase):
+    def test_large_offsets(self):
+        sizes = np.full(3, 1 << 30, dtype=np.int32)
+        offsets = data.sizes_to_offsets(sizes)
+        self.assertEqual(np.int64, offsets.dtype)
+        self.assertListEqual([0, 1 << 30, 2 << 30, 3 << 30], offsets.tolist())
+
+
+class TestChunkedArrayWriter(unittest.TestCase):
+    def test_extend(self):
+        values = list(range(23))
+        for chunk_size in (1, 4, 5, 100):
+            writer = data.ChunkedArrayWriter(dtype=np.int32, chunk_size=chunk_size)
+            for start, end in ((0, 3), (3, 3), (3, 12), (12, 23)):
+                writer.extend(values[start:end])
+            self.assertEqual(len(values), len(writer))
+            array = writer.finalize()
+            self.assertEqual(np.int32, array.dtype)
+            self.assertListEqual(values, array.tolist())
+
+    def test_spill(self):
+        values = np.arange(23, dtype=np.int32)
+        spill_path = test_utils.make_temp_file()
+        writer = data.ChunkedArrayWriter(
+            dtype=np.int32, chunk_size=4, spill_path=spill_path
+        )
+        writer.extend(values[:10])
+        writer.extend(values[10:])
+        # At most one chunk is held in memory.
+        self.assertEqual(0, len(writer._full_chunks))
+        array = writer.finalize()
+        self.assertIsInstance(array, np.memmap)
+        self.assertListEqual(values.tolist(), array.tolist())
+        del array
+        os.remove(spill_path)
+
+
+class TestDeduplication(unittest.TestCase):
+    def test_hash_sentences(self):
+        sentences = [[4, 5], [], [5, 4], [4, 5], [4, 5, 0], [], [7]]
+        sizes = np.array([len(s) for s in sentences], dtype=np.int32)
+        offsets = data.sizes_to_offsets(sizes)
+        buffer = np.array(sum(sentences, []), dtype=np.int32)
+        hashes = data.hash_sentences(buffer, offsets)
+        # Chunking and the buffer dtype do not change the hashes.
+        for chunk_tokens in (1, 2, 3):
+            np.testing.assert_array_equal(
+                hashes,
+                data.hash_sentences(
+                    buffer.astype(np.uint8), offsets, max_chunk_tokens=chunk_tokens
+                ),
+            )
+        self.assertEqual(hashes[0], hashes[3])
+        self.assertEqual(hashes[1], hashes[5])
+        self.assertEqual(5, len(set(hashes.tolist())))
+
+        expected = [False, False, False, True, False, True, False]
+        self.assertListEqual(expected, data.find_duplicates(hashes).tolist())
+        self.assertListEqual(
+            expected, data.find_duplicates(hashes, max_partition_size=1).tolist()
+        )
@@ -3,10 +3,22 @@
 import os
 import unittest
 
-from pytorch_translate import dictionary
+from pytorch_translate import dictionary, mmap_format
 from pytorch_translate.test import utils as test_utils
 
 
+def remove_vocab_file(vocab_file):
+    """Removes a vocab file written by Dictionary.save() and its binary copy."""
+    binary_path = dictionary.binary_dictionary_path(vocab_file)
+    paths = [vocab_file, binary_path] + [
+        mmap_format.mmap_array_path(binary_path, name)
+        for name in ("symbols", "symbol_offsets", "counts")
+    ]
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
 class TestDictionary(unittest.TestCase):
     def test_base(self):
         d = dictionary.Dictionary()
@@ -64,10 +76,9 @@ class TestDictionary(unittest.TestCase):
             self.assertEqual(trg_dict1.count[c], trg_dict1_loaded.count[c])
             self.assertEqual(trg_dict2.count[c], trg_dict2_loaded.count[c])
             self.assertEqual(trg_dict1.count[c] * 3, trg_dict2.count[c])
-        os.remove(f"{tmp_prefix}.src1")
-        os.remove(f"{tmp_prefix}.src2")
-        os.remove(f"{tmp_prefix}.trg1")
-        os.remove(f"{tmp_prefix}.trg2")
+        for suffix in ("src1", "src2", "trg1", "trg2", "srctrg"):
+            remove_vocab_file(f"{tmp_prefix}.{suffix}")
+        os.remove(tmp_prefix)
         os.remove(src_txt)
         os.remove(trg_txt)
 
@@ -102,10 +113,88 @@ class TestDictionary(unittest.TestCase):
         self.assertEqual(src_dict2.nspecial + 2, len(src_dict2))
         self.assertEqual(src_dict3.nspecial + 4, len(src_dict3))
         self._assert_vocab_equal(src_dict3, src_dict4)
-        os.remove(f"{tmp_prefix}.src1")
-        os.remove(f"{tmp_prefix}.src2")
-        os.remove(f"{tmp_prefix}.src3")
-        os.remove(f"{tmp_prefix}.src4")
+        for suffix in ("src1", "src2", "src3", "src4"):
+            remove_vocab_file(f"{tmp_prefix}.{suffix}")
+        os.remove(tmp_prefix)
+        os.remove(src_txt)
+        os.remove(trg_txt)
+
+    def test_build_vocab_file_multiple_workers(self):
+        src_txt, trg_txt = test_utils.create_test_text_files()
+        tmp_prefix = test_utils.make_temp_file()
+        d = dictionary.Dictionary()
+        for corpus_file in (src_txt, trg_txt):
+            dictionary.add_file_to_dictionary(
+                filename=corpus_file, dict=d, tokenize=dictionary.tokenize_line
+            )
+        d.finalize(padding_factor=1)
+        for num_workers in (1, 3):
+            parallel_dict = dictionary.Dictionary.build_vocab_file(
+                corpus_files=[src_txt, trg_txt],
+                vocab_file=f"{tmp_prefix}.{num_workers}",
+                max_vocab_size=-1,
+                padding_factor=1,
+                num_workers=num_workers,
+            )
+            self._assert_vocab_equal(d, parallel_dict)
+            self.assertListEqual(d.count, parallel_dict.count)
+            remove_vocab_file(f"{tmp_prefix}.{num_workers}")
+        os.remove(tmp_prefix)
+        os.remove(src_txt)
+        os.remove(trg_txt)
+
+    def test_encode_lines(self):
+        d = dictionary.Dictionary()
+        a, b, c = (d.add_symbol(symbol) for symbol in ("a", "b", "c"))
+        lines = ["a b  c\n", "\n", "c unknown a"]
+        ids, offsets = d.encode_lines(lines)
+        self.assertListEqual([0, 3, 3, 6], offsets.tolist())
+        self.assertListEqual([a, b, c, c, d.unk_index, a], ids.tolist())
+        ids, offsets = d.encode_lines(
+            lines, append_eos=True, reverse_order=True, prepend_ids=[11]
+        )
+        self.assertListEqual([0, 5, 7, 12], offsets.tolist())
+        self.assertListEqual(
+            [11, c, b, a, d.eos_index, 11, d.eos_index, 11, a, d.unk_index, c]
+            + [d.eos_index],
+            ids.tolist(),
+        )
+        ids, offsets = d.encode_lines(
+            [["2", "1"], ["3"]],
+            tokenize=None,
+            append_ids=[11],
+            lookup=dictionary.numberized_lookup,
+        )
+        self.assertListEqual([0, 3, 5], offsets.tolist())
+        self.assertListEqual([2, 1, 11, 3, 11], ids.tolist())
+        ids, offsets = d.encode_lines([], append_eos=True)
+        self.assertEqual(0, len(ids))
+        self.assertListEqual([0], offsets.tolist())
+
+    def test_save_load_binary(self):
+        src_txt, trg_txt = test_utils.create_test_text_files()
+        vocab_file = test_utils.make_temp_file()
+        d = dictionary.Dictionary.build_vocab_file(
+            corpus_files=[src_txt, trg_txt], vocab_file=vocab_file, max_vocab_size=-1
+        )
+        binary_path = dictionary.binary_dictionary_path(vocab_file)
+        self.assertTrue(os.path.isfile(binary_path))
+        loaded = dictionary.Dictionary.load(vocab_file)
+        # The symbol to index mapping is built lazily.
+        self.assertIsNone(loaded._indices)
+        self.assertListEqual(d.count[d.nspecial :], loaded.count[d.nspecial :])
+        self._assert_vocab_equal(d, loaded)
+        self.assertEqual(d.index("srcB"), loaded.index("srcB"))
+
+        # A binary copy which does not match the text file is ignored.
+        with open(vocab_file, "a", encoding="utf-8") as f:
+            f.write("appended 1\n")
+        self.assertIsNone(dictionary.Dictionary.load_binary(vocab_file))
+        loaded = dictionary.Dictionary.load(vocab_file)
+        self.assertEqual(len(d) + 1, len(loaded))
+        self.assertEqual(len(d), loaded.index("appended"))
+
+        remove_vocab_file(vocab_file)
         os.remove(src_txt)
         os.remove(trg_txt)
 
@@ -135,7 +224,8 @@ class TestMaxVocabDictionary(unittest.TestCase):
         self.assertEqual(len(max_vocab_dict), len(srctrg_dict))
         max_vocab_dict.push(src_dict)
         self.assertEqual(len(max_vocab_dict), len(srctrg_dict))
-        os.remove(f"{tmp_prefix}.src")
-        os.remove(f"{tmp_prefix}.srctrg")
+        remove_vocab_file(f"{tmp_prefix}.src")
+        remove_vocab_file(f"{tmp_prefix}.srctrg")
+        os.remove(tmp_prefix)
         os.remove(src_txt)
         os.remove(trg_txt)
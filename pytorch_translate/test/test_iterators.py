@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from pytorch_translate import iterators
+
+
+class TestPrefetchIterator(unittest.TestCase):
+    def test_order(self):
+        itr = iterators.PrefetchIterator(range(100), num_batches=3)
+        self.assertEqual(100, len(itr))
+        self.assertListEqual(list(range(100)), list(itr))
+
+    def test_close_early(self):
+        itr = iterators.PrefetchIterator(range(100), num_batches=3)
+        self.assertListEqual([0, 1], [next(itr), next(itr)])
+        itr.close()
+        self.assertFalse(itr._thread.is_alive())
+        self.assertListEqual([], list(itr))
+
+    def test_error(self):
+        def batches():
+            yield 0
+            raise ValueError("bad batch")
+
+        itr = iterators.PrefetchIterator(batches(), num_batches=2)
+        self.assertEqual(0, next(itr))
+        with self.assertRaises(ValueError):
+            next(itr)
+
+    def test_base_exception(self):
+        def batches():
+            yield 0
+            raise KeyboardInterrupt()
+
+        itr = iterators.PrefetchIterator(batches(), num_batches=2)
+        self.assertEqual(0, next(itr))
+        with self.assertRaises(KeyboardInterrupt):
+            next(itr)
+        self.assertFalse(itr._thread.is_alive())
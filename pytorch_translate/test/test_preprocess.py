@@ -2,9 +2,19 @@
 
 import argparse
 import os
+import shutil
+import tempfile
 import unittest
 
-from pytorch_translate import constants, preprocess
+import numpy as np
+from pytorch_translate import (
+    binarization_cache,
+    constants,
+    data,
+    mmap_format,
+    preprocess,
+    weighted_data,
+)
 from pytorch_translate.test import utils as test_utils
 
 
@@ -84,3 +94,172 @@ class TestPreprocess(unittest.TestCase):
             file_path = getattr(args, file_type)
             assert file_path and os.path.isfile(file_path)
             assert file_path.endswith(".npz")
+
+    def test_preprocess_mmap_format(self):
+        args = self.get_common_data_args_namespace()
+        args.binary_format = "mmap"
+        preprocess.preprocess_corpora(args)
+        for file_type in (
+            "train_source_binary_path",
+            "train_target_binary_path",
+            "eval_source_binary_path",
+            "eval_target_binary_path",
+        ):
+            file_path = getattr(args, file_type)
+            assert file_path and os.path.isfile(file_path)
+            assert mmap_format.read_mmap_header(file_path) is not None
+            dataset = data.InMemoryNumpyDataset.create_from_file(file_path)
+            assert len(dataset) == 4
+
+    def test_binarization_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            args = self.get_common_data_args_namespace()
+            args.binarization_cache_dir = cache_dir
+            preprocess.preprocess_corpora(args)
+            assert os.path.dirname(args.train_source_binary_path) == cache_dir
+            cached_files = sorted(os.listdir(cache_dir))
+
+            # Outputs of a job which died before committing them (here a pid
+            # above the kernel's pid limit) are removed by later lookups.
+            key = os.path.basename(args.train_source_binary_path).split(".")[0]
+            stale_path = os.path.join(
+                cache_dir, f"{binarization_cache._output_prefix(key)}{1 << 23}.npz"
+            )
+            open(stale_path, "w").close()
+
+            # Nothing is binarized again with the same text files, vocabs and
+            # flags.
+            reused_args = self.get_common_data_args_namespace()
+            reused_args.binarization_cache_dir = cache_dir
+            preprocess.preprocess_corpora(reused_args)
+            self.assertListEqual(cached_files, sorted(os.listdir(cache_dir)))
+            for file_type in (
+                "train_source_binary_path",
+                "train_target_binary_path",
+                "eval_source_binary_path",
+                "eval_target_binary_path",
+            ):
+                self.assertEqual(
+                    getattr(args, file_type), getattr(reused_args, file_type)
+                )
+
+            unreversed_args = self.get_common_data_args_namespace()
+            unreversed_args.binarization_cache_dir = cache_dir
+            unreversed_args.reverse_source = False
+            preprocess.preprocess_corpora(unreversed_args)
+            self.assertNotEqual(
+                args.train_source_binary_path,
+                unreversed_args.train_source_binary_path,
+            )
+            self.assertEqual(
+                args.train_target_binary_path,
+                unreversed_args.train_target_binary_path,
+            )
+            source = data.InMemoryNumpyDataset.create_from_file(
+                args.train_source_binary_path
+            )
+            unreversed_source = data.InMemoryNumpyDataset.create_from_file(
+                unreversed_args.train_source_binary_path
+            )
+            self.assertListEqual(
+                source[0].tolist()[::-1], unreversed_source[0].tolist()
+            )
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_binarize_weights_file(self):
+        def read_weights(path):
+            return weighted_data.IndexedWeightsDataset(path).values.tolist()
+
+        text_file = test_utils.write_lines_to_temp_file(["0.5", "1.5"])
+        temp_file = test_utils.make_temp_file()
+        output_path = f"{temp_file}.npy"
+        preprocess.binarize_weights_file(text_file, output_path)
+        self.assertListEqual([0.5, 1.5], read_weights(output_path))
+        # Binarized weights newer than the text file are kept.
+        other_weights = weighted_data.IndexedWeightsDataset()
+        other_weights.values = np.array([2.0, 3.0], dtype=np.float32)
+        other_weights.save(output_path)
+        preprocess.binarize_weights_file(text_file, output_path)
+        self.assertListEqual([2.0, 3.0], read_weights(output_path))
+        stat = os.stat(output_path)
+        os.utime(text_file, (stat.st_atime + 10, stat.st_mtime + 10))
+        preprocess.binarize_weights_file(text_file, output_path)
+        self.assertListEqual([0.5, 1.5], read_weights(output_path))
+        for path in (text_file, temp_file, output_path):
+            os.remove(path)
+
+    def test_filter_parallel_corpus(self):
+        args = self.get_common_data_args_namespace()
+        args.train_source_text_file = test_utils.write_lines_to_temp_file(
+            ["a b c", "a b", "a b c", "a b c", "a"]
+        )
+        args.train_target_text_file = test_utils.write_lines_to_temp_file(
+            ["x y z", "x y", "x y z", "x y", "x y z w v u"]
+        )
+        args.train_weights_path = test_utils.write_lines_to_temp_file(
+            ["0.1", "0.2", "0.3", "0.4", "0.5"]
+        )
+        args.train_dedup = True
+        args.train_max_length_ratio = 3.0
+        preprocess.preprocess_corpora(args)
+        # The third pair duplicates the first one, and the target of the last
+        # pair is more than 3 times as long as its source.
+        source = data.InMemoryNumpyDataset.create_from_file(
+            args.train_source_binary_path
+        )
+        target = data.InMemoryNumpyDataset.create_from_file(
+            args.train_target_binary_path
+        )
+        weights = weighted_data.IndexedWeightsDataset(args.train_weights_binary_path)
+        self.assertEqual(3, len(source))
+        self.assertEqual(3, len(target))
+        self.assertListEqual([3, 2, 3], source.sizes.tolist())
+        self.assertListEqual([4, 3, 3], target.sizes.tolist())
+        self.assertListEqual(
+            [0.1, 0.2, 0.4], [round(weights[i], 6) for i in range(len(weights))]
+        )
+
+    def test_filter_parallel_corpus_cached(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            source_text_file = test_utils.write_lines_to_temp_file(
+                ["a b c", "a b", "a b c"]
+            )
+            target_text_file = test_utils.write_lines_to_temp_file(
+                ["x y z", "x y", "x y z"]
+            )
+            weights_file = test_utils.write_lines_to_temp_file(["0.1", "0.2", "0.3"])
+            all_args = []
+            for _ in range(2):
+                args = self.get_common_data_args_namespace()
+                args.train_source_text_file = source_text_file
+                args.train_target_text_file = target_text_file
+                args.train_weights_path = weights_file
+                args.train_dedup = True
+                args.binarization_cache_dir = cache_dir
+                preprocess.preprocess_corpora(args)
+                all_args.append(args)
+                if len(all_args) == 1:
+                    cached_files = sorted(os.listdir(cache_dir))
+            # The filtered corpus is cached as well.
+            self.assertListEqual(cached_files, sorted(os.listdir(cache_dir)))
+            for file_type in (
+                "train_source_binary_path",
+                "train_target_binary_path",
+                "train_weights_binary_path",
+            ):
+                path = getattr(all_args[0], file_type)
+                self.assertEqual(cache_dir, os.path.dirname(path))
+                self.assertEqual(path, getattr(all_args[1], file_type))
+            source = data.InMemoryNumpyDataset.create_from_file(
+                all_args[0].train_source_binary_path
+            )
+            self.assertEqual(2, len(source))
+            weights = weighted_data.IndexedWeightsDataset(
+                all_args[0].train_weights_binary_path
+            )
+            self.assertEqual(2, len(weights))
+        finally:
+            shutil.rmtree(cache_dir)
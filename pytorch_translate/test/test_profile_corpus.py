@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from pytorch_translate import data, dictionary, profile_corpus
+from pytorch_translate.test import utils as test_utils
+
+
+class TestProfileCorpus(unittest.TestCase):
+    def setUp(self):
+        self.src_txt, self.trg_txt = test_utils.create_test_text_files()
+        self.vocab_file_path = test_utils.make_temp_file()
+        self.d = dictionary.Dictionary.build_vocab_file(
+            corpus_files=[self.src_txt, self.trg_txt],
+            vocab_file=self.vocab_file_path,
+            max_vocab_size=0,
+            padding_factor=1,  # don't add extra padding symbols
+        )
+        self.binary_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        os.remove(self.src_txt)
+        os.remove(self.trg_txt)
+        os.remove(self.vocab_file_path)
+        shutil.rmtree(self.binary_dir)
+
+    def test_read_sizes(self):
+        dataset = data.InMemoryNumpyDataset()
+        dataset.parse(self.trg_txt, self.d, append_eos=True)
+        for binary_format in data.BINARY_FORMATS:
+            path = os.path.join(self.binary_dir, f"train.{binary_format}")
+            dataset.save(path, binary_format=binary_format)
+            self.assertListEqual(
+                [11, 9, 7, 5], profile_corpus.read_sizes(path).tolist()
+            )
+
+    def test_length_histogram(self):
+        histogram = profile_corpus.length_histogram(np.array([1, 2, 3, 3, 9]))
+        self.assertListEqual([(1, 2, 1), (2, 4, 3), (8, 16, 1)], histogram)
+
+    def test_simulate_batching(self):
+        rng = np.random.RandomState(0)
+        src_sizes = rng.randint(1, 50, size=20000)
+        tgt_sizes = src_sizes + rng.randint(0, 5, size=20000)
+        full = profile_corpus.simulate_batching(
+            src_sizes, tgt_sizes, max_tokens=1000, max_sentences=None
+        )
+        sampled = profile_corpus.simulate_batching(
+            src_sizes, tgt_sizes, max_tokens=1000, max_sentences=None, sample_size=5000
+        )
+        # Batching a sample estimates the number of batches of the corpus.
+        ratio = sampled["num_batches"] / full["num_batches"]
+        self.assertAlmostEqual(1.0, ratio, delta=0.05)
+        for stats in (full, sampled):
+            self.assertLessEqual(stats["source_pad_efficiency"], 1.0)
+            self.assertLessEqual(stats["target_pad_efficiency"], 1.0)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from pytorch_translate import data, dictionary, sharded_data, weighted_data
+from pytorch_translate.test import utils as test_utils
+
+
+class TestShardedData(unittest.TestCase):
+    def setUp(self):
+        self.src_txt, self.trg_txt = test_utils.create_test_text_files()
+        self.vocab_file_path = test_utils.make_temp_file()
+        self.d = dictionary.Dictionary.build_vocab_file(
+            corpus_files=[self.src_txt, self.trg_txt],
+            vocab_file=self.vocab_file_path,
+            max_vocab_size=0,
+            padding_factor=1,  # don't add extra padding symbols
+        )
+        self.src_dataset = data.InMemoryNumpyDataset()
+        self.src_dataset.parse(self.src_txt, self.d, reverse_order=True)
+        self.trg_dataset = data.InMemoryNumpyDataset()
+        self.trg_dataset.parse(self.trg_txt, self.d, append_eos=True)
+        self.num_sentences = len(self.src_dataset)
+        self.shard_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        os.remove(self.src_txt)
+        os.remove(self.trg_txt)
+        os.remove(self.vocab_file_path)
+        shutil.rmtree(self.shard_dir)
+
+    def _save_shards(self, dataset, name, num_shards, binary_format):
+        path = os.path.join(self.shard_dir, name)
+        sharded_data.save_shards(dataset, path, num_shards, binary_format)
+        return path
+
+    def test_save_load_shards(self):
+        for binary_format in data.BINARY_FORMATS:
+            path = self._save_shards(self.src_dataset, binary_format, 3, binary_format)
+            self.assertTrue(sharded_data.is_shard_manifest(path))
+            corpus = sharded_data.ShardedCorpus(path)
+            self.assertEqual(3, len(corpus))
+            self.assertEqual(self.num_sentences, corpus.num_examples())
+            loaded = corpus.load(range(3))
+            self.assertEqual(self.num_sentences, len(loaded))
+            for i in range(self.num_sentences):
+                self.assertListEqual(self.src_dataset[i].tolist(), loaded[i].tolist())
+            # Loading a subset of the shards.
+            start, end = corpus.example_ranges([2])[0]
+            loaded = corpus.load([2])
+            self.assertEqual(end - start, len(loaded))
+            for i in range(start, end):
+                self.assertListEqual(
+                    self.src_dataset[i].tolist(), loaded[i - start].tolist()
+                )
+        # Neither binary datasets nor text files are manifests.
+        self.assertFalse(sharded_data.is_shard_manifest(self.src_txt))
+        self.assertFalse(
+            sharded_data.is_shard_manifest(
+                sharded_data.shard_path(path, 0, data.BINARY_FORMAT_MMAP)
+            )
+        )
+
+    def test_shard_window(self):
+        num_shards, window_size = 7, 3
+        for seed in range(3):
+            windows = [
+                sharded_data.shard_window(num_shards, window_size, epoch, seed)
+                for epoch in range(1, 7)
+            ]
+            # Each pass of 3 epochs visits every shard exactly once.
+            for pass_windows in (windows[:3], windows[3:]):
+                self.assertListEqual(
+                    list(range(num_shards)), sorted(sum(pass_windows, []))
+                )
+            self.assertListEqual(
+                windows,
+                [
+                    sharded_data.shard_window(num_shards, window_size, epoch, seed)
+                    for epoch in range(1, 7)
+                ],
+            )
+        self.assertListEqual(
+            list(range(num_shards)), sharded_data.shard_window(num_shards, 0, 5)
+        )
+
+    def test_load_window(self):
+        weights = np.arange(self.num_sentences, dtype=np.float32)
+        weights_file = os.path.join(self.shard_dir, "weights.npy")
+        np.save(weights_file, weights)
+        corpus = sharded_data.ShardedParallelCorpus(
+            source_path=self._save_shards(
+                self.src_dataset, "src", 2, data.BINARY_FORMAT_MMAP
+            ),
+            target_path=self._save_shards(
+                self.trg_dataset, "trg", 2, data.BINARY_FORMAT_MMAP
+            ),
+            weights_file=weights_file,
+            window_size=1,
+        )
+        first, second = corpus.window_for_epoch(1), corpus.window_for_epoch(2)
+        self.assertListEqual([0, 1], sorted(first + second))
+        corpus.load_window(first, prefetch_shard_ids=second)
+        src, trg, window_weights = corpus.load_window(second)
+        start, end = corpus.source.example_ranges(second)[0]
+        self.assertEqual(end - start, len(src))
+        self.assertEqual(end - start, len(trg))
+        self.assertIsInstance(window_weights, weighted_data.IndexedWeightsDataset)
+        self.assertListEqual(
+            weights[start:end].tolist(), [window_weights[i] for i in range(end - start)]
+        )
+        for i in range(start, end):
+            self.assertListEqual(self.src_dataset[i].tolist(), src[i - start].tolist())
+            self.assertListEqual(self.trg_dataset[i].tolist(), trg[i - start].tolist())
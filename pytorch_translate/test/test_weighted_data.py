@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+import os
+import unittest
+
+import numpy as np
+import torch
+from pytorch_translate import weighted_data
+from pytorch_translate.test import utils as test_utils
+
+
+class TestIndexedWeightsDataset(unittest.TestCase):
+    def setUp(self):
+        self.weights = [0.5, 1.0, 0.25, 0.0]
+        self.weights_txt = test_utils.write_lines_to_temp_file(
+            [str(w) for w in self.weights]
+        )
+
+    def tearDown(self):
+        os.remove(self.weights_txt)
+
+    def test_binarize(self):
+        binary_path = test_utils.make_temp_file()
+        weighted_data.binarize_weights_file(self.weights_txt, binary_path)
+        self.assertTrue(weighted_data.is_binarized_weights_file(binary_path))
+        self.assertFalse(weighted_data.is_binarized_weights_file(self.weights_txt))
+        for path in (self.weights_txt, binary_path):
+            dataset = weighted_data.IndexedWeightsDataset(path)
+            self.assertEqual(len(self.weights), len(dataset))
+            self.assertListEqual(self.weights, [dataset[i] for i in range(4)])
+        # The binarized weights are memory-mapped.
+        self.assertIsInstance(dataset.values, np.memmap)
+        del dataset
+        os.remove(binary_path)
+
+    def test_gather_weights(self):
+        dataset = weighted_data.IndexedWeightsDataset(self.weights_txt)
+        ids = torch.LongTensor([2, 0, 3])
+        weights = weighted_data.gather_weights(dataset, ids)
+        self.assertEqual(torch.float, weights.dtype)
+        self.assertListEqual([0.25, 0.5, 0.0], weights.tolist())
+        weights = weighted_data.gather_weights(None, ids)
+        self.assertListEqual([1.0, 1.0, 1.0], weights.tolist())
@@ -2,7 +2,8 @@
 
 import unittest
 
-from pytorch_translate import word_dropout
+import torch
+from pytorch_translate import dictionary, word_dropout
 from pytorch_translate.test import utils as test_utils
 
 
@@ -17,3 +18,27 @@ class TestWordDropout(unittest.TestCase):
         samples, src_dict, tgt_dict = test_utils.prepare_inputs(test_args)
         word_dropout_module = word_dropout.WordDropout(src_dict, word_dropout_params)
         word_dropout_module.apply_probabilistic_unking(3)
+
+    def test_forward(self):
+        src_dict = dictionary.Dictionary()
+        rare = src_dict.add_symbol("rare", n=1)
+        frequent = src_dict.add_symbol("frequent", n=100)
+        word_dropout_module = word_dropout.WordDropout(
+            src_dict,
+            {"word_dropout_freq_threshold": 3, "word_dropout_smoothing_alpha": 1},
+        )
+        src_tokens = torch.LongTensor(
+            [[rare] * 50 + [frequent] * 50 + [src_dict.eos_index]] * 20
+        )
+        torch.manual_seed(1)
+        dropped = word_dropout_module(src_tokens)
+        # The input is not modified.
+        self.assertEqual(rare, src_tokens[0, 0].item())
+        self.assertTrue((dropped[:, 50:] == src_tokens[:, 50:]).all())
+        # Rare words are dropped with probability 1 / (1 + 1).
+        num_unks = (dropped[:, :50] == src_dict.unk_index).sum().item()
+        num_rare = (dropped[:, :50] == rare).sum().item()
+        self.assertEqual(1000, num_unks + num_rare)
+        self.assertTrue(400 < num_unks < 600)
+        torch.manual_seed(1)
+        self.assertTrue((word_dropout_module(src_tokens) == dropped).all())
@@ -30,10 +30,12 @@ from pytorch_translate import transformer  # noqa
 from pytorch_translate import weighted_criterions  # noqa
 from pytorch_translate import (
     average_checkpoints,
+    batching,
     constants,
     data as pytorch_translate_data,
     dictionary as pytorch_translate_dictionary,
     generate,
+    iterators,
     multi_model,
     options as pytorch_translate_options,
     preprocess,
@@ -269,7 +271,8 @@ def setup_training_model(args):
             split=args.train_subset,
             src_bin_path=args.train_source_binary_path,
             tgt_bin_path=args.train_target_binary_path,
-            weights_file=getattr(args, "train_weights_path", None),
+            weights_file=getattr(args, "train_weights_binary_path", None)
+            or getattr(args, "train_weights_path", None),
         )
     task.load_dataset(
         split=args.valid_subset,
@@ -362,7 +365,34 @@ def build_trainer(args, task, model, criterion, trainer_class):
         flush=True,
     )
     extra_state = setup_training_state(args, trainer, task)
+    load_train_shard_window(args, task, extra_state)
+    epoch_itr = create_epoch_iterator(args, task, max_positions, extra_state)
+    return trainer, extra_state, epoch_itr
+
+
+def load_train_shard_window(args, task, extra_state) -> bool:
+    """For training corpora binarized in shards, loads the shards of the
+    current epoch, and records them in extra_state so that training resumes
+    mid-epoch on the same shards even if the shard schedule has changed.
 
+    Returns:
+        Whether the training corpus is sharded.
+    """
+    shard_ids = None
+    if extra_state["batch_offset"]:
+        shard_ids = extra_state.get("train_shards")
+    shard_ids = task.load_shard_window(
+        args.train_subset, extra_state["epoch"], shard_ids=shard_ids
+    )
+    if shard_ids is None:
+        return False
+    extra_state["train_shards"] = shard_ids
+    return True
+
+
+def create_epoch_iterator(args, task, max_positions, extra_state):
+    """Creates the iterator over the training set, positioned at the epoch
+    and batch offset of extra_state."""
     epoch_itr = task.get_batch_iterator(
         dataset=task.dataset(args.train_subset),
         max_tokens=args.max_tokens,
@@ -380,7 +410,7 @@ def build_trainer(args, task, model, criterion, trainer_class):
     epoch_itr.load_state_dict(
         {"epoch": epoch, "iterations_in_epoch": extra_state["batch_offset"]}
     )
-    return trainer, extra_state, epoch_itr
+    return epoch_itr
 
 
 def setup_training(args, trainer_class=None):
@@ -575,6 +605,9 @@ def train(
             if stop_training_mid_epoch:
                 break
 
+        if isinstance(itr, iterators.PrefetchIterator):
+            itr.close()
+
         # log end-of-epoch stats
         train_stats = log_end_epoch_stats(
             trainer=trainer, progress=progress, extra_meters=extra_meters
@@ -617,6 +650,20 @@ def train(
         extra_state["epoch"] += 1
         extra_state["batch_offset"] = 0
         starting_offset = 0
+        if lr <= args.min_lr or extra_state["epoch"] > max_epoch:
+            # Training is over, so there is no next window of shards to load.
+            break
+        if load_train_shard_window(args, task, extra_state):
+            # Each window of shards is a different dataset, with its own
+            # batches.
+            epoch_itr = create_epoch_iterator(
+                args,
+                task,
+                utils.resolve_max_positions(
+                    task.max_positions(), trainer.get_model().max_positions()
+                ),
+                extra_state,
+            )
 
     train_meter.stop()
     print(f"| done training in {train_meter.sum:.1f} seconds")
@@ -655,7 +702,13 @@ def setup_epoch(args, epoch_itr, trainer):
 
     # Initialize dataloader, starting at batch_offset
     itr = epoch_itr.next_epoch_itr()
+    log_pad_efficiency(epoch_itr)
     itr = data.iterators.GroupedIterator(itr, update_freq)
+    prefetch_batches = getattr(args, "prefetch_batches", 0)
+    if prefetch_batches > 0:
+        itr = iterators.PrefetchIterator(
+            itr, prefetch_batches, pin_memory=getattr(args, "pin_memory", False)
+        )
     progress = progress_bar.build_progress_bar(
         args, itr, epoch_itr.epoch, no_progress_bar="simple"
     )
@@ -679,6 +732,24 @@ def setup_epoch(args, epoch_itr, trainer):
     return itr, progress, extra_meters
 
 
+def log_pad_efficiency(epoch_itr):
+    """Reports the fraction of real (non-pad) tokens in the source and target
+    batches of an epoch, to help tune --max-tokens and batching."""
+    dataset = epoch_itr.dataset
+    if not hasattr(dataset, "src_sizes"):
+        return
+    batches = epoch_itr.frozen_batches
+    message = (
+        f"| epoch {epoch_itr.epoch:03d}: {len(batches)} batches, pad efficiency "
+        f"source {batching.pad_efficiency(batches, dataset.src_sizes):.1%}"
+    )
+    if getattr(dataset, "tgt_sizes", None) is not None:
+        message += (
+            f", target {batching.pad_efficiency(batches, dataset.tgt_sizes):.1%}"
+        )
+    print(message, flush=True)
+
+
 def log_mid_epoch_stats(trainer, progress, extra_meters, log_output):
     stats = get_training_stats(trainer)
     for k, v in log_output.items():
@@ -143,15 +143,24 @@ def get_translation_candidates(
         with codecs.open(lexical_dictionary, "r", "utf-8") as lexical_dictionary_file:
             current_source_index = None
             current_target_indices = []
+            alignments = []
             for line in lexical_dictionary_file.readlines():
                 alignment_data = line.split()
                 if len(alignment_data) != 3:
                     logger.warning(f"Malformed line in lexical dictionary: {line}")
                     continue
-                source_word, target_word, prob = alignment_data
+                alignments.append(alignment_data)
+            # Numberize the source and target words of all lines at once.
+            source_indices, _ = src_dict.encode_lines(
+                [[source_word for source_word, _, _ in alignments]], tokenize=None
+            )
+            target_indices, _ = dst_dict.encode_lines(
+                [[target_word for _, target_word, _ in alignments]], tokenize=None
+            )
+            for (_, _, prob), source_index, target_index in zip(
+                alignments, source_indices.tolist(), target_indices.tolist()
+            ):
                 prob = float(prob)
-                source_index = src_dict.index(source_word)
-                target_index = dst_dict.index(target_word)
                 if (
                     source_index not in src_dict.lexicon_indices
                     and target_index in dst_dict.lexicon_indices
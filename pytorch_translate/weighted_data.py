@@ -1,23 +1,86 @@
 #!/usr/bin/env python3
 
+import numpy as np
 import torch
 from fairseq import data
 
 
+NPY_MAGIC = b"\x93NUMPY"
+
+
+def is_binarized_weights_file(path):
+    with open(path, "rb") as f:
+        return f.read(len(NPY_MAGIC)) == NPY_MAGIC
+
+
+def binarize_weights_file(text_path, output_path):
+    """Converts a text file of one weight per line to a float32 .npy file."""
+    weights = IndexedWeightsDataset(text_path)
+    weights.save(output_path)
+    return output_path
+
+
+def gather_weights(weights, ids):
+    """Returns the weights of examples `ids` (a LongTensor) as a FloatTensor,
+    looked up in a single gather. All weights are 1.0 if there is no
+    IndexedWeightsDataset."""
+    if not weights:
+        return torch.ones(len(ids), dtype=torch.float)
+    return torch.from_numpy(weights.get_weights(ids.numpy()))
+
+
 class IndexedWeightsDataset(data.indexed_dataset.IndexedDataset):
-    def __init__(self, path):
-        self.values = []
-        self.read_data(path)
+    """Weights of the examples of a dataset, read either from a text file of
+    one weight per line, or from a float32 .npy file (see save()) which is
+    memory-mapped."""
+
+    def __init__(self, path=None):
+        self.values = None
+        self.size = 0
+        if path is not None:
+            self.read_data(path)
 
     def read_data(self, path):
-        with open(path, "r") as f:
-            for line in f:
-                self.values.append(float(line.strip("\n")))
-            self.size = len(self.values)
+        if is_binarized_weights_file(path):
+            self.values = np.load(path, mmap_mode="r")
+        else:
+            with open(path, "r") as f:
+                self.values = np.array(
+                    [line.strip("\n") for line in f], dtype=np.float32
+                )
+        self.size = len(self.values)
+
+    def save(self, path):
+        # np.save() would append .npy to paths without that suffix.
+        with open(path, "wb") as f:
+            np.save(f, np.asarray(self.values, dtype=np.float32))
+
+    def get_weights(self, indices):
+        """Vectorized look-up of the float32 weights of an array of indices."""
+        return np.asarray(self.values[indices], dtype=np.float32)
+
+    def select(self, indices):
+        """Returns an in-memory IndexedWeightsDataset of the weights of the
+        examples `indices`, in that order."""
+        result = IndexedWeightsDataset()
+        result.values = self.get_weights(np.asarray(indices, dtype=np.int64))
+        result.size = len(result.values)
+        return result
+
+    def select_ranges(self, ranges):
+        """Returns an in-memory IndexedWeightsDataset of the weights of the
+        examples in each [start, end) range of `ranges`, in order."""
+        result = IndexedWeightsDataset()
+        result.values = np.concatenate(
+            [np.zeros(0, dtype=np.float32)]
+            + [np.asarray(self.values[start:end]) for start, end in ranges]
+        ).astype(np.float32, copy=False)
+        result.size = len(result.values)
+        return result
 
     def __getitem__(self, i):
         self.check_index(i)
-        return self.values[i]
+        return float(self.values[i])
 
     def __del__(self):
         pass
@@ -46,15 +109,6 @@ class WeightedLanguagePairDataset(data.language_pair_dataset.LanguagePairDataset
         super().__init__(src, src_sizes, src_dict, tgt, tgt_sizes, tgt_dict, **kwargs)
         self.weights = weights
 
-    def __getitem__(self, i):
-        example = super().__getitem__(i)
-        if self.weights:
-            example["weight"] = self.weights[i]
-        else:
-            example["weight"] = 1.0
-
-        return example
-
     def __len__(self):
         return super().__len__()
 
@@ -62,10 +116,7 @@ class WeightedLanguagePairDataset(data.language_pair_dataset.LanguagePairDataset
         if len(samples) == 0:
             return {}
         unweighted_data = super().collater(samples)
-        original_weights = torch.FloatTensor([s.get("weight", 1.0) for s in samples])
-        # sort by descending source length
-        src_lengths = torch.LongTensor([s["source"].numel() for s in samples])
-        src_lengths, sort_order = src_lengths.sort(descending=True)
-        weights = original_weights.index_select(0, sort_order)
-        unweighted_data["weights"] = weights
+        # The batch is already sorted by descending source length, so the
+        # weights are gathered in the order of its ids.
+        unweighted_data["weights"] = gather_weights(self.weights, unweighted_data["id"])
         return unweighted_data
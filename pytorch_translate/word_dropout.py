@@ -1,6 +1,6 @@
 import logging
-import random
 
+import torch
 import torch.nn as nn
 
 
@@ -51,27 +51,40 @@ def set_arg_defaults(args):
         delattr(args, "word_dropout_smoothing_alpha")
 
 
+def make_drop_probs(src_dict, word_dropout_freq_threshold, alpha):
+    """Returns a FloatTensor with the probability alpha / (freq + alpha) of
+    replacing each word of the vocabulary by UNK, for words seen at most
+    word_dropout_freq_threshold times. Special symbols are never dropped."""
+    counts = torch.tensor(src_dict.count, dtype=torch.float)
+    drop_probs = float(alpha) / (counts + alpha)
+    drop_probs[counts > word_dropout_freq_threshold] = 0.0
+    drop_probs[: src_dict.nspecial] = 0.0
+    return drop_probs
+
+
 class WordDropout(nn.Module):
     def __init__(self, src_dict, word_dropout_params):
         super().__init__()
         self.src_dict = src_dict
         self.word_dropout_params = word_dropout_params
+        # Not a registered buffer, so that it is not saved in checkpoints.
+        self.drop_probs = make_drop_probs(
+            src_dict,
+            word_dropout_params["word_dropout_freq_threshold"],
+            word_dropout_params["word_dropout_smoothing_alpha"],
+        )
 
     def forward(self, source_seq):
-        for i in range(len(source_seq)):  # source_seq is a list of token ids
-            for j in range(len(source_seq[i])):
-                source_seq[i][j] = self.apply_probabilistic_unking(source_seq[i][j])
-        return source_seq
+        """Replaces tokens of the LongTensor source_seq by UNK with the
+        probability of their word, drawn with the torch RNG on the device of
+        source_seq (so that runs are reproducible with the same seed)."""
+        if self.drop_probs.device != source_seq.device:
+            self.drop_probs = self.drop_probs.to(source_seq.device)
+        probs = self.drop_probs[source_seq]
+        mask = torch.rand_like(probs) < probs
+        return source_seq.masked_fill(mask, self.src_dict.unk_index)
 
     def apply_probabilistic_unking(self, token_id):
-        word_dropout_freq_threshold = self.word_dropout_params[
-            "word_dropout_freq_threshold"
-        ]
-        alpha = self.word_dropout_params["word_dropout_smoothing_alpha"]
-        if token_id >= self.src_dict.nspecial:
-            freq = self.src_dict.count[token_id]
-            if freq <= word_dropout_freq_threshold and random.random() < float(
-                alpha
-            ) / (freq + alpha):
-                return self.src_dict.unk_index
+        if torch.rand(1).item() < float(self.drop_probs[token_id]):
+            return self.src_dict.unk_index
         return token_id